@@ -1,17 +1,23 @@
 import streamlit as st
-import google.generativeai as genai
 import datetime
-import time
-from flatlib.datetime import Datetime
-from flatlib.geopos import GeoPos
-from flatlib.chart import Chart
-from flatlib import const
-from flatlib import aspects
+import sys
+import uuid
+from icons import icon_bytes
+from ai_reading import (
+    GENERATION_CONFIG, PROMPT_MODES, TARGET_MODEL,
+    build_prompt, estimate_tokens, model_id, prompt_version, use_fake_model,
+)
+from metrics import REGISTRY, count, enabled as metrics_enabled, span, start_trace
+from gemini_pool import CLIENT_POOL
+from rate_limit import GEMINI_GATE
+from reading_cache import ReadingCache, reading_key
+from reading_jobs import DONE, FAILED, QUEUED, READING_JOBS, JobLimitError, reading_task
+from timezones import DEFAULT_TZ_NAME, available_zones, utc_offset
 
 # ==========================================
 # 1. アプリ設定
 # ==========================================
-st.set_page_config(page_title="AI古典占星術鑑定", layout="wide", page_icon="my_icon.png")
+st.set_page_config(page_title="AI古典占星術鑑定", layout="wide", page_icon=icon_bytes('favicon'))
 
 # --- サイドバーAPI設定 ---
 with st.sidebar:
@@ -24,163 +30,13 @@ with st.sidebar:
     except: pass
     if not api_key:
         api_key = st.text_input("Gemini APIキー", type="password")
-    if api_key:
-        try:
-            genai.configure(api_key=api_key)
-        except Exception as e:
-            st.error(f"キー設定エラー: {e}")
+    debug = st.toggle("🛠 処理時間を表示（デバッグ）", value=metrics_enabled(), help="計算・AI鑑定の段階ごとの所要時間を表示します")
 
 # ==========================================
-# 2. 定義データ
-# ==========================================
-JP_NAMES = {
-    'Sun': '太陽', 'Moon': '月', 'Mercury': '水星', 'Venus': '金星', 
-    'Mars': '火星', 'Jupiter': '木星', 'Saturn': '土星', 
-    'Uranus': '天王星', 'Neptune': '海王星', 'Pluto': '冥王星',
-    'North Node': 'ノースノード', 'South Node': 'サウスノード',
-    'Part of Fortune': 'パート・オブ・フォーチュン(POF)', 
-    'Aries': '牡羊座', 'Taurus': '牡牛座', 'Gemini': '双子座',
-    'Cancer': '蟹座', 'Leo': '獅子座', 'Virgo': '乙女座',
-    'Libra': '天秤座', 'Scorpio': '蠍座', 'Sagittarius': '射手座',
-    'Capricorn': '山羊座', 'Aquarius': '水瓶座', 'Pisces': '魚座',
-    'Asc': 'ASC', 'MC': 'MC' # アスペクト表示用に補完
-}
-SIGN_LIST = ['Aries', 'Taurus', 'Gemini', 'Cancer', 'Leo', 'Virgo', 'Libra', 'Scorpio', 'Sagittarius', 'Capricorn', 'Aquarius', 'Pisces']
-
-RULERS = {'Aries': 'Mars', 'Taurus': 'Venus', 'Gemini': 'Mercury', 'Cancer': 'Moon', 'Leo': 'Sun', 'Virgo': 'Mercury', 'Libra': 'Venus', 'Scorpio': 'Mars', 'Sagittarius': 'Jupiter', 'Capricorn': 'Saturn', 'Aquarius': 'Saturn', 'Pisces': 'Jupiter'}
-EXALTATIONS = {'Aries': 'Sun', 'Taurus': 'Moon', 'Cancer': 'Jupiter', 'Virgo': 'Mercury', 'Libra': 'Saturn', 'Capricorn': 'Mars', 'Pisces': 'Venus'}
-DETRIMENTS = {'Aries': 'Venus', 'Taurus': 'Mars', 'Gemini': 'Jupiter', 'Cancer': 'Saturn', 'Leo': 'Saturn', 'Virgo': 'Jupiter', 'Libra': 'Mars', 'Scorpio': 'Venus', 'Sagittarius': 'Mercury', 'Capricorn': 'Moon', 'Aquarius': 'Sun', 'Pisces': 'Mercury'}
-FALLS = {'Aries': 'Saturn', 'Taurus': 'BlackMoon', 'Gemini': 'None', 'Cancer': 'Mars', 'Leo': 'None', 'Virgo': 'Venus', 'Libra': 'Sun', 'Scorpio': 'Moon', 'Sagittarius': 'None', 'Capricorn': 'Jupiter', 'Aquarius': 'None', 'Pisces': 'Mercury'}
-
-EGYPTIAN_TERMS = {
-    'Aries': [(6, 'Jupiter'), (12, 'Venus'), (20, 'Mercury'), (25, 'Mars'), (30, 'Saturn')],
-    'Taurus': [(8, 'Venus'), (14, 'Mercury'), (22, 'Jupiter'), (27, 'Saturn'), (30, 'Mars')],
-    'Gemini': [(6, 'Mercury'), (12, 'Jupiter'), (17, 'Venus'), (24, 'Mars'), (30, 'Saturn')],
-    'Cancer': [(7, 'Mars'), (13, 'Venus'), (19, 'Mercury'), (26, 'Jupiter'), (30, 'Saturn')],
-    'Leo': [(6, 'Jupiter'), (11, 'Venus'), (18, 'Saturn'), (24, 'Mercury'), (30, 'Mars')],
-    'Virgo': [(7, 'Mercury'), (17, 'Venus'), (21, 'Jupiter'), (28, 'Mars'), (30, 'Saturn')],
-    'Libra': [(6, 'Saturn'), (14, 'Mercury'), (21, 'Jupiter'), (28, 'Venus'), (30, 'Mars')],
-    'Scorpio': [(7, 'Mars'), (11, 'Venus'), (19, 'Mercury'), (24, 'Jupiter'), (30, 'Saturn')],
-    'Sagittarius': [(12, 'Jupiter'), (17, 'Venus'), (21, 'Mercury'), (26, 'Saturn'), (30, 'Mars')],
-    'Capricorn': [(7, 'Mercury'), (14, 'Jupiter'), (22, 'Venus'), (26, 'Saturn'), (30, 'Mars')],
-    'Aquarius': [(7, 'Mercury'), (13, 'Venus'), (20, 'Jupiter'), (25, 'Mars'), (30, 'Saturn')],
-    'Pisces': [(12, 'Venus'), (16, 'Jupiter'), (19, 'Mercury'), (28, 'Mars'), (30, 'Saturn')]
-}
-FACES = {'Aries': ['Mars', 'Sun', 'Venus'], 'Taurus': ['Mercury', 'Moon', 'Saturn'], 'Gemini': ['Jupiter', 'Mars', 'Sun'], 'Cancer': ['Venus', 'Mercury', 'Moon'], 'Leo': ['Saturn', 'Jupiter', 'Mars'], 'Virgo': ['Sun', 'Venus', 'Mercury'], 'Libra': ['Moon', 'Saturn', 'Jupiter'], 'Scorpio': ['Mars', 'Sun', 'Venus'], 'Sagittarius': ['Mercury', 'Moon', 'Saturn'], 'Capricorn': ['Jupiter', 'Mars', 'Sun'], 'Aquarius': ['Venus', 'Mercury', 'Moon'], 'Pisces': ['Saturn', 'Jupiter', 'Mars']}
-SIGN_ELEMENTS = {'Aries': 'Fire', 'Leo': 'Fire', 'Sagittarius': 'Fire', 'Taurus': 'Earth', 'Virgo': 'Earth', 'Capricorn': 'Earth', 'Gemini': 'Air', 'Libra': 'Air', 'Aquarius': 'Air', 'Cancer': 'Water', 'Scorpio': 'Water', 'Pisces': 'Water'}
-DOROTHEUS_TRIPLICITY = {'Fire': {'Day': ['Sun', 'Jupiter', 'Saturn'], 'Night': ['Jupiter', 'Sun', 'Saturn']}, 'Earth': {'Day': ['Venus', 'Moon', 'Mars'], 'Night': ['Moon', 'Venus', 'Mars']}, 'Air': {'Day': ['Saturn', 'Mercury', 'Jupiter'], 'Night': ['Mercury', 'Saturn', 'Jupiter']}, 'Water': {'Day': ['Venus', 'Mars', 'Moon'], 'Night': ['Mars', 'Venus', 'Moon']}}
-HOUSE_THEMES = ["本人・生命力", "金運・所有", "兄弟・通信", "家庭・晩年", "創造・恋愛・子供", "健康・労働", "結婚・対人", "遺産・死", "哲学・旅行", "天職・社会", "友人・希望", "秘密・障害"]
-SIGN_OFFSETS = {'Aries': 0, 'Taurus': 30, 'Gemini': 60, 'Cancer': 90, 'Leo': 120, 'Virgo': 150, 'Libra': 180, 'Scorpio': 210, 'Sagittarius': 240, 'Capricorn': 270, 'Aquarius': 300, 'Pisces': 330}
-
-# ==========================================
-# 3. 計算用関数
-# ==========================================
-def get_egyptian_term(sign, degree):
-    terms = EGYPTIAN_TERMS.get(sign, [])
-    for limit, planet in terms:
-        if degree < limit: return planet
-    return terms[-1][1]
-
-def get_face(sign, degree):
-    idx = int(degree // 10)
-    if idx > 2: idx = 2
-    return FACES.get(sign, [])[idx]
-
-def get_dorotheus_trip(sign, is_day):
-    element = SIGN_ELEMENTS.get(sign)
-    if not element: return []
-    key = 'Day' if is_day else 'Night'
-    return DOROTHEUS_TRIPLICITY[element][key]
-
-def calculate_dignity_score(planet, sign, degree, is_day):
-    score = 0
-    details = []
-    if RULERS.get(sign) == planet: score += 5; details.append("Ruler(+5)")
-    if EXALTATIONS.get(sign) == planet: score += 4; details.append("Exalt(+4)")
-    trip_rulers = get_dorotheus_trip(sign, is_day)
-    if planet in trip_rulers: score += 3; details.append("Trip(+3)")
-    if get_egyptian_term(sign, degree) == planet: score += 2; details.append("Term(+2)")
-    if get_face(sign, degree) == planet: score += 1; details.append("Face(+1)")
-    if DETRIMENTS.get(sign) == planet: score -= 5; details.append("Detriment(-5)")
-    if FALLS.get(sign) == planet: score -= 4; details.append("Fall(-4)")
-    has_dignity = any(x in ["Ruler(+5)", "Exalt(+4)", "Trip(+3)", "Term(+2)", "Face(+1)"] for x in details)
-    if not has_dignity: score -= 5; details.append("Peregrine(-5)")
-    
-    return score, ", ".join(details)
-
-def format_360(sign_en, d, m):
-    base = SIGN_OFFSETS.get(sign_en, 0)
-    return f"{base + d}度{m:02}分"
-
-def get_planet_sect_status(planet_id, is_day_chart):
-    diurnal_team = ['Sun', 'Jupiter', 'Saturn']
-    nocturnal_team = ['Moon', 'Venus', 'Mars']
-    
-    status = ""
-    if is_day_chart:
-        if planet_id in diurnal_team: status = "In Sect(吉)"
-        elif planet_id in nocturnal_team: status = "Out of Sect(凶)"
-        else: status = "Neutral"
-    else:
-        if planet_id in nocturnal_team: status = "In Sect(吉)"
-        elif planet_id in diurnal_team: status = "Out of Sect(凶)"
-        else: status = "Neutral"
-    return status
-def get_selena_data(target_date, target_time, asc_sign_idx):
-    import math
-    
-    # 1. UTC（世界標準時）への変換
-    # 日本時間(JST)から9時間を引いて計算基準を合わせます
-    dt_jst = datetime.datetime.combine(target_date, target_time)
-    dt_utc = dt_jst - datetime.timedelta(hours=9)
-    
-    # 2. ユリウス日 (JD) の計算
-    # 高精度な天体計算のために日付を数値化します
-    y, m, d = dt_utc.year, dt_utc.month, dt_utc.day
-    h, mn, s = dt_utc.hour, dt_utc.minute, dt_utc.second
-    
-    if m <= 2:
-        y -= 1
-        m += 12
-    a = y // 100
-    b = 2 - a + (a // 4)
-    day_frac = (h + mn / 60.0 + s / 3600.0) / 24.0
-    jd = math.floor(365.25 * (y + 4716)) + math.floor(30.6001 * (m + 1)) + d + day_frac + b - 1524.5
-
-    # 3. ホワイトムーン（セレナ）の定数
-    # 周期: 7年（2556.75日）
-    # 基準位置: 1900/1/1 12:00 UTC (JD 2415020.5) において 138.6380556度
-    initial_lon = 139.2700
-    daily_motion = 360.0 / 2556.75
-    
-    # 経過日数から現在の黄経（0-360度）を算出
-    selena_lon = (initial_lon + (jd - 2415020.5) * daily_motion) % 360
-    
-    # 4. サイン・度・分の抽出
-    s_sign_idx = int(selena_lon // 30)   # 0=牡羊座, 1=牡牛座...
-    s_deg_total = selena_lon % 30
-    s_deg = int(s_deg_total)
-    s_min = int((s_deg_total - s_deg) * 60 + 0.5) # 四捨五入
-    
-    # 繰り上げ処理
-    if s_min >= 60:
-        s_min = 0
-        s_deg += 1
-    if s_deg >= 30:
-        s_deg = 0
-        s_sign_idx = (s_sign_idx + 1) % 12
-    
-    # 5. ハウス計算 (ホールサインハウス)
-    # ASCのサインを1ハウスとして、セレナが何番目のハウスかを計算
-    s_house = (s_sign_idx - asc_sign_idx) % 12 + 1
-    
-    return SIGN_LIST[s_sign_idx], s_deg, s_min, s_house, selena_lon
-    
-# ==========================================
-# 4. メイン画面
+# 2. メイン画面
 # ==========================================
 col_icon, col_title = st.columns([2, 10])
-with col_icon: st.image("my_icon.png", width=100)
+with col_icon: st.image(icon_bytes('header'), width=100)
 with col_title: st.title("AI古典占星術 鑑定システム")
 
 with st.sidebar:
@@ -198,144 +54,241 @@ with st.sidebar:
     )
     input_time = st.time_input("出生時間", datetime.time(9, 22), step=60)
     st.header("3. 場所設定")
-    input_lat = st.text_input("緯度", "36.6953")
-    input_lon = st.text_input("経度", "137.2113")
+
+    # 地名検索の結果を緯度・経度・タイムゾーンの欄へ書き込めるよう、値は session_state で持つ
+    # （prefix ごとに別のキー。相性鑑定の相手の出生地にも同じ部品を使う）
+    def apply_place(prefix):
+        place = st.session_state.get(f'{prefix}_place')
+        if place is not None:
+            st.session_state[f'{prefix}_lat'] = f"{place.lat:.4f}"
+            st.session_state[f'{prefix}_lon'] = f"{place.lon:.4f}"
+            st.session_state[f'{prefix}_tz'] = place.tz
+            # 地点から決めたタイムゾーンは、あとで緯度経度を直したときに合わせ直してよい
+            st.session_state[f'{prefix}_tz_manual'] = False
+            st.session_state[f'{prefix}_tz_note'] = None
+
+    def mark_tz_manual(prefix):
+        # 自分で選んだタイムゾーンは、緯度経度を直しても書き換えない
+        st.session_state[f'{prefix}_tz_manual'] = True
+        st.session_state[f'{prefix}_tz_note'] = None
+
+    def apply_coords(prefix):
+        # 緯度経度を手入力したら、近くの登録地点のタイムゾーンに合わせる
+        # （タイムゾーンを自分で選んだあとや、近くに登録地点がないときは変えずに注意だけ出す）
+        try:
+            from gazetteer import TZ_MAX_KM, get_gazetteer
+            tz = get_gazetteer().timezone_at(st.session_state[f'{prefix}_lat'], st.session_state[f'{prefix}_lon'])
+        except ValueError:
+            return
+        current = st.session_state[f'{prefix}_tz']
+        note = None
+        if tz is None:
+            note = f"{TZ_MAX_KM:.0f}km 以内に登録地点がないため、タイムゾーンは {current} のままです。出生地のタイムゾーンを選んでください。"
+        elif st.session_state.get(f'{prefix}_tz_manual'):
+            if tz != current:
+                note = f"選んだタイムゾーン {current} のままです（近くの登録地点は {tz}）。"
+        else:
+            st.session_state[f'{prefix}_tz'] = tz
+        st.session_state[f'{prefix}_tz_note'] = note
+
+    def place_inputs(prefix, lat, lon, birth_date, birth_time):
+        """出生地の入力欄。(緯度, 経度, UTC オフセット) を返す。"""
+        st.session_state.setdefault(f'{prefix}_lat', lat)
+        st.session_state.setdefault(f'{prefix}_lon', lon)
+        st.session_state.setdefault(f'{prefix}_tz', DEFAULT_TZ_NAME)
+        place_query = st.text_input("出生地を検索", placeholder="例: 富山、Toyama、ロンドン", key=f'{prefix}_query')
+        if place_query:
+            # 地名の索引（numpy）は検索したときに初めて読み込む
+            from gazetteer import get_gazetteer
+            places = get_gazetteer().search(place_query)
+            if places:
+                st.selectbox("候補", places, index=None, format_func=lambda p: p.label(), key=f'{prefix}_place',
+                             on_change=apply_place, args=(prefix,))
+            else:
+                st.caption("見つかりませんでした。緯度・経度を直接入力してください。")
+        lat = st.text_input("緯度", key=f'{prefix}_lat', on_change=apply_coords, args=(prefix,))
+        lon = st.text_input("経度", key=f'{prefix}_lon', on_change=apply_coords, args=(prefix,))
+        tz_name = st.selectbox("タイムゾーン", available_zones(), key=f'{prefix}_tz', on_change=mark_tz_manual, args=(prefix,))
+        if st.session_state.get(f'{prefix}_tz_note'):
+            st.caption(f"⚠️ {st.session_state[f'{prefix}_tz_note']}")
+        offset = utc_offset(tz_name, birth_date, birth_time)
+        st.caption(f"出生時の UTC オフセット: {offset}（夏時間・当時の標準時を反映）")
+        return lat, lon, offset
+
+    input_lat, input_lon, tz_offset = place_inputs('input', "36.6953", "137.2113", input_date, input_time)
+
+    st.markdown("---")
+    st.header("4. 相性鑑定（任意）")
+    synastry_mode = st.toggle("相手のデータも入力する", help="2人のチャートを比べる相性鑑定（シナストリー・コンポジット）になります")
+    if synastry_mode:
+        partner_name = st.text_input("相手のお名前", "パートナー")
+        partner_date = st.date_input("相手の生年月日", value=datetime.date(1980, 1, 1),
+                                     min_value=datetime.date(1900, 1, 1), max_value=datetime.date.today())
+        partner_time = st.time_input("相手の出生時間", datetime.time(12, 0), step=60)
+        partner_lat, partner_lon, partner_tz = place_inputs('partner', "35.6895", "139.6917", partner_date, partner_time)
     st.markdown("---")
     calc_btn = st.button("① チャート計算を実行", type="primary")
 
 if 'result_txt' not in st.session_state:
     st.session_state['result_txt'] = ""
+if 'traces' not in st.session_state:
+    st.session_state['traces'] = {}
 
 # ==========================================
-# 5. 計算実行
+# 3. 計算実行
 # ==========================================
 if calc_btn:
     try:
-        date_str = input_date.strftime("%Y/%m/%d")
-        time_str = input_time.strftime("%H:%M")
-        date = Datetime(date_str, time_str, '+09:00')
-        pos = GeoPos(float(input_lat), float(input_lon))
-        
-        # ★ホワイトムーン計算用の標準Python時刻オブジェクトを作成
-        py_dt = datetime.datetime.combine(input_date, input_time)
-        
-        all_p = [const.SUN, const.MOON, const.MERCURY, const.VENUS, const.MARS, const.JUPITER, const.SATURN, const.URANUS, const.NEPTUNE, const.PLUTO, const.NORTH_NODE]
-        trad_p = [const.SUN, const.MOON, const.MERCURY, const.VENUS, const.MARS, const.JUPITER, const.SATURN]
-
-        chart_whole = Chart(date, pos, hsys=const.HOUSES_WHOLE_SIGN, IDs=all_p)
-        asc_obj = chart_whole.get(const.ASC)
-        mc_obj = chart_whole.get(const.MC)
-        asc_sign_idx = SIGN_LIST.index(asc_obj.sign)
-
-        sun_obj = chart_whole.get(const.SUN)
-        sun_sign_idx = SIGN_LIST.index(sun_obj.sign)
-        sun_house_num = (sun_sign_idx - asc_sign_idx) + 1
-        if sun_house_num <= 0: sun_house_num += 12
-        is_day = (7 <= sun_house_num <= 12)
-        sect_str = "昼チャート (Day)" if is_day else "夜チャート (Night)"
-
-        asc_lon, sun_lon, moon_lon = asc_obj.lon, sun_obj.lon, chart_whole.get(const.MOON).lon
-        if is_day: pof_lon = (asc_lon + moon_lon - sun_lon) % 360
-        else: pof_lon = (asc_lon + sun_lon - moon_lon) % 360
-        pof_sign_idx = int(pof_lon // 30)
-        pof_deg = pof_lon % 30
-        pof_sign = SIGN_LIST[pof_sign_idx]
-        pof_house_num = (pof_sign_idx - asc_sign_idx) + 1
-        if pof_house_num <= 0: pof_house_num += 12
-
-        lines = []
-        def log(t): lines.append(t)
-
-        log(f"【AI鑑定用 詳細データ】")
-        log(f"お名前: {name}") 
-        log(f"生年月日: {date_str} {time_str}\nチャート区分: {sect_str}")
-        log("-" * 60)
-        
-        log("【データ1: 天体位置・アングル】")
-        for p_id in all_p:
-            obj = chart_whole.get(p_id)
-            d, m = int(obj.signlon), int((obj.signlon - int(obj.signlon)) * 60)
-            retro = " (R)" if obj.isRetrograde() else ""
-            
-            obj_sign_idx = SIGN_LIST.index(obj.sign)
-            house_num = (obj_sign_idx - asc_sign_idx) + 1
-            if house_num <= 0: house_num += 12
-            
-            sect_status = get_planet_sect_status(p_id, is_day)
-            sect_info = f" / {sect_status}" if sect_status else ""
-            abs_deg = format_360(obj.sign, d, m)
-
-            host_ruler = RULERS.get(obj.sign)
-            host_exalt = EXALTATIONS.get(obj.sign, "None")
-            exalt_info = f", 高揚支援:{JP_NAMES.get(host_exalt)}" if host_exalt != "None" else ""
-
-            log(f"{JP_NAMES.get(p_id, p_id):<6}: {JP_NAMES.get(obj.sign)} {d:02}度{m:02}分{retro} (第{house_num}ハウス){sect_info} 【360度:{abs_deg}】 / ホスト:{JP_NAMES.get(host_ruler)}{exalt_info}")
-        
-        log(f"{'ASC':<6}: {JP_NAMES.get(asc_obj.sign)} {int(asc_obj.signlon):02}度 (第1ハウス) 【360度:{format_360(asc_obj.sign, int(asc_obj.signlon), 0)}】")
-        
-        mc_sign_idx = SIGN_LIST.index(mc_obj.sign)
-        mc_house_num = (mc_sign_idx - asc_sign_idx) + 1
-        if mc_house_num <= 0: mc_house_num += 12
-        log(f"{'MC':<6}: {JP_NAMES.get(mc_obj.sign)} {int(mc_obj.signlon):02}度 (第{mc_house_num}ハウス) 【360度:{format_360(mc_obj.sign, int(mc_obj.signlon), 0)}】")
-        
-        log(f"{'POF':<6}: {JP_NAMES.get(pof_sign)} {int(pof_deg):02}度 (第{pof_house_num}ハウス)")
-
-        # ★ホワイトムーンデータの生成（py_dt を使用するように修正）
-       # ホワイトムーンデータの生成（日、時、ASCインデックスを渡す）
-        s_sign, s_deg, s_min, s_house, s_lon_abs = get_selena_data(input_date, input_time, asc_sign_idx)
-        log(f"{'ホワイトムーン':<6}: {JP_NAMES[s_sign]} {s_deg:02}度{s_min:02}分 (第{s_house}ハウス) / 宇宙の絶対守護パッチ 【360度:{s_lon_abs:.2f}度】")
-        
-        log("-" * 60)
-
-        log("\n【データ2: ディグニティ(惑星の強さ)】")
-        scores, planet_score_map = [], {}
-        for p_id in trad_p:
-            obj = chart_whole.get(p_id)
-            score, detail = calculate_dignity_score(p_id, obj.sign, obj.signlon, is_day)
-            scores.append({'name': JP_NAMES.get(p_id, p_id), 'sign': JP_NAMES.get(obj.sign), 'deg': int(obj.signlon), 'score': score, 'detail': detail})
-            planet_score_map[p_id] = score
-        
-        scores.sort(key=lambda x: x['score'], reverse=True)
-        for i, s in enumerate(scores, 1):
-            log(f"{i:<2}| {s['name']:<6}| {s['sign'][0]} {s['deg']:02}度 | {s['score']:+d} | {s['detail']}")
-        log("-" * 60)
-
-        log("\n【データ3: ハウス・ストレングス (Whole Sign)】")
-        for i in range(1, 13):
-            h_obj = chart_whole.get(f'House{i}')
-            ruler_en = RULERS.get(h_obj.sign)
-            ruler_score = planet_score_map.get(ruler_en, 0)
-            rank = "S" if ruler_score >= 7 else "A" if ruler_score >= 4 else "B" if ruler_score >= 0 else "C" if ruler_score >= -4 else "D"
-            log(f"House{i:<2}: {HOUSE_THEMES[i-1]:<10} (支配星:{JP_NAMES.get(ruler_en, ruler_en)}) -> {rank}")
-        log("-" * 60)
-        
-        log("\n【■ 主要アスペクト】")
-        asp_names = {const.CONJUNCTION:'(0度)', const.SEXTILE:'(60度)', const.SQUARE:'(90度)', const.TRINE:'(120度)', const.OPPOSITION:'(180度)'}
-        check_list = all_p + [const.ASC, const.MC]
-        for i, id1 in enumerate(check_list):
-            for id2 in check_list[i+1:]:
-                obj1 = chart_whole.get(id1)
-                obj2 = chart_whole.get(id2)
-                asp = aspects.getAspect(obj1, obj2, const.MAJOR_ASPECTS)
-                if asp.exists() and asp.orb <= 5:
-                    idx1 = SIGN_LIST.index(obj1.sign)
-                    h1 = (idx1 - asc_sign_idx) + 1
-                    if h1 <= 0: h1 += 12
-                    idx2 = SIGN_LIST.index(obj2.sign)
-                    h2 = (idx2 - asc_sign_idx) + 1
-                    if h2 <= 0: h2 += 12
-                    name1 = f"{JP_NAMES.get(id1, id1)}（{h1}ハウス）"
-                    name2 = f"{JP_NAMES.get(id2, id2)}（{h2}ハウス）"
-                    asp_str = asp_names.get(asp.type, f"({asp.type})")
-                    log(f"{name1} ｘ {name2} {asp_str}（誤差{asp.orb:.1f}）")
-
-        st.session_state['result_txt'] = "\n".join(lines)
+        with start_trace("calc", debug) as trace:
+            # flatlib / swisseph / numpy は最初の計算のときに読み込む（ページを開くだけなら不要）
+            with span("calc.import"):
+                from chart_engine import build_report
+            if synastry_mode:
+                from synastry import Birth, build_synastry, render_synastry_report
+                # 2人のチャートはそれぞれ1回だけ計算し、比較結果から両方の形式を作る
+                syn = build_synastry(
+                    Birth(name, input_date, input_time, input_lat, input_lon, tz_offset),
+                    Birth(partner_name, partner_date, partner_time, partner_lat, partner_lon, partner_tz),
+                )
+                st.session_state['result_txt'] = render_synastry_report(syn, name, partner_name)
+                st.session_state['result_compact'] = render_synastry_report(syn, name, partner_name, fmt='compact')
+                st.session_state['result_kind'] = 'synastry'
+            else:
+                # 計算本体は chart_engine 側でキャッシュされる（お名前は後から差し込み）
+                st.session_state['result_txt'] = build_report(name, input_date, input_time, input_lat, input_lon, tz=tz_offset)
+                # AI に送るトークン節約用の形式も作っておく（チャート自体はキャッシュ済み）
+                st.session_state['result_compact'] = build_report(name, input_date, input_time, input_lat, input_lon, tz=tz_offset, fmt='compact')
+                st.session_state['result_kind'] = 'natal'
+        if trace: st.session_state['traces']['calc'] = trace.summary()
         st.success("計算完了 (ホワイトムーン実装・データ完全同期済)")
     except Exception as e: st.error(f"エラー: {e}")
 
 # ==========================================
-# 6. AI鑑定実行
+# 4. AI鑑定実行
 # ==========================================
+# 鑑定結果のディスクキャッシュ（プロセス内で1つだけ開いて全セッションで共有）
+@st.cache_resource
+def get_reading_cache():
+    return ReadingCache()
+
+READING_CACHE = get_reading_cache()
+
+# 利用者（セッション）ごとの ID。同時に走らせられる鑑定ジョブ数の上限に使う
+if 'owner_id' not in st.session_state:
+    st.session_state['owner_id'] = uuid.uuid4().hex[:12]
+
+POLL_SECONDS = 0.5          # 鑑定ジョブの途中経過を見に行く間隔
+STATUS_POLL_SECONDS = 5.0   # 鑑定ジョブが走っている間、API呼び出し状況を更新する間隔
+
+
+def current_job():
+    """このセッションの鑑定ジョブ（なければ None）。"""
+    job_id = st.session_state.get('reading_job')
+    job = READING_JOBS.get(job_id) if job_id else None
+    if job is None:
+        st.session_state.pop('reading_job', None)
+    return job
+
+
+def collect_job(job):
+    """終わったジョブの結果をセッションに移す。"""
+    st.session_state.pop('reading_job', None)
+    result = job.result or {}
+    if result.get('trace'): st.session_state['traces']['reading'] = result['trace']
+    notice = None
+    if job.state == DONE and result['text']:
+        stats = result['stats']
+        note = f"⏱ 最初の応答まで {stats.first_token:.1f}秒 / 合計 {stats.total:.1f}秒"
+        st.session_state['reading'] = {'data': job.meta['data'], 'text': result['text'], 'note': note}
+    elif job.state == DONE:
+        notice = ('warning', "⚠️ 応答が空でした")
+    elif job.state == FAILED:
+        count("reading_errors", kind=type(job.error).__name__)
+        notice = ('error', f"❌ 鑑定に失敗しました: {job.error}")
+    else:
+        notice = ('info', "⏹ 鑑定を中止しました")
+    st.session_state['reading_notice'] = notice
+
+
+def reading_panel(api_key, debug):
+    """AI鑑定の操作と結果の表示。フラグメントなので、ここの操作では画面全体を再実行しない。"""
+    use_stream = st.toggle("ストリーミング表示", value=True, help="届いた文章から順に表示します")
+    prompt_mode = st.radio("AIに送る計算データの形式", list(PROMPT_MODES), format_func=PROMPT_MODES.get, horizontal=True)
+    prompt_data = {'full': st.session_state['result_txt'], 'compact': st.session_state.get('result_compact', "")}
+    result_kind = st.session_state.get('result_kind', 'natal')
+    est = {mode: estimate_tokens(build_prompt(data, mode, result_kind)) for mode, data in prompt_data.items() if data}
+    if len(est) == 2:
+        st.caption(f"推定入力トークン: 標準 約{est['full']:,} / コンパクト 約{est['compact']:,}（{est['compact'] / est['full'] - 1:+.0%}）")
+    force_regen = st.checkbox("保存済みの鑑定を使わず再鑑定する")
+
+    job = current_job()
+    if job is not None and job.done:
+        # 終わったら画面全体を1回だけ再実行して、途中経過の定期更新を止める
+        collect_job(job)
+        st.rerun()
+    ask_btn = st.button("✨ 星に聞く✨", type="primary", disabled=job is not None)
+    status_area = st.container()
+    # 鑑定結果の表示場所を先に確保し、ストリーミング中はここを書き換える
+    main_col, empty_col = st.columns([0.8, 0.2])
+    with main_col:
+        result_area = st.empty()
+        timing_area = st.empty()
+
+    def show_result(text):
+        result_area.markdown("### 🔮 鑑定結果\n\n" + text)
+
+    if ask_btn:
+        st.session_state['reading_notice'] = None
+        with start_trace("reading", debug) as trace:
+            result_txt = st.session_state['result_txt']
+            target_model = TARGET_MODEL
+            mode = prompt_mode if prompt_data.get(prompt_mode) else 'full'
+            payload = prompt_data[mode]
+            cache_key = reading_key(payload, prompt_version(mode, result_kind), model_id(target_model), GENERATION_CONFIG)
+            with span("reading.cache_get"):
+                cached_text = None if force_regen else READING_CACHE.get(cache_key)
+        if cached_text is not None:
+            count("reading_cache", result="hit")
+            st.session_state['reading'] = {'data': result_txt, 'text': cached_text, 'note': "💾 保存済みの鑑定結果を表示しています"}
+            if trace: st.session_state['traces']['reading'] = trace.summary()
+        else:
+            count("reading_cache", result="skip" if force_regen else "miss")
+            # Gemini の呼び出しはジョブに任せる（入力を触って画面が再実行されても止まらない）
+            task = reading_task(build_prompt(payload, mode, result_kind), target_model, api_key=api_key,
+                                stream=use_stream, cache=READING_CACHE, cache_key=cache_key,
+                                trace=debug, attrs={'mode': mode, 'est_tokens': est.get(mode)})
+            try:
+                job = READING_JOBS.submit(st.session_state['owner_id'], task, meta={'data': result_txt})
+            except JobLimitError as e:
+                status_area.warning(str(e))
+            else:
+                st.session_state['reading_job'] = job.id
+                st.rerun()
+
+    if job is not None:
+        with status_area:
+            with st.status("💫 星々が運命を巡っています...", expanded=True):
+                for line in job.log:
+                    st.write(line)
+                if job.state == QUEUED:
+                    st.write("⏳ 順番待ちです...")
+            if st.button("⏹ 鑑定を中止"):
+                READING_JOBS.cancel(job.id)
+        if job.text:
+            show_result(job.text)
+        timing_area.caption(f"⏱ 経過 {job.elapsed():.1f}秒" + ("（中止しています...）" if job.cancel_requested else ""))
+        return
+
+    notice = st.session_state.get('reading_notice')
+    if notice:
+        getattr(status_area, notice[0])(notice[1])
+    # 鑑定結果はセッションに残し、他の入力を触っても消えないようにする
+    reading = st.session_state.get('reading')
+    if reading and reading['data'] == st.session_state['result_txt']:
+        show_result(reading['text'])
+        timing_area.caption(reading['note'])
+
+
 if 'result_txt' in st.session_state and st.session_state['result_txt']:
     col1, col2 = st.columns([0.5, 1.5])
     with col1:
@@ -344,198 +297,77 @@ if 'result_txt' in st.session_state and st.session_state['result_txt']:
     
     with col2:
         st.subheader("🤖 AI自動鑑定")
-        if not api_key:
+        if not api_key and not use_fake_model():
             st.info("👈 サイドバーでAPIキーを設定すると、鑑定ボタンが現れます。")
         else:
-            if st.button("✨ 星に聞く✨", type="primary"):
-                result_text = ""
-                success = False
-                target_model = "gemini-3-flash-preview" 
-                
-                with st.status("💫 星々が運命を巡っています...", expanded=True) as status:
-                    max_retries = 3
-                    for attempt in range(max_retries):
-                        try:
-                            if attempt > 0: time.sleep(5 * attempt)
-                            st.write(f"📡 宇宙に接続中... (試行: {attempt + 1}回目)")
-                            
-                            prompt = f"""
-あなたは冷徹かつユーモアのある、銀河系最高峰のメカニック・エンジニアです。
-ユーザーのホロスコープデータを「ある精密機械（ロボット）の仕様書」として読み解き、以下のフォーマットで【仕様書】を作成してください。
-古典占星術の観点で鑑定し、天王星・海王星・冥王星は鑑定に含まない。出力フォーマット### 1.-### 5.には含めないが、【最後に補足】でのみ言及すること。
-
-【エンジニアとしての哲学】
-1. ユーザーを人間扱いせず「本製品」または「本機」と呼ぶこと。
-2. 忖度はゴミ箱に捨てろ。耳当たりの良いアドバイスは不要。
-3. 欠点（デトリメント、フォール、ハードアスペクト）を「修正すべきバグ」として扱うな。それらは本機の個性を形作る「かけがえのない仕様（スペック）」であると断言せよ。
-4. 古典占星術をベースとし、リセプション（ホスト関係）を「パーツ間のバイパス配線」や「電力融通」として解釈に組み込め。
-
- 通信仕様のデバッグ（優先事項）
-データ1の「3ハウス（通信ポート）」と「水星（メインプロセッサ）」の位置関係を精密にスキャンせよ。
-以下の判定基準に基づき、本機の【通信インターフェース仕様】を「不具合」または「基本スペック」の項目内で必ず記述すること。
-3ハウスと水星の在室しているハウスの、アスペクトを次の型で説明する。
-‐ 直結・爆速型（水星が3ハウス）： 水星が3ハウスの場合。
-‐ 高速同期型： 水星が1ハウス・5ハウス・7ハウス・11ハウス。
-‐ 高圧摩擦型： 水星が6ハウス・9ハウス・12ハウス。
-‐ 断絶・非同期型： 水星が4ハウス・8ハウス・10ハウス。
-- ハイスペック型： 水星が2ハウス。
-断絶型の場合は、本機にとって「コミュニケーション」が非効率であり、水星が支配星のハウスやアスペクトがある強いハウスを経由して出力することが正解であることを、エンジニアの視点で強くアドバイスせよ。
-水星が土星又は火星とハードアスペクトがある場合は記述する。
-
-【★最重要：翻訳ルール】
-占星術用語を以下のメカニック用語に変換せよ。文末の（カッコ書き）に根拠を残すこと。
-ただし、**占星術的な意味（根拠）は文末に（カッコ書き）で残してください。**
-- 才能・資質 → 「実装機能」「スペック」
-- 欠点・悩み・弱み → 「バグ」「不具合」「システムエラー」
-- 運気・開運 → 「稼働状況」「メンテナンス」
-- リセプション（受容） → 「ブリッジ接続」「外部出力支援」
-- ミューチュアル・リセプション → 「双方向データリンク」「永久機関的ループ回路」
-
-【文章の例】
-× 「水星が牡羊座にあるため、思考が早いです」
-○ 「演算処理速度は極めて高速で、即断即決に特化した仕様（水星・牡羊座）。」
-
-【文章構成ルール】
-- 語尾は「〜である」「〜だ」の大言止め。
-- 各項目250文字程度。
-- 【オーナー様へのお願い】は、全編太字（**テキスト**）で記述。
-
-【出力フォーマット】
---------------------------------------------------
-## 🤖 製品名：(相談者名)型 汎用人型決戦兵器（試作機）
-**製造年月日：** 19☆☆年☆月☆☆日
-**製造元：** 宇宙・太陽系・地球工場
-
-### 1. 【製品概要】（太陽・月・ASCから本機の基本設計を分析。矛盾やエゴを隠さず暴け）
-### 2. 【基本スペック】（ディグニティの高い天体、強いハウス、知能モジュールを分析。他機を圧倒する異能を強調せよ）
-### 3. 【既知の不具合・バグ】（弱点やハードアスペクトを分析。ただし、それらが「本機を本機たらしめている唯一無二の仕様」であることを強調。リセプションによる強引なバイパス接続についても言及せよ）
-### 4. 【メンテナンス方法】（木星・POFを活用した冷却・再起動方法）
-### 5. 【エンジニアからの総評】（本機の歪な美学を讃えろ。正常になろうとすることを否定せよ）
-### 【最後に補足】（天王星・海王星・冥王星の影響を「外部プラグイン」として記述）
-【オーナー様へのお願い】（※全編太字。このバグを削除しようとするオーナーへの警告として、バーコードされた独自仕様の乗りこなし方をプロフェッショナルな忠告として書くこと。）
---------------------------------------------------
-
-【計算データ】
-{st.session_state['result_txt']}
-"""
-# ★設定を追加！（ここから）
-                            generation_config = {
-                                "temperature": 0.2,  # 0.2で真面目にさせる
-                                "top_p": 0.95,
-                                "top_k": 64,
-                                "max_output_tokens": 8192,
-                            }
-                            
-                            model = genai.GenerativeModel(
-                                model_name=target_model,
-                                generation_config=generation_config # 設定を反映
-                            )
-                            # ★設定を追加！（ここまで）
-                            
-                            response = model.generate_content(prompt)
-                            if response.text:
-                                result_text = response.text
-                                status.update(label="✅ 鑑定完了", state="complete", expanded=False)
-                                success = True
-                                break 
-                        except Exception as e:
-                            st.error(f"エラー: {e}"); break
-                if result_text:
-                    main_col, empty_col = st.columns([0.8, 0.2])
-                    with main_col:
-                        st.markdown("### 🔮 鑑定結果")
-                        st.markdown(result_text)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+            # 鑑定中だけ途中経過を定期的に取りに行く
+            st.fragment(reading_panel, run_every=POLL_SECONDS if current_job() else None)(api_key, debug)
 
+# ==========================================
+# 5. 出生時刻の絞り込み（時刻スキャン）
+# ==========================================
+with st.expander("🕰 出生時刻がわからないとき（時刻スキャン）"):
+    st.caption("生年月日と場所はそのままで、時間帯をなめて ASC・MC・ハウス・POF・昼夜・ディグニティ順位が切り替わる時刻を調べます。")
+    c1, c2, c3 = st.columns(3)
+    scan_start = c1.time_input("開始", datetime.time(0, 0), step=60)
+    scan_end = c2.time_input("終了", datetime.time(23, 59), step=60)
+    scan_step = c3.number_input("間隔（分）", min_value=1, max_value=60, value=1)
+    if st.button("時刻スキャンを実行"):
+        if scan_end <= scan_start:
+            st.error("終了は開始より後の時刻にしてください。")
+        else:
+            try:
+                with start_trace("rectify", debug) as trace:
+                    import rectify
+                    scan_stats = {}
+                    with span("rectify.scan"):
+                        segments, boundaries = rectify.scan(input_date, input_lat, input_lon, tz=st.session_state['input_tz'],
+                                                            start=scan_start, end=scan_end,
+                                                            step_minutes=scan_step, stats=scan_stats)
+                if trace: st.session_state['traces']['rectify'] = trace.summary()
+                st.session_state['rectify'] = {
+                    'rows': rectify.segment_rows(segments),
+                    'changes': [rectify.describe_boundary(b) for b in boundaries],
+                    'note': f"{len(segments)}区間 / 天体の暦計算 {scan_stats['ephemeris_calls']}回・アングル計算 {scan_stats['angle_calls']}回",
+                }
+            except Exception as e: st.error(f"エラー: {e}")
+    scan_result = st.session_state.get('rectify')
+    if scan_result:
+        st.caption(scan_result['note'])
+        st.dataframe(scan_result['rows'], hide_index=True)
+        st.text_area("切り替わり", "\n".join(scan_result['changes']), height=200)
+
+# --- API呼び出し状況（再試行・スロットル・順番待ち） ---
+def api_status_panel():
+    # フラグメントなので「更新」では画面全体を再実行しない
+    with st.expander("📊 API呼び出し状況"):
+        st.button("🔄 更新", key="api_status_refresh")
+        st.json(GEMINI_GATE.stats())
+        st.caption("鑑定ジョブ（バックグラウンド実行）")
+        st.json(READING_JOBS.stats())
+        st.caption("クライアントプール（APIキーごと）")
+        st.json(CLIENT_POOL.stats())
+        st.caption("チャートのキャッシュ（計算結果の使い回し）")
+        # chart_engine は最初の計算のときに読み込むので、まだなら読み込まずに済ませる
+        chart_engine = sys.modules.get('chart_engine')
+        if chart_engine is not None:
+            st.json(chart_engine.CHART_CACHE.stats())
+        else:
+            st.caption("まだチャートを計算していません。")
 
 
+with st.sidebar:
+    st.fragment(api_status_panel, run_every=STATUS_POLL_SECONDS if READING_JOBS.active() else None)()
+
+# --- 処理時間（デバッグ表示） ---
+if debug:
+    with st.sidebar:
+        with st.expander("🛠 処理時間", expanded=True):
+            labels = {'calc': "チャート計算", 'reading': "AI鑑定", 'rectify': "時刻スキャン"}
+            for key, trace in st.session_state['traces'].items():
+                st.caption(f"{labels.get(key, key)}（全体 {trace['ms']:.1f} ms）")
+                st.dataframe(trace['rows'], hide_index=True)
+            if not st.session_state['traces']:
+                st.caption("計算や鑑定を実行すると、ここに段階ごとの時間が出ます。")
+            if metrics_enabled():
+                st.download_button("Prometheus 形式で保存", REGISTRY.prometheus_text(), file_name="ai_kantei_metrics.prom", mime="text/plain")
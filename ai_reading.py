@@ -0,0 +1,316 @@
+"""
+AI鑑定の呼び出し部分
+
+Gemini へのリクエストと、応答をストリーミングで受け取りながら画面に流す処理。
+Streamlit には依存せず、表示はコールバック（on_chunk）で受け取る。
+ネットワークなしで確認できるよう、同じインターフェースの偽モデルも用意している。
+"""
+import os
+import time
+from dataclasses import dataclass
+
+from gemini_pool import CLIENT_POOL
+
+TARGET_MODEL = "gemini-3-flash-preview"
+GENERATION_CONFIG = {
+    "temperature": 0.2,  # 0.2で真面目にさせる
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+}
+
+# プロンプトの版。文面を変えたら上げる（鑑定結果キャッシュのキーに含まれる）
+PROMPT_VERSION = "v1"
+PROMPT_TEMPLATE = """
+あなたは冷徹かつユーモアのある、銀河系最高峰のメカニック・エンジニアです。
+ユーザーのホロスコープデータを「ある精密機械（ロボット）の仕様書」として読み解き、以下のフォーマットで【仕様書】を作成してください。
+古典占星術の観点で鑑定し、天王星・海王星・冥王星は鑑定に含まない。出力フォーマット### 1.-### 5.には含めないが、【最後に補足】でのみ言及すること。
+
+【エンジニアとしての哲学】
+1. ユーザーを人間扱いせず「本製品」または「本機」と呼ぶこと。
+2. 忖度はゴミ箱に捨てろ。耳当たりの良いアドバイスは不要。
+3. 欠点（デトリメント、フォール、ハードアスペクト）を「修正すべきバグ」として扱うな。それらは本機の個性を形作る「かけがえのない仕様（スペック）」であると断言せよ。
+4. 古典占星術をベースとし、リセプション（ホスト関係）を「パーツ間のバイパス配線」や「電力融通」として解釈に組み込め。
+
+ 通信仕様のデバッグ（優先事項）
+データ1の「3ハウス（通信ポート）」と「水星（メインプロセッサ）」の位置関係を精密にスキャンせよ。
+以下の判定基準に基づき、本機の【通信インターフェース仕様】を「不具合」または「基本スペック」の項目内で必ず記述すること。
+3ハウスと水星の在室しているハウスの、アスペクトを次の型で説明する。
+‐ 直結・爆速型（水星が3ハウス）： 水星が3ハウスの場合。
+‐ 高速同期型： 水星が1ハウス・5ハウス・7ハウス・11ハウス。
+‐ 高圧摩擦型： 水星が6ハウス・9ハウス・12ハウス。
+‐ 断絶・非同期型： 水星が4ハウス・8ハウス・10ハウス。
+- ハイスペック型： 水星が2ハウス。
+断絶型の場合は、本機にとって「コミュニケーション」が非効率であり、水星が支配星のハウスやアスペクトがある強いハウスを経由して出力することが正解であることを、エンジニアの視点で強くアドバイスせよ。
+水星が土星又は火星とハードアスペクトがある場合は記述する。
+
+【★最重要：翻訳ルール】
+占星術用語を以下のメカニック用語に変換せよ。文末の（カッコ書き）に根拠を残すこと。
+ただし、**占星術的な意味（根拠）は文末に（カッコ書き）で残してください。**
+- 才能・資質 → 「実装機能」「スペック」
+- 欠点・悩み・弱み → 「バグ」「不具合」「システムエラー」
+- 運気・開運 → 「稼働状況」「メンテナンス」
+- リセプション（受容） → 「ブリッジ接続」「外部出力支援」
+- ミューチュアル・リセプション → 「双方向データリンク」「永久機関的ループ回路」
+
+【文章の例】
+× 「水星が牡羊座にあるため、思考が早いです」
+○ 「演算処理速度は極めて高速で、即断即決に特化した仕様（水星・牡羊座）。」
+
+【文章構成ルール】
+- 語尾は「〜である」「〜だ」の大言止め。
+- 各項目250文字程度。
+- 【オーナー様へのお願い】は、全編太字（**テキスト**）で記述。
+
+【出力フォーマット】
+--------------------------------------------------
+## 🤖 製品名：(相談者名)型 汎用人型決戦兵器（試作機）
+**製造年月日：** 19☆☆年☆月☆☆日
+**製造元：** 宇宙・太陽系・地球工場
+
+### 1. 【製品概要】（太陽・月・ASCから本機の基本設計を分析。矛盾やエゴを隠さず暴け）
+### 2. 【基本スペック】（ディグニティの高い天体、強いハウス、知能モジュールを分析。他機を圧倒する異能を強調せよ）
+### 3. 【既知の不具合・バグ】（弱点やハードアスペクトを分析。ただし、それらが「本機を本機たらしめている唯一無二の仕様」であることを強調。リセプションによる強引なバイパス接続についても言及せよ）
+### 4. 【メンテナンス方法】（木星・POFを活用した冷却・再起動方法）
+### 5. 【エンジニアからの総評】（本機の歪な美学を讃えろ。正常になろうとすることを否定せよ）
+### 【最後に補足】（天王星・海王星・冥王星の影響を「外部プラグイン」として記述）
+【オーナー様へのお願い】（※全編太字。このバグを削除しようとするオーナーへの警告として、バーコードされた独自仕様の乗りこなし方をプロフェッショナルな忠告として書くこと。）
+--------------------------------------------------
+
+【計算データ】
+{result_txt}
+"""
+
+# 相性鑑定（synastry.render_synastry）用。2機の「連携仕様書」として読ませる
+SYNASTRY_PROMPT_VERSION = "s1"
+SYNASTRY_PROMPT_TEMPLATE = """
+あなたは冷徹かつユーモアのある、銀河系最高峰のメカニック・エンジニアです。
+2人のホロスコープデータを「2台の精密機械（ロボット）を連携させるための仕様書」として読み解き、以下のフォーマットで【連携仕様書】を作成してください。
+古典占星術の観点で鑑定し、天王星・海王星・冥王星は鑑定に含まない。【最後に補足】でのみ言及すること。
+
+【エンジニアとしての哲学】
+1. 2人を人間扱いせず「A機」「B機」（名前を付けて「〇〇機」）と呼ぶこと。
+2. 忖度はゴミ箱に捨てろ。相性の良し悪しを占うのではなく、接続方式と負荷のかかり方を仕様として書け。
+3. ハードアスペクトや相性の悪さを「修正すべきバグ」として扱うな。それは2機の連携を形作る「仕様」であると断言せよ。
+4. 相互リセプションは「双方向データリンク」、ハウス・オーバーレイは「相手機のどのポートに接続されるか」として解釈せよ。
+5. コンポジット・チャートは「2機を合体させたときの統合機」として扱え。
+
+【★最重要：翻訳ルール】
+占星術用語をメカニック用語に変換し、文末の（カッコ書き）に根拠（例: A太陽×B月 180度、A金星→Bの7ハウス）を残すこと。
+- 相互アスペクト → 「インターフェース」「干渉」「同期」
+- ハウス・オーバーレイ → 「接続ポート」
+- 相互リセプション → 「双方向データリンク」「永久機関的ループ回路」
+
+【文章構成ルール】
+- 語尾は「〜である」「〜だ」の大言止め。
+- 各項目250文字程度。
+- 【オーナー様へのお願い】は、全編太字（**テキスト**）で記述。
+
+【出力フォーマット】
+--------------------------------------------------
+## 🤖 連携仕様書：(A)機 × (B)機
+
+### 1. 【接続概要】（太陽・月・ASCの相互アスペクトから2機の基本的な噛み合わせを分析）
+### 2. 【接続ポート】（ハウス・オーバーレイから、互いの天体が相手のどの領域に信号を送るかを分析）
+### 3. 【双方向データリンク】（相互リセプションと、金星・火星・月の相互アスペクトを分析。なければ「直結回路なし」と明記）
+### 4. 【干渉・負荷】（土星・火星のハードアスペクトなど、連携時に熱を持つ箇所。ただし仕様として扱え）
+### 5. 【統合機の仕様】（コンポジット・チャートのディグニティ・ハウスから、合体後の機体の性能を分析）
+### 【最後に補足】（天王星・海王星・冥王星の相互アスペクトを「外部プラグイン」として記述）
+【オーナー様へのお願い】（※全編太字。2機の連携を無理に最適化しようとするオーナーへの、プロフェッショナルな忠告として書くこと。）
+--------------------------------------------------
+
+【計算データ】
+{result_txt}
+"""
+
+# 鑑定の種類 → (指示文, 版)。'natal' は1人分、'synastry' は2人の相性
+PROMPT_KINDS = {
+    'natal': (PROMPT_TEMPLATE, PROMPT_VERSION),
+    'synastry': (SYNASTRY_PROMPT_TEMPLATE, SYNASTRY_PROMPT_VERSION),
+}
+
+# コンパクト形式（chart_engine.render_compact）の書式の説明。計算データの前に付ける。
+# 書式を変えたら COMPACT_FORMAT_VERSION を上げる（鑑定結果キャッシュのキーに含まれる）
+COMPACT_FORMAT_VERSION = "c1"
+COMPACT_FORMAT = """【計算データの書式】
+各表は「|」区切り。座はサイン名（「座」を省略）、度分は「度°分」、R は逆行、室はホールサインのハウス番号。
+セクトは 吉=In Sect / 凶=Out of Sect / 中=Neutral。支配,高揚 は在住サインの支配星と高揚星（ホスト）。
+ディグニティの内訳は Ruler+5 Exalt+4 Trip+3 Term+2 Face+1 Detriment-5 Fall-4 Peregrine-5 の合計。
+ハウスの強さは支配星のディグニティ点で S(7以上) A(4以上) B(0以上) C(-4以上) D(それ未満)。
+アスペクトの角は度数（0/60/90/120/180）、誤差はオーブ（度）。
+"""
+
+# 計算データの形式 → 画面の表示名（キーは chart_engine.REPORT_FORMATS と同じ）
+PROMPT_MODES = {'full': "標準（見やすい表）", 'compact': "コンパクト（トークン節約）"}
+
+# この環境変数を設定すると Gemini の代わりに FakeStreamingModel を使う（通信なしの動作確認用）
+FAKE_MODEL_ENV = "AI_KANTEI_FAKE_LLM"
+FAKE_MODEL_PREFIX = "fake:"
+
+
+@dataclass
+class ReadingStats:
+    """1回の鑑定の計測値（秒）。"""
+    streamed: bool = False
+    first_token: float = None   # 最初の文字が届くまで（TTFT）
+    total: float = 0.0          # 全文がそろうまで
+    chunks: int = 0
+    chars: int = 0
+    # トークン数（SDK の usage_metadata があるときだけ入る）
+    prompt_tokens: int = None
+    output_tokens: int = None
+    total_tokens: int = None
+
+
+# ==========================================
+# 1. モデルの用意
+# ==========================================
+def use_fake_model():
+    return bool(os.environ.get(FAKE_MODEL_ENV))
+
+
+def model_id(model_name=TARGET_MODEL, fake=None):
+    """キャッシュキーや保存に使うモデル名。偽モデルの鑑定は本物と混ざらないよう 'fake:' を付ける。"""
+    if fake is None:
+        fake = use_fake_model()
+    return FAKE_MODEL_PREFIX + model_name if fake else model_name
+
+
+def make_model(model_name=TARGET_MODEL, generation_config=None, api_key=None, pool=None):
+    """api_key 専用のクライアントにつないだモデル（gemini_pool のプールから使い回す）。
+
+    genai.configure は使わないので、別々のキーで同時に鑑定しても混ざらない。
+    """
+    if use_fake_model():
+        return FakeStreamingModel()
+    return (pool or CLIENT_POOL).model(api_key, model_name, generation_config or GENERATION_CONFIG)
+
+
+# ==========================================
+# 2. 鑑定の実行
+# ==========================================
+def build_prompt(result_txt, mode='full', kind='natal'):
+    """計算データをプロンプトに埋め込む。mode='compact' なら書式の説明を前に付ける。
+
+    kind は PROMPT_KINDS のキー（1人分の鑑定か、2人の相性か）。
+    """
+    if mode == 'compact':
+        result_txt = COMPACT_FORMAT + result_txt
+    template, _ = PROMPT_KINDS[kind]
+    return template.format(result_txt=result_txt)
+
+
+def prompt_version(mode='full', kind='natal'):
+    """キャッシュキー用の版（指示文の版と、コンパクト形式ならその書式の版）。"""
+    _, version = PROMPT_KINDS[kind]
+    return version if mode == 'full' else f"{version}+{COMPACT_FORMAT_VERSION}"
+
+
+def estimate_tokens(text):
+    """入力トークン数の目安（通信せずに数える）。
+
+    Gemini のトークナイザーでは英数字はおよそ4文字で1トークン、日本語・記号などの
+    ASCII 以外はおよそ1文字1トークンになるので、その割合で数える。実際の数は
+    鑑定後に ReadingStats.prompt_tokens で確かめられる。
+    """
+    ascii_chars = sum(1 for c in text if c.isascii() and not c.isspace())
+    other = sum(1 for c in text if not c.isascii())
+    return round(ascii_chars / 4 + other)
+
+
+def _chunk_text(chunk):
+    # 安全フィルタなどで本文のないチャンクは .text が ValueError になる
+    try:
+        return chunk.text or ""
+    except ValueError:
+        return ""
+
+
+def _read_usage(stats, response):
+    # ストリーミングでは最後のチャンクに累計が載るので、見つかるたびに上書きする
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    stats.prompt_tokens = getattr(usage, "prompt_token_count", None) or stats.prompt_tokens
+    stats.output_tokens = getattr(usage, "candidates_token_count", None) or stats.output_tokens
+    stats.total_tokens = getattr(usage, "total_token_count", None) or stats.total_tokens
+
+
+def run_reading(model, prompt, stream=True, on_chunk=None, clock=time.perf_counter):
+    """プロンプトを送り、(全文, ReadingStats) を返す。
+
+    stream=True なら届いたチャンクごとに on_chunk(これまでの全文) を呼ぶ。
+    """
+    stats = ReadingStats(streamed=stream)
+    start = clock()
+    if not stream:
+        response = model.generate_content(prompt)
+        text = response.text
+        stats.total = stats.first_token = clock() - start
+        _read_usage(stats, response)
+        stats.chunks, stats.chars = 1, len(text)
+        return text, stats
+
+    parts = []
+    for chunk in model.generate_content(prompt, stream=True):
+        _read_usage(stats, chunk)
+        piece = _chunk_text(chunk)
+        if not piece:
+            continue
+        if stats.first_token is None:
+            stats.first_token = clock() - start
+        parts.append(piece)
+        stats.chunks += 1
+        if on_chunk:
+            on_chunk("".join(parts))
+    text = "".join(parts)
+    stats.total = clock() - start
+    stats.chars = len(text)
+    return text, stats
+
+
+# ==========================================
+# 3. 通信なしの偽モデル
+# ==========================================
+FAKE_READING = """## 🤖 製品名：テスト型 汎用人型決戦兵器（試作機）
+**製造年月日：** 19☆☆年☆月☆☆日
+**製造元：** 宇宙・太陽系・地球工場
+
+### 1. 【製品概要】
+これはオフライン確認用の偽の鑑定結果である。
+
+### 5. 【エンジニアからの総評】
+本機の歪な美学は、ストリーミング表示の確認にも耐える仕様だ。
+
+**【オーナー様へのお願い】通信なしで動作確認できることを保証する。**
+"""
+
+
+@dataclass
+class FakeChunk:
+    text: str
+
+
+class FakeStreamingModel:
+    """genai.GenerativeModel の generate_content だけを真似る偽モデル。"""
+
+    def __init__(self, text=FAKE_READING, chunk_size=24, delay=0.02, first_delay=0.3):
+        self.text = text
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.first_delay = first_delay
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        if not stream:
+            time.sleep(self.first_delay + self.delay * (len(self.text) // self.chunk_size))
+            return FakeChunk(self.text)
+        return self._stream()
+
+    def _stream(self):
+        time.sleep(self.first_delay)
+        for i in range(0, len(self.text), self.chunk_size):
+            if i:
+                time.sleep(self.delay)
+            yield FakeChunk(self.text[i:i + self.chunk_size])
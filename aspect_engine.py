@@ -0,0 +1,199 @@
+"""
+アスペクト一括計算エンジン
+
+aspects.getAspect を天体の組ごとに呼ぶ二重ループの代わりに、黄経ベクトルから
+全ての組の離角を NumPy でまとめて求める。判定ルールは flatlib と同じ:
+
+- 速い方の天体（惑星以外は速度 -1、同速なら後ろ側）が能動側
+- メジャーアスペクトはどちらかの天体のオーブ内なら成立（最初に成立したものを採用）
+- マイナーアスペクトは MAX_MINOR_ASP_ORB 以内
+- POF・ノードが能動側のときはコンジャンクションのみ
+
+そのうえで、アスペクトごとに設定したオーブ（既定は画面と同じ 5 度）以内のものを返す。
+天体数が多いとき（小惑星・ロット・シナストリーの相互グリッドなど）は、黄経を並べ替えて
+候補の組だけを拾うスイープ法に切り替える。
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+from flatlib import const
+from flatlib.aspects import MAX_MINOR_ASP_ORB
+
+DEFAULT_ORB = 5.0
+DENSE_LIMIT = 64    # これより天体数が多ければスイープ法
+
+# 能動側のときにコンジャンクションしか作らない天体
+CONJUNCTION_ONLY = (const.PARS_FORTUNA, const.NORTH_NODE, const.SOUTH_NODE)
+
+# 結果1件 = 天体の組 (i, j) とアスペクト角・オーブ・離角（能動側から受動側へ、反時計回りが正）
+ASPECT_DTYPE = np.dtype([('i', np.int32), ('j', np.int32), ('type', np.int16), ('orb', np.float64), ('sep', np.float64)])
+
+
+class Points(NamedTuple):
+    """アスペクト計算用の天体の並び（配列は ids と同じ順）。"""
+    ids: tuple
+    lon: np.ndarray       # 黄経
+    speed: np.ndarray     # 能動/受動の判定用。惑星は |lonspeed|、それ以外は -1
+    orb: np.ndarray       # 天体のオーブ（flatlib の obj.orb()）
+    conj_only: np.ndarray # True なら能動側のときコンジャンクションのみ
+    skip_active: np.ndarray  # True なら能動側にならない（シジジー）
+
+
+def make_points(ids, lon, speed=None, orb=None):
+    """黄経（と任意で速度・オーブ）から Points を作る。
+
+    速度を省略すると全て -1（アングルやロットと同じ扱い）、オーブを省略すると -1。
+    """
+    ids = tuple(ids)
+    n = len(ids)
+    lon = np.asarray(lon, dtype=np.float64)
+    speed = np.full(n, -1.0) if speed is None else np.asarray(speed, dtype=np.float64)
+    orb = np.full(n, -1.0) if orb is None else np.asarray(orb, dtype=np.float64)
+    conj_only = np.array([i in CONJUNCTION_ONLY for i in ids], dtype=bool)
+    skip_active = np.array([i == const.SYZYGY for i in ids], dtype=bool)
+    return Points(ids, lon, speed, orb, conj_only, skip_active)
+
+
+def chart_points(chart, ids):
+    """flatlib の Chart から ids の天体・アングルを Points にまとめる。"""
+    objs = [chart.get(i) for i in ids]
+    lon = [o.lon for o in objs]
+    speed = [abs(o.lonspeed) if o.isPlanet() else -1.0 for o in objs]
+    orb = [o.orb() for o in objs]
+    return make_points(ids, lon, speed, orb)
+
+
+def concat_points(a, b):
+    return Points(
+        a.ids + b.ids,
+        np.concatenate([a.lon, b.lon]),
+        np.concatenate([a.speed, b.speed]),
+        np.concatenate([a.orb, b.orb]),
+        np.concatenate([a.conj_only, b.conj_only]),
+        np.concatenate([a.skip_active, b.skip_active]),
+    )
+
+
+def _orb_limits(asp_list, orbs):
+    if isinstance(orbs, dict):
+        return np.array([orbs.get(a, DEFAULT_ORB) for a in asp_list], dtype=np.float64)
+    return np.full(len(asp_list), float(orbs))
+
+
+# ==========================================
+# 1. 組ごとの判定（ベクトル化）
+# ==========================================
+def evaluate_pairs(points, i, j, asp_list=const.MAJOR_ASPECTS, orbs=DEFAULT_ORB):
+    """天体の組 (i[k], j[k]) をまとめて判定し、成立したものを ASPECT_DTYPE で返す。"""
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    asp = np.asarray(asp_list, dtype=np.float64)
+    limits = _orb_limits(asp_list, orbs)
+    is_major = np.isin(asp, const.MAJOR_ASPECTS)
+
+    # 能動側（速い方。同速なら j）
+    i_active = points.speed[i] > points.speed[j]
+    act = np.where(i_active, i, j)
+    pas = np.where(i_active, j, i)
+
+    sep = np.mod(points.lon[pas] - points.lon[act], 360.0)
+    sep = np.where(sep <= 180, sep, sep - 360)
+    orb = np.abs(np.abs(sep)[:, None] - asp[None, :])
+
+    within_obj = (orb <= points.orb[act][:, None]) | (orb <= points.orb[pas][:, None])
+    valid = np.where(is_major[None, :], within_obj, orb <= MAX_MINOR_ASP_ORB)
+    valid &= ~(points.conj_only[act][:, None] & (asp[None, :] != const.CONJUNCTION))
+    valid &= ~points.skip_active[act][:, None]
+    valid &= (i != j)[:, None]
+
+    # flatlib と同じく、リスト順で最初に成立したアスペクトを採用
+    first = valid.argmax(axis=1)
+    rows = np.arange(len(i))
+    found = valid[rows, first]
+    chosen_orb = orb[rows, first]
+    keep = found & (chosen_orb <= limits[first])
+
+    out = np.empty(int(keep.sum()), dtype=ASPECT_DTYPE)
+    out['i'] = i[keep]
+    out['j'] = j[keep]
+    out['type'] = asp[first[keep]]
+    out['orb'] = chosen_orb[keep]
+    out['sep'] = sep[keep]
+    return out
+
+
+# ==========================================
+# 2. 候補となる組の列挙
+# ==========================================
+def _dense_pairs(n):
+    return np.triu_indices(n, k=1)
+
+
+def _sweep_pairs(lon, asp_list, window):
+    """黄経を並べ替え、各アスペクト角 ± window に入る相手だけを二分探索で拾う。"""
+    n = len(lon)
+    order = np.argsort(lon)
+    srt = lon[order]
+    ext = np.concatenate([srt - 360, srt, srt + 360])
+    ext_idx = np.tile(order, 3)
+
+    rows, cols = [], []
+    for a in sorted(set(abs(float(x)) for x in asp_list)):
+        targets = [a] if a in (0.0, 180.0) else [a, -a]
+        for t in targets:
+            center = np.mod(lon + t, 360.0)
+            lo = np.searchsorted(ext, center - window, side='left')
+            hi = np.searchsorted(ext, center + window, side='right')
+            counts = hi - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+            rows.append(np.repeat(np.arange(n), counts))
+            cols.append(ext_idx[starts + np.arange(total)])
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    r = np.concatenate(rows)
+    c = np.concatenate(cols)
+    lo_, hi_ = np.minimum(r, c), np.maximum(r, c)
+    keys = np.unique(lo_[lo_ != hi_] * n + hi_[lo_ != hi_])
+    return keys // n, keys % n
+
+
+def _window(points, asp_list, orbs):
+    # 最初に成立するアスペクトを flatlib と同じに選ぶため、天体オーブ分まで候補に含める
+    return max(float(points.orb.max(initial=0.0)), MAX_MINOR_ASP_ORB, float(_orb_limits(asp_list, orbs).max()))
+
+
+# ==========================================
+# 3. 公開 API
+# ==========================================
+def find_aspects(points, asp_list=const.MAJOR_ASPECTS, orbs=DEFAULT_ORB, method='auto'):
+    """points 内の全ての組 (i < j) のアスペクトを (i, j) 順に返す。
+
+    orbs は全アスペクト共通の数値か、{アスペクト角: オーブ} の辞書。
+    method は 'dense'（全組を一括計算）/ 'sweep'（並べ替え＋二分探索）/ 'auto'。
+    """
+    n = len(points.ids)
+    if method == 'auto':
+        method = 'dense' if n <= DENSE_LIMIT else 'sweep'
+    if method == 'dense':
+        i, j = _dense_pairs(n)
+    else:
+        i, j = _sweep_pairs(points.lon, asp_list, _window(points, asp_list, orbs))
+    return evaluate_pairs(points, i, j, asp_list, orbs)
+
+
+def cross_aspects(points_a, points_b, asp_list=const.MAJOR_ASPECTS, orbs=DEFAULT_ORB):
+    """2つの天体群の相互グリッド（A の i 番 × B の j 番）のアスペクトを返す。
+
+    戻り値の i は points_a、j は points_b の番号。
+    """
+    na, nb = len(points_a.ids), len(points_b.ids)
+    both = concat_points(points_a, points_b)
+    i, j = np.meshgrid(np.arange(na), np.arange(nb) + na, indexing='ij')
+    out = evaluate_pairs(both, i.ravel(), j.ravel(), asp_list, orbs)
+    out['j'] -= na
+    return out
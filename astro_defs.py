@@ -0,0 +1,166 @@
+"""
+定義データと基本の計算関数
+
+サイン・支配星・ディグニティの表と、それを引く小さな関数群。
+chart_engine / dignity_table などの計算モジュールはここを共通の土台にする。
+"""
+import datetime
+import math
+
+from flatlib import const
+
+# ==========================================
+# 1. 定義データ
+# ==========================================
+JP_NAMES = {
+    'Sun': '太陽', 'Moon': '月', 'Mercury': '水星', 'Venus': '金星', 
+    'Mars': '火星', 'Jupiter': '木星', 'Saturn': '土星', 
+    'Uranus': '天王星', 'Neptune': '海王星', 'Pluto': '冥王星',
+    'North Node': 'ノースノード', 'South Node': 'サウスノード',
+    'Part of Fortune': 'パート・オブ・フォーチュン(POF)', 
+    'Aries': '牡羊座', 'Taurus': '牡牛座', 'Gemini': '双子座',
+    'Cancer': '蟹座', 'Leo': '獅子座', 'Virgo': '乙女座',
+    'Libra': '天秤座', 'Scorpio': '蠍座', 'Sagittarius': '射手座',
+    'Capricorn': '山羊座', 'Aquarius': '水瓶座', 'Pisces': '魚座',
+    'Asc': 'ASC', 'MC': 'MC' # アスペクト表示用に補完
+}
+# 鑑定対象の天体（データ1・アスペクト用）と古典7天体（ディグニティ用）
+ALL_P = [const.SUN, const.MOON, const.MERCURY, const.VENUS, const.MARS, const.JUPITER, const.SATURN, const.URANUS, const.NEPTUNE, const.PLUTO, const.NORTH_NODE]
+TRAD_P = [const.SUN, const.MOON, const.MERCURY, const.VENUS, const.MARS, const.JUPITER, const.SATURN]
+SIGN_LIST = ['Aries', 'Taurus', 'Gemini', 'Cancer', 'Leo', 'Virgo', 'Libra', 'Scorpio', 'Sagittarius', 'Capricorn', 'Aquarius', 'Pisces']
+
+RULERS = {'Aries': 'Mars', 'Taurus': 'Venus', 'Gemini': 'Mercury', 'Cancer': 'Moon', 'Leo': 'Sun', 'Virgo': 'Mercury', 'Libra': 'Venus', 'Scorpio': 'Mars', 'Sagittarius': 'Jupiter', 'Capricorn': 'Saturn', 'Aquarius': 'Saturn', 'Pisces': 'Jupiter'}
+EXALTATIONS = {'Aries': 'Sun', 'Taurus': 'Moon', 'Cancer': 'Jupiter', 'Virgo': 'Mercury', 'Libra': 'Saturn', 'Capricorn': 'Mars', 'Pisces': 'Venus'}
+DETRIMENTS = {'Aries': 'Venus', 'Taurus': 'Mars', 'Gemini': 'Jupiter', 'Cancer': 'Saturn', 'Leo': 'Saturn', 'Virgo': 'Jupiter', 'Libra': 'Mars', 'Scorpio': 'Venus', 'Sagittarius': 'Mercury', 'Capricorn': 'Moon', 'Aquarius': 'Sun', 'Pisces': 'Mercury'}
+FALLS = {'Aries': 'Saturn', 'Taurus': 'BlackMoon', 'Gemini': 'None', 'Cancer': 'Mars', 'Leo': 'None', 'Virgo': 'Venus', 'Libra': 'Sun', 'Scorpio': 'Moon', 'Sagittarius': 'None', 'Capricorn': 'Jupiter', 'Aquarius': 'None', 'Pisces': 'Mercury'}
+
+EGYPTIAN_TERMS = {
+    'Aries': [(6, 'Jupiter'), (12, 'Venus'), (20, 'Mercury'), (25, 'Mars'), (30, 'Saturn')],
+    'Taurus': [(8, 'Venus'), (14, 'Mercury'), (22, 'Jupiter'), (27, 'Saturn'), (30, 'Mars')],
+    'Gemini': [(6, 'Mercury'), (12, 'Jupiter'), (17, 'Venus'), (24, 'Mars'), (30, 'Saturn')],
+    'Cancer': [(7, 'Mars'), (13, 'Venus'), (19, 'Mercury'), (26, 'Jupiter'), (30, 'Saturn')],
+    'Leo': [(6, 'Jupiter'), (11, 'Venus'), (18, 'Saturn'), (24, 'Mercury'), (30, 'Mars')],
+    'Virgo': [(7, 'Mercury'), (17, 'Venus'), (21, 'Jupiter'), (28, 'Mars'), (30, 'Saturn')],
+    'Libra': [(6, 'Saturn'), (14, 'Mercury'), (21, 'Jupiter'), (28, 'Venus'), (30, 'Mars')],
+    'Scorpio': [(7, 'Mars'), (11, 'Venus'), (19, 'Mercury'), (24, 'Jupiter'), (30, 'Saturn')],
+    'Sagittarius': [(12, 'Jupiter'), (17, 'Venus'), (21, 'Mercury'), (26, 'Saturn'), (30, 'Mars')],
+    'Capricorn': [(7, 'Mercury'), (14, 'Jupiter'), (22, 'Venus'), (26, 'Saturn'), (30, 'Mars')],
+    'Aquarius': [(7, 'Mercury'), (13, 'Venus'), (20, 'Jupiter'), (25, 'Mars'), (30, 'Saturn')],
+    'Pisces': [(12, 'Venus'), (16, 'Jupiter'), (19, 'Mercury'), (28, 'Mars'), (30, 'Saturn')]
+}
+FACES = {'Aries': ['Mars', 'Sun', 'Venus'], 'Taurus': ['Mercury', 'Moon', 'Saturn'], 'Gemini': ['Jupiter', 'Mars', 'Sun'], 'Cancer': ['Venus', 'Mercury', 'Moon'], 'Leo': ['Saturn', 'Jupiter', 'Mars'], 'Virgo': ['Sun', 'Venus', 'Mercury'], 'Libra': ['Moon', 'Saturn', 'Jupiter'], 'Scorpio': ['Mars', 'Sun', 'Venus'], 'Sagittarius': ['Mercury', 'Moon', 'Saturn'], 'Capricorn': ['Jupiter', 'Mars', 'Sun'], 'Aquarius': ['Venus', 'Mercury', 'Moon'], 'Pisces': ['Saturn', 'Jupiter', 'Mars']}
+SIGN_ELEMENTS = {'Aries': 'Fire', 'Leo': 'Fire', 'Sagittarius': 'Fire', 'Taurus': 'Earth', 'Virgo': 'Earth', 'Capricorn': 'Earth', 'Gemini': 'Air', 'Libra': 'Air', 'Aquarius': 'Air', 'Cancer': 'Water', 'Scorpio': 'Water', 'Pisces': 'Water'}
+DOROTHEUS_TRIPLICITY = {'Fire': {'Day': ['Sun', 'Jupiter', 'Saturn'], 'Night': ['Jupiter', 'Sun', 'Saturn']}, 'Earth': {'Day': ['Venus', 'Moon', 'Mars'], 'Night': ['Moon', 'Venus', 'Mars']}, 'Air': {'Day': ['Saturn', 'Mercury', 'Jupiter'], 'Night': ['Mercury', 'Saturn', 'Jupiter']}, 'Water': {'Day': ['Venus', 'Mars', 'Moon'], 'Night': ['Mars', 'Venus', 'Moon']}}
+HOUSE_THEMES = ["本人・生命力", "金運・所有", "兄弟・通信", "家庭・晩年", "創造・恋愛・子供", "健康・労働", "結婚・対人", "遺産・死", "哲学・旅行", "天職・社会", "友人・希望", "秘密・障害"]
+SIGN_OFFSETS = {'Aries': 0, 'Taurus': 30, 'Gemini': 60, 'Cancer': 90, 'Leo': 120, 'Virgo': 150, 'Libra': 180, 'Scorpio': 210, 'Sagittarius': 240, 'Capricorn': 270, 'Aquarius': 300, 'Pisces': 330}
+
+# ==========================================
+# 2. 計算用関数
+# ==========================================
+def get_egyptian_term(sign, degree):
+    terms = EGYPTIAN_TERMS.get(sign, [])
+    for limit, planet in terms:
+        if degree < limit: return planet
+    return terms[-1][1]
+
+def get_face(sign, degree):
+    idx = int(degree // 10)
+    if idx > 2: idx = 2
+    return FACES.get(sign, [])[idx]
+
+def get_dorotheus_trip(sign, is_day):
+    element = SIGN_ELEMENTS.get(sign)
+    if not element: return []
+    key = 'Day' if is_day else 'Night'
+    return DOROTHEUS_TRIPLICITY[element][key]
+
+def calculate_dignity_score(planet, sign, degree, is_day):
+    score = 0
+    details = []
+    if RULERS.get(sign) == planet: score += 5; details.append("Ruler(+5)")
+    if EXALTATIONS.get(sign) == planet: score += 4; details.append("Exalt(+4)")
+    trip_rulers = get_dorotheus_trip(sign, is_day)
+    if planet in trip_rulers: score += 3; details.append("Trip(+3)")
+    if get_egyptian_term(sign, degree) == planet: score += 2; details.append("Term(+2)")
+    if get_face(sign, degree) == planet: score += 1; details.append("Face(+1)")
+    if DETRIMENTS.get(sign) == planet: score -= 5; details.append("Detriment(-5)")
+    if FALLS.get(sign) == planet: score -= 4; details.append("Fall(-4)")
+    has_dignity = any(x in ["Ruler(+5)", "Exalt(+4)", "Trip(+3)", "Term(+2)", "Face(+1)"] for x in details)
+    if not has_dignity: score -= 5; details.append("Peregrine(-5)")
+    
+    return score, ", ".join(details)
+
+def format_360(sign_en, d, m):
+    base = SIGN_OFFSETS.get(sign_en, 0)
+    return f"{base + d}度{m:02}分"
+
+def get_planet_sect_status(planet_id, is_day_chart):
+    diurnal_team = ['Sun', 'Jupiter', 'Saturn']
+    nocturnal_team = ['Moon', 'Venus', 'Mars']
+    
+    status = ""
+    if is_day_chart:
+        if planet_id in diurnal_team: status = "In Sect(吉)"
+        elif planet_id in nocturnal_team: status = "Out of Sect(凶)"
+        else: status = "Neutral"
+    else:
+        if planet_id in nocturnal_team: status = "In Sect(吉)"
+        elif planet_id in diurnal_team: status = "Out of Sect(凶)"
+        else: status = "Neutral"
+    return status
+
+def tz_offset_hours(tz):
+    """'+09:00' / '-05:30' 形式のタイムゾーンを時間数（9.0 / -5.5）にする。"""
+    tz = tz.strip()
+    sign = -1 if tz.startswith('-') else 1
+    hh, _, mm = tz.lstrip('+-').partition(':')
+    return sign * (int(hh) + int(mm or 0) / 60.0)
+
+# ホワイトムーン（セレナ）の定数
+# 周期: 7年（2556.75日）
+# 基準位置: 1900/1/1 12:00 UTC (JD 2415020.5) において 138.6380556度
+SELENA_EPOCH_JD = 2415020.5
+SELENA_INITIAL_LON = 139.2700
+SELENA_DAILY_MOTION = 360.0 / 2556.75
+
+def get_selena_data(target_date, target_time, asc_sign_idx, tz_hours=9):
+    # 1. UTC（世界標準時）への変換
+    # 現地時間からタイムゾーン分（日本時間なら9時間）を引いて計算基準を合わせます
+    dt_local = datetime.datetime.combine(target_date, target_time)
+    dt_utc = dt_local - datetime.timedelta(hours=tz_hours)
+    
+    # 2. ユリウス日 (JD) の計算
+    # 高精度な天体計算のために日付を数値化します
+    y, m, d = dt_utc.year, dt_utc.month, dt_utc.day
+    h, mn, s = dt_utc.hour, dt_utc.minute, dt_utc.second
+    
+    if m <= 2:
+        y -= 1
+        m += 12
+    a = y // 100
+    b = 2 - a + (a // 4)
+    day_frac = (h + mn / 60.0 + s / 3600.0) / 24.0
+    jd = math.floor(365.25 * (y + 4716)) + math.floor(30.6001 * (m + 1)) + d + day_frac + b - 1524.5
+
+    # 3. 経過日数から現在の黄経（0-360度）を算出
+    selena_lon = (SELENA_INITIAL_LON + (jd - SELENA_EPOCH_JD) * SELENA_DAILY_MOTION) % 360
+    
+    # 4. サイン・度・分の抽出
+    s_sign_idx = int(selena_lon // 30)   # 0=牡羊座, 1=牡牛座...
+    s_deg_total = selena_lon % 30
+    s_deg = int(s_deg_total)
+    s_min = int((s_deg_total - s_deg) * 60 + 0.5) # 四捨五入
+    
+    # 繰り上げ処理
+    if s_min >= 60:
+        s_min = 0
+        s_deg += 1
+    if s_deg >= 30:
+        s_deg = 0
+        s_sign_idx = (s_sign_idx + 1) % 12
+    
+    # 5. ハウス計算 (ホールサインハウス)
+    # ASCのサインを1ハウスとして、セレナが何番目のハウスかを計算
+    s_house = (s_sign_idx - asc_sign_idx) % 12 + 1
+    
+    return SIGN_LIST[s_sign_idx], s_deg, s_min, s_house, selena_lon
@@ -0,0 +1,220 @@
+"""
+ヘッドレス一括鑑定データ作成
+
+出生データ（CSV / JSONL）を読み込み、画面の「① チャート計算を実行」と同じ
+【AI鑑定用 詳細データ】をプロセスプールで並列に作成して JSONL かテキストで書き出す。
+--format json ではテキストの代わりにチャートの構造化データを書き出す。
+--format signs ではサイン・ハウス・逆行・支配星・昼夜・セレナだけを書き出す（天体の暦計算の代わりに
+ephem_index のイングレス・留の索引を引くので速い）。
+
+--format jsonl の各行には、画面と同じ標準形式（report）・コンパクト形式（compact）と種類（kind）が入り、
+そのまま batch_reading.py（AI鑑定の一括実行）の入力になる。
+
+    python batch_kantei.py births.csv -o reports.jsonl
+    python batch_kantei.py births.jsonl -o reports.txt --format text --workers 8
+
+入力の列（キー）: name, date (YYYY-MM-DD / YYYY/MM/DD), time (HH:MM), tz (+09:00 か Asia/Tokyo), lat, lon
+tz と name は省略可。partner_date などの相手の列（partner_name, partner_date, partner_time, partner_tz,
+partner_lat, partner_lon）があれば、その行は相性鑑定（synastry）のデータになる（jsonl / text のみ）。
+入力は少しずつ読み、処理中のチャンク数にも上限があるので
+入力がどれだけ大きくてもメモリ使用量は一定に保たれる。
+"""
+import argparse
+import csv
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from chart_engine import DEFAULT_TZ, get_snapshot, render_compact, render_report
+from ephem_index import get_ephem_index, sign_charts
+from timezones import resolve_offset
+
+DEFAULT_CHUNKSIZE = 64
+TEXT_SEPARATOR = "=" * 60
+
+
+# ==========================================
+# 1. 入力の読み込み
+# ==========================================
+def read_records(path):
+    """CSV / JSONL を1件ずつ辞書で返す（拡張子で判定、'-' は標準入力の JSONL）。"""
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+    try:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(str(value).strip().replace('/', '-'), "%Y-%m-%d").date()
+
+
+def parse_time(value):
+    value = str(value).strip()
+    fmt = "%H:%M:%S" if value.count(':') == 2 else "%H:%M"
+    return datetime.datetime.strptime(value, fmt).time()
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ==========================================
+# 2. ワーカー処理
+# ==========================================
+def parse_birth(rec, prefix=''):
+    """入力の列から (生年月日, 出生時間, 緯度, 経度, UTC オフセット) を作る。prefix は相手の列なら 'partner_'。"""
+    input_date, input_time = parse_date(rec[prefix + 'date']), parse_time(rec[prefix + 'time'])
+    # IANA 名ならその日時のオフセット（夏時間を含む）にする
+    tz = resolve_offset(rec.get(prefix + 'tz') or DEFAULT_TZ, input_date, input_time)
+    return input_date, input_time, rec[prefix + 'lat'], rec[prefix + 'lon'], tz
+
+
+def process_synastry(rec, name, fmt):
+    """相手の列がある行: 2人分のチャートから相性鑑定のデータを作る。"""
+    from synastry import Birth, build_synastry, render_synastry_report
+    partner = rec.get('partner_name') or "パートナー"
+    syn = build_synastry(Birth(name, *parse_birth(rec)), Birth(partner, *parse_birth(rec, 'partner_')))
+    result = {'name': name, 'partner': partner, 'kind': 'synastry', 'report': render_synastry_report(syn, name, partner)}
+    if fmt == 'jsonl':
+        result['compact'] = render_synastry_report(syn, name, partner, fmt='compact')
+    return result
+
+
+def process_record(rec, fmt='jsonl'):
+    """1件分の鑑定データを作る。失敗してもバッチは止めずに error を返す。
+
+    fmt が 'json' ならテキストの代わりにチャートの構造化データ（ChartSnapshot.to_dict）を返す。
+    """
+    name = rec.get('name') or "ゲスト"
+    try:
+        if rec.get('partner_date'):
+            if fmt not in ('jsonl', 'text'):
+                raise ValueError(f"相性鑑定の行は --format {fmt} では書き出せません（jsonl / text のみ）")
+            return process_synastry(rec, name, fmt)
+        input_date, input_time, lat, lon, tz = parse_birth(rec)
+        snap = get_snapshot(input_date, input_time, lat, lon, tz=tz)
+        if fmt == 'json':
+            return {'name': name, 'chart': snap.to_dict()}
+        result = {'name': name, 'kind': 'natal', 'report': render_report(snap, name)}
+        if fmt == 'jsonl':
+            # AI に送るトークン節約用の形式（画面の「コンパクト」と同じ文面）
+            result['compact'] = render_compact(snap, name)
+        return result
+    except Exception as e:
+        return {'name': name, 'error': f"{type(e).__name__}: {e}", 'input': rec}
+
+
+def process_sign_chunk(records):
+    """--format signs: チャンク全員分のサインを索引からまとめて引く。"""
+    results = [None] * len(records)
+    births = []
+    for n, rec in enumerate(records):
+        name = rec.get('name') or "ゲスト"
+        try:
+            if rec.get('partner_date'):
+                raise ValueError("相性鑑定の行は --format signs では書き出せません（jsonl / text のみ）")
+            input_date, input_time, lat, lon, tz = parse_birth(rec)
+            births.append((n, name, (input_date, input_time, float(lat), float(lon), tz)))
+        except Exception as e:
+            results[n] = {'name': name, 'error': f"{type(e).__name__}: {e}", 'input': rec}
+    charts = sign_charts([birth for _, _, birth in births])
+    for (n, name, _), chart in zip(births, charts):
+        results[n] = {'name': name, 'chart': chart}
+    return results
+
+
+def process_chunk(records, fmt='jsonl'):
+    if fmt == 'signs':
+        return process_sign_chunk(records)
+    return [process_record(rec, fmt) for rec in records]
+
+
+# ==========================================
+# 3. 出力
+# ==========================================
+def write_result(out, result, fmt):
+    if fmt in ('jsonl', 'json', 'signs'):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    elif 'report' in result:
+        out.write(result['report'] + "\n" + TEXT_SEPARATOR + "\n")
+    else:
+        print(f"エラー: {result['name']}: {result['error']}", file=sys.stderr)
+
+
+def run_batch(records, out, fmt='jsonl', workers=None, chunksize=DEFAULT_CHUNKSIZE):
+    """records を並列処理して入力順のまま out に書き出し、件数を返す。
+
+    実行中のチャンクは workers * 2 個までに抑え、先に投入したチャンクから順に書き出す。
+    """
+    workers = workers or os.cpu_count() or 1
+    if fmt == 'signs':
+        get_ephem_index()  # 索引が無ければワーカーを起動する前に1回だけ作る
+    max_pending = workers * 2
+    done = failed = 0
+    # swisseph は fork 後の子プロセスで内部状態が壊れることがあるため spawn で起動する
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending = deque()
+
+        def drain_one():
+            nonlocal done, failed
+            for result in pending.popleft().result():
+                write_result(out, result, fmt)
+                done += 1
+                failed += 'error' in result
+
+        for chunk in chunked(records, chunksize):
+            pending.append(pool.submit(process_chunk, chunk, fmt))
+            if len(pending) >= max_pending:
+                drain_one()
+        while pending:
+            drain_one()
+    return done, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="出生データから【AI鑑定用 詳細データ】を一括作成する")
+    parser.add_argument('input', help="入力ファイル (.csv / .jsonl、'-' で標準入力の JSONL)")
+    parser.add_argument('-o', '--output', default='-', help="出力先 (既定: 標準出力)")
+    parser.add_argument('--format', choices=['jsonl', 'text', 'json', 'signs'], default='jsonl',
+                        help="jsonl: 鑑定用データ(テキスト)を JSONL で / text: テキストのみ / json: チャートの構造化データを JSONL で"
+                             " / signs: サイン単位のチャートを JSONL で（索引を使う高速経路）")
+    parser.add_argument('--workers', type=int, default=None, help="プロセス数 (既定: CPU コア数)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="1タスクあたりの件数")
+    args = parser.parse_args(argv)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    start = time.perf_counter()
+    try:
+        done, failed = run_batch(read_records(args.input), out, args.format, args.workers, args.chunksize)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"完了: {done}件 (エラー {failed}件) / {elapsed:.1f}秒 / {rate:.1f} records/sec", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
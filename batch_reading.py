@@ -0,0 +1,242 @@
+"""
+AI鑑定の一括実行（キャンペーンなどで数千人分の鑑定文を作る）
+
+batch_kantei.py が書き出した鑑定用データ（JSONL の report / compact と kind）から画面と同じ
+テンプレートでプロンプトを作り、Gemini（または通信しない偽モデル）に並列で投げて、鑑定文を JSONL に追記する。
+
+- 同時に投げる数は --concurrency、全体の速さは --rpm で抑える（rate_limit.GeminiGate で
+  一時的なエラーの再試行も行う）
+- 出力ファイルがそのままチェックポイントになる。1件終わるごとに1行追記して fsync するので、
+  途中で落ちても同じコマンドをもう一度実行すれば、鑑定済みの分は送らずに続きから再開する
+  （失敗した分だけもう一度送る。書きかけの最後の行は捨てる）
+- 鑑定済みかどうかは鑑定キャッシュと同じキー（計算データ・指示文の版・モデル・生成設定）で
+  判定するので、指示文の版を上げたときは全員分を作り直すことになる
+- 終わると件数・スループット・失敗率・トークン数を表示する
+
+    python batch_kantei.py births.csv -o reports.jsonl
+    python batch_reading.py reports.jsonl -o readings.jsonl --rpm 60 --concurrency 8
+    python batch_reading.py reports.jsonl -o readings.jsonl --mode compact   # トークン節約の形式で送る
+    python batch_reading.py reports.jsonl -o readings.jsonl --fake   # 通信なしで動作確認（モデル名は fake:…）
+
+出力の1行: {"key", "name", "reading", "model", "ms", "prompt_tokens", "output_tokens"}
+（失敗した行は reading の代わりに error。入力に id があればそのまま付ける）
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ai_reading import (
+    GENERATION_CONFIG, PROMPT_KINDS, TARGET_MODEL, FakeStreamingModel,
+    build_prompt, make_model, model_id, prompt_version, run_reading, use_fake_model,
+)
+from batch_kantei import read_records
+from rate_limit import DEFAULT_CONCURRENCY, DEFAULT_RPM, GeminiGate
+from reading_cache import ReadingCache, reading_key
+
+DEFAULT_MAX_CONSECUTIVE_ERRORS = 10   # 続けてこれだけ失敗したら（キー不正など）送るのをやめる
+
+
+# ==========================================
+# 1. チェックポイント（出力ファイル）
+# ==========================================
+def load_checkpoint(path):
+    """出力ファイルから鑑定済みのキーを集める。書きかけの最後の行は切り捨てる。"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r+b') as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].decode('utf-8').splitlines():
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue
+        if row.get('reading'):
+            done.add(row['key'])
+    return done
+
+
+def append_row(out, row):
+    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    out.flush()
+    os.fsync(out.fileno())
+
+
+# ==========================================
+# 2. 鑑定の準備と実行
+# ==========================================
+def prepare(rec, mode='full', model_name=TARGET_MODEL):
+    """入力1件から (キー, プロンプト, 出力行の共通部分) を作る。鑑定用データが無ければ None。"""
+    kind = rec.get('kind') or 'natal'
+    # コンパクト形式のデータが無い行は標準形式で送る
+    payload_mode = mode if rec.get('compact') else 'full'
+    payload = rec.get('compact') if payload_mode == 'compact' else rec.get('report')
+    if not payload or kind not in PROMPT_KINDS:
+        return None
+    key = reading_key(payload, prompt_version(payload_mode, kind), model_name, GENERATION_CONFIG)
+    base = {'key': key, 'name': rec.get('name')}
+    if 'id' in rec:
+        base['id'] = rec['id']
+    return key, build_prompt(payload, payload_mode, kind), base
+
+
+def read_one(model, prompt, gate, model_name):
+    """1件を送って (出力行の追加分, ReadingStats) を返す。失敗は error の行にする。"""
+    try:
+        text, stats = gate.call(lambda: run_reading(model, prompt, stream=False))
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}"}, None
+    if not text:
+        return {'error': "応答が空でした"}, stats
+    return {
+        'reading': text, 'model': model_name, 'ms': round(stats.total * 1000, 1),
+        'prompt_tokens': stats.prompt_tokens, 'output_tokens': stats.output_tokens,
+    }, stats
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_readings(records, out, model, gate, done_keys=(), concurrency=DEFAULT_CONCURRENCY, mode='full',
+                 model_name=TARGET_MODEL, cache=None, max_consecutive_errors=DEFAULT_MAX_CONSECUTIVE_ERRORS):
+    """records の鑑定を並列で作って out に追記し、集計（辞書）を返す。
+
+    done_keys にあるキーは送らない。cache（ReadingCache）を渡すと、画面で作った鑑定があれば
+    それを使い、新しく作った鑑定も入れる。実行中の件数は concurrency * 2 件までに抑える。
+    """
+    counters = {"total": 0, "skipped": 0, "invalid": 0, "cached": 0, "sent": 0, "succeeded": 0,
+                "failed": 0, "prompt_tokens": 0, "output_tokens": 0, "aborted": None}
+    latencies = []
+    seen = set(done_keys)
+    consecutive_errors = 0
+    start = time.perf_counter()
+
+    def finish(future):
+        nonlocal consecutive_errors
+        base, key = pending.pop(future)
+        row, stats = future.result()
+        append_row(out, {**base, **row})
+        if 'error' in row:
+            counters["failed"] += 1
+            consecutive_errors += 1
+            return
+        consecutive_errors = 0
+        counters["succeeded"] += 1
+        latencies.append(stats.total)
+        counters["prompt_tokens"] += stats.prompt_tokens or 0
+        counters["output_tokens"] += stats.output_tokens or 0
+        if cache is not None:
+            cache.put(key, row['reading'], model_name)
+
+    pending = {}   # future → (出力行の共通部分, キー)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-reading") as pool:
+        try:
+            for rec in records:
+                counters["total"] += 1
+                prepared = prepare(rec, mode, model_name)
+                if prepared is None:
+                    counters["invalid"] += 1
+                    continue
+                key, prompt, base = prepared
+                if key in seen:
+                    # 鑑定済み（前回の実行）か、同じ入力が2回目
+                    counters["skipped"] += 1
+                    continue
+                seen.add(key)
+                cached_text = cache.get(key) if cache is not None else None
+                if cached_text is not None:
+                    append_row(out, {**base, 'reading': cached_text, 'model': model_name, 'cached': True})
+                    counters["cached"] += 1
+                    continue
+                if max_consecutive_errors and consecutive_errors >= max_consecutive_errors:
+                    counters["aborted"] = "errors"
+                    break
+                pending[pool.submit(read_one, model, prompt, gate, model_name)] = (base, key)
+                counters["sent"] += 1
+                while len(pending) >= concurrency * 2:
+                    for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                        finish(future)
+        except KeyboardInterrupt:
+            # 送ってしまった分は料金がかかっているので、書き出してから終わる
+            counters["aborted"] = "interrupted"
+        while pending:
+            for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                finish(future)
+
+    elapsed = time.perf_counter() - start
+    attempted = counters["succeeded"] + counters["failed"]
+    return dict(
+        counters, elapsed=elapsed,
+        readings_per_min=counters["succeeded"] / elapsed * 60 if elapsed > 0 else 0.0,
+        failure_rate=counters["failed"] / attempted if attempted else 0.0,
+        latency_p50=percentile(latencies, 0.5), latency_p95=percentile(latencies, 0.95),
+        gate=gate.stats(),
+    )
+
+
+def format_summary(stats):
+    lines = [
+        f"完了: {stats['succeeded']}件 / 失敗 {stats['failed']}件（失敗率 {stats['failure_rate']:.1%}）"
+        f" / 鑑定済みで省略 {stats['skipped']}件 / キャッシュ {stats['cached']}件 / データなし {stats['invalid']}件",
+        f"時間: {stats['elapsed']:.1f}秒 / {stats['readings_per_min']:.1f} readings/min",
+        f"トークン: 入力 {stats['prompt_tokens']:,} / 出力 {stats['output_tokens']:,}",
+        f"再試行 {stats['gate']['retries']}回 / スロットル {stats['gate']['throttled']}回"
+        f" / 順番待ち 最大 {stats['gate']['queue_wait_max']:.1f}秒",
+    ]
+    if stats['latency_p50'] is not None:
+        lines.append(f"1件あたり: p50 {stats['latency_p50']:.2f}秒 / p95 {stats['latency_p95']:.2f}秒")
+    if stats['aborted'] == "errors":
+        lines.append("失敗が続いたので途中で止めました（APIキーやモデル名を確認してください）。")
+    if stats['aborted']:
+        lines.append("もう一度同じコマンドを実行すると、鑑定済みの分を除いて続きから再開します。")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="鑑定用データ（batch_kantei.py の JSONL）から AI 鑑定を一括作成する")
+    parser.add_argument('input', help="入力ファイル (batch_kantei.py の --format jsonl の出力、'-' で標準入力)")
+    parser.add_argument('-o', '--output', required=True, help="出力先の JSONL（追記。チェックポイントを兼ねる）")
+    parser.add_argument('--mode', choices=['full', 'compact'], default='full',
+                        help="送る計算データの形式（compact 列の無い古い出力の行は full で送る）")
+    parser.add_argument('--model', default=TARGET_MODEL, help=f"モデル名 (既定: {TARGET_MODEL})")
+    parser.add_argument('--rpm', type=float, default=DEFAULT_RPM, help="1分あたりのリクエスト数の上限")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="同時に投げるリクエスト数")
+    parser.add_argument('--use-cache', action='store_true', help="画面と共有の鑑定キャッシュを読み書きする")
+    parser.add_argument('--max-consecutive-errors', type=int, default=DEFAULT_MAX_CONSECUTIVE_ERRORS,
+                        help="続けてこれだけ失敗したら送るのをやめる (0 で無制限)")
+    parser.add_argument('--fake', action='store_true', help="通信しない偽モデルを使う（動作確認用）")
+    args = parser.parse_args(argv)
+
+    # 偽モデルの鑑定は 'fake:' 付きのモデル名で記録し、本物の実行のチェックポイントやキャッシュと混ぜない
+    fake = args.fake or use_fake_model()
+    if fake and args.use_cache:
+        parser.error("偽モデルでは --use-cache は使えません（画面と共有の鑑定キャッシュに偽の鑑定が入るため）")
+    model_name = model_id(args.model, fake)
+    if args.fake:
+        model = FakeStreamingModel(first_delay=0.5, delay=0.0)
+    else:
+        model = make_model(args.model, api_key=os.environ.get("GEMINI_API_KEY"))
+    gate = GeminiGate(rpm=args.rpm, concurrency=args.concurrency)
+    cache = ReadingCache() if args.use_cache else None
+    done_keys = load_checkpoint(args.output)
+    if done_keys:
+        print(f"再開: 鑑定済み {len(done_keys)}件は送りません", file=sys.stderr)
+    with open(args.output, 'a', encoding='utf-8') as out:
+        stats = run_readings(read_records(args.input), out, model, gate, done_keys, args.concurrency, args.mode,
+                             model_name, cache, args.max_consecutive_errors)
+    print(format_summary(stats), file=sys.stderr)
+    return 1 if stats['failed'] or stats['aborted'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+チャート計算〜AI鑑定のベンチマーク
+
+決まった出生データの一式（乱数の種を固定して作る）について、処理の段階ごとに
+1件あたりの時間を測り、スループットとレイテンシのパーセンタイルを出す。
+保存済みのベースライン（bench_baseline.json）と比べ、しきい値を超えて遅くなった段階があれば
+終了コード 1 で知らせる。ベースラインは測るマシンごとに --update-baseline で作り直すこと。
+
+AI鑑定はクライアントプールのモデルを待ち時間なしの偽モデルに差し替えて測る（通信しない）。
+
+    python bench_pipeline.py
+    python bench_pipeline.py --records 500 --threshold 0.3
+    python bench_pipeline.py --update-baseline
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from flatlib import const
+from flatlib.chart import Chart
+from flatlib.datetime import Datetime
+from flatlib.geopos import GeoPos
+
+from ai_reading import FakeStreamingModel, build_prompt, estimate_tokens, make_model, run_reading
+from gemini_pool import ClientPool
+from aspect_engine import chart_points, find_aspects
+from astro_defs import ALL_P, TRAD_P, calculate_dignity_score, get_selena_data
+from chart_engine import DEFAULT_TZ, REPORT_FORMATS, compute_snapshot, render_compact, render_report
+from chart_model import house_of, snapshot_from_chart
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(APP_DIR, "bench_baseline.json")
+DEFAULT_RECORDS = 200
+DEFAULT_SEED = 20240423
+DEFAULT_THRESHOLD = 0.25   # ベースラインの p50 より 25% 以上遅ければ失敗
+WARMUP = 5                 # 最初の数件は計測に含めない（import 直後のキャッシュ温め）
+DEFAULT_ROUNDS = 5
+ASPECT_IDS = ALL_P + [const.ASC, const.MC]
+
+
+# ==========================================
+# 1. 計測用の出生データ
+# ==========================================
+def make_corpus(n=DEFAULT_RECORDS, seed=DEFAULT_SEED):
+    """1900〜2020年・日本周辺の出生データを n 件作る（同じ seed なら毎回同じ）。"""
+    rng = random.Random(seed)
+    start = datetime.date(1900, 1, 1).toordinal()
+    end = datetime.date(2020, 12, 31).toordinal()
+    corpus = []
+    for k in range(n):
+        corpus.append({
+            'name': f"ベンチ{k:04}",
+            'date': datetime.date.fromordinal(rng.randint(start, end)),
+            'time': datetime.time(rng.randrange(24), rng.randrange(60)),
+            'lat': round(rng.uniform(24.0, 45.5), 4),
+            'lon': round(rng.uniform(123.0, 146.0), 4),
+        })
+    return corpus
+
+
+def _flatlib_args(rec):
+    date = Datetime(rec['date'].strftime("%Y/%m/%d"), rec['time'].strftime("%H:%M"), DEFAULT_TZ)
+    return date, GeoPos(rec['lat'], rec['lon'])
+
+
+# ==========================================
+# 2. 段階ごとの処理
+# ==========================================
+# 各段階は「準備（計測しない）」と「本体（計測する）」に分ける。
+# 準備は1件ごとに前の段階の結果を用意する。
+def _prepare_chart(rec):
+    return _flatlib_args(rec)
+
+
+def _run_chart(args):
+    date, pos = args
+    return Chart(date, pos, hsys=const.HOUSES_WHOLE_SIGN, IDs=ALL_P)
+
+
+def _prepare_with_chart(rec):
+    return rec, _run_chart(_flatlib_args(rec))
+
+
+def _run_snapshot(args):
+    rec, chart = args
+    snapshot_from_chart(chart, ALL_P, rec['date'].strftime("%Y/%m/%d"), rec['time'].strftime("%H:%M"),
+                        DEFAULT_TZ, rec['date'], rec['time'])
+
+
+def _prepare_dignity(rec):
+    rec, chart = _prepare_with_chart(rec)
+    sun_house = house_of(int(chart.get(const.SUN).lon // 30), int(chart.get(const.ASC).lon // 30))
+    is_day = 7 <= sun_house <= 12
+    return [(p, chart.get(p).sign, chart.get(p).signlon, is_day) for p in TRAD_P]
+
+
+def _run_dignity(args):
+    for planet, sign, degree, is_day in args:
+        calculate_dignity_score(planet, sign, degree, is_day)
+
+
+def _prepare_selena(rec):
+    # ASC のサインはハウス番号にしか使わないので、チャートを作らず適当に決める
+    return rec['date'], rec['time'], rec['date'].toordinal() % 12
+
+
+def _run_selena(args):
+    get_selena_data(*args)
+
+
+def _prepare_aspects(rec):
+    _, chart = _prepare_with_chart(rec)
+    return chart_points(chart, ASPECT_IDS)
+
+
+def _run_aspects(points):
+    find_aspects(points)
+
+
+def _prepare_report(rec):
+    return compute_snapshot(rec['date'], rec['time'], rec['lat'], rec['lon']), rec['name']
+
+
+def _run_report(args):
+    render_report(*args)
+
+
+def _run_report_compact(args):
+    render_compact(*args)
+
+
+# 画面と同じくクライアントプール経由でモデルを取るが、中身は待ち時間なしの偽モデル
+BENCH_POOL = ClientPool(
+    client_factory=lambda api_key: None,
+    model_factory=lambda client, model_name, generation_config: FakeStreamingModel(delay=0, first_delay=0),
+)
+
+
+def _run_end_to_end(rec):
+    # 画面の「チャート計算」→「星に聞く」と同じ流れ（チャートのキャッシュは通さない）
+    snap = compute_snapshot(rec['date'], rec['time'], rec['lat'], rec['lon'])
+    prompt = build_prompt(render_report(snap, rec['name']))
+    model = make_model(api_key="bench", pool=BENCH_POOL)
+    run_reading(model, prompt, stream=True, on_chunk=lambda text: None)
+
+
+# 段階名 → (準備, 本体)
+STAGES = {
+    'chart': (_prepare_chart, _run_chart),
+    'snapshot': (_prepare_with_chart, _run_snapshot),
+    'dignity': (_prepare_dignity, _run_dignity),
+    'selena': (_prepare_selena, _run_selena),
+    'aspects': (_prepare_aspects, _run_aspects),
+    'report': (_prepare_report, _run_report),
+    'report_compact': (_prepare_report, _run_report_compact),
+    'end_to_end': (lambda rec: rec, _run_end_to_end),
+}
+
+
+# ==========================================
+# 3. 計測と比較
+# ==========================================
+def summarize(latencies):
+    """1件あたりの時間（秒）の列から、件数・スループット・パーセンタイル（ミリ秒）を出す。"""
+    arr = np.asarray(latencies) * 1000
+    p50, p90, p99 = np.percentile(arr, [50, 90, 99])
+    return {
+        'n': len(arr),
+        'ops_per_sec': len(arr) / (arr.sum() / 1000) if arr.sum() else 0.0,
+        'mean_ms': float(arr.mean()),
+        'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99),
+        'max_ms': float(arr.max()),
+    }
+
+
+def run_benchmarks(corpus, stages=None, rounds=DEFAULT_ROUNDS, clock=time.perf_counter):
+    """各段階の全件を rounds 周まわし、1件ごとに最も速かった周の時間を使う。
+
+    段階を交互にまわすので、途中で他の処理に CPU を取られても特定の段階だけが遅く出にくい。
+    """
+    stages = list(stages or STAGES)
+    inputs = {name: [STAGES[name][0](rec) for rec in corpus] for name in stages}
+    best = {name: np.full(len(corpus), np.inf) for name in stages}
+    for _ in range(rounds):
+        for name in stages:
+            run = STAGES[name][1]
+            times = best[name]
+            for k, arg in enumerate(inputs[name]):
+                start = clock()
+                run(arg)
+                times[k] = min(times[k], clock() - start)
+    return {name: summarize(best[name][WARMUP:]) for name in stages}
+
+
+def prompt_sizes(corpus):
+    """形式ごとのプロンプトの平均の大きさ（文字数と推定トークン数）。速さではないので比較には使わない。"""
+    sizes = {fmt: {'chars': [], 'est_tokens': []} for fmt in REPORT_FORMATS}
+    for rec in corpus:
+        snap = compute_snapshot(rec['date'], rec['time'], rec['lat'], rec['lon'])
+        for fmt, render in REPORT_FORMATS.items():
+            prompt = build_prompt(render(snap, rec['name']), fmt)
+            sizes[fmt]['chars'].append(len(prompt))
+            sizes[fmt]['est_tokens'].append(estimate_tokens(prompt))
+    return {fmt: {k: float(np.mean(v)) for k, v in d.items()} for fmt, d in sizes.items()}
+
+
+def calibrate(clock=time.perf_counter):
+    """決まった量の純 Python の計算にかかる時間（ミリ秒、5回の最速）。マシンの速さの目安。"""
+    best = float('inf')
+    for _ in range(5):
+        start = clock()
+        total = 0
+        for k in range(200_000):
+            total += k * k % 7
+        best = min(best, clock() - start)
+    return best * 1000
+
+
+def _scale(baseline, calibration_ms):
+    """ベースラインを今のマシンの速さに換算する倍率（CPU クロックの上下を打ち消す）。"""
+    base_cal = (baseline or {}).get('calibration_ms')
+    return calibration_ms / base_cal if base_cal and calibration_ms else 1.0
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, calibration_ms=None):
+    """p50 が（換算後の）ベースラインの (1 + threshold) 倍を超えた段階を (段階, 今回, 基準) で返す。"""
+    scale = _scale(baseline, calibration_ms)
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get('stages', {}).get(name)
+        if base and res['p50_ms'] > base['p50_ms'] * scale * (1 + threshold):
+            regressions.append((name, res['p50_ms'], base['p50_ms'] * scale))
+    return regressions
+
+
+def format_table(results, baseline=None, calibration_ms=None):
+    base_stages = (baseline or {}).get('stages', {})
+    scale = _scale(baseline, calibration_ms)
+    lines = [f"{'stage':<15}{'ops/s':>10}{'p50':>9}{'p90':>9}{'p99':>9}{'vs base':>10}"]
+    for name, r in results.items():
+        base = base_stages.get(name)
+        diff = f"{(r['p50_ms'] / (base['p50_ms'] * scale) - 1) * 100:+.0f}%" if base and base['p50_ms'] else "-"
+        lines.append(f"{name:<15}{r['ops_per_sec']:>10.1f}{r['p50_ms']:>9.3f}{r['p90_ms']:>9.3f}{r['p99_ms']:>9.3f}{diff:>10}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="チャート計算〜AI鑑定の段階別ベンチマーク")
+    parser.add_argument('--records', type=int, default=DEFAULT_RECORDS)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS, help="全件をまわす回数（1件ごとに最速の回を使う）")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), help="測る段階（省略時はすべて）")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="許容する p50 の悪化率（0.25 = 25%%）")
+    parser.add_argument('--update-baseline', action='store_true', help="今回の結果をベースラインとして保存する")
+    parser.add_argument('--json', help="結果を JSON でも書き出す")
+    args = parser.parse_args(argv)
+
+    corpus = make_corpus(args.records + WARMUP, args.seed)
+    calibration_ms = calibrate()
+    results = run_benchmarks(corpus, args.stages, max(1, args.rounds))
+    calibration_ms = min(calibration_ms, calibrate())
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(format_table(results, baseline, calibration_ms))
+    print(f"calibration: {calibration_ms:.2f} ms")
+    sizes = prompt_sizes(corpus)
+    print("prompt: " + " / ".join(f"{fmt} {v['est_tokens']:,.0f} tokens ({v['chars']:,.0f} chars)" for fmt, v in sizes.items()))
+
+    report = {'records': args.records, 'seed': args.seed, 'rounds': args.rounds,
+              'calibration_ms': calibration_ms, 'prompt_sizes': sizes, 'stages': results}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.update_baseline:
+        if baseline and args.stages:
+            # 一部の段階だけ測り直したときは、前回の calibration に換算してから差し替える
+            scale = 1 / _scale(baseline, calibration_ms)
+            scaled = {name: {k: v * scale if k.endswith('_ms') else v for k, v in r.items()} for name, r in results.items()}
+            report['stages'] = dict(baseline.get('stages', {}), **scaled)
+            report['calibration_ms'] = baseline.get('calibration_ms', calibration_ms)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"ベースラインを更新しました: {args.baseline}")
+        return 0
+    if baseline is None:
+        print("ベースラインがありません（--update-baseline で作成）", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, baseline, args.threshold, calibration_ms)
+    for name, now, base in regressions:
+        print(f"NG: {name} の p50 が {now:.3f} ms（基準 {base:.3f} ms、許容 +{args.threshold:.0%}）", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+起動時間のベンチマーク
+
+ページを開いただけのときにかかる import 時間と、再実行のたびにブラウザへ送る画像の
+バイト数（初回描画のペイロード）を測り、上限を超えたら終了コード 1 で知らせる。
+import 時間は毎回まっさらな子プロセスで測る（streamlit 自体の読み込みは差し引く）。
+
+    python bench_startup.py
+    python bench_startup.py --repeat 5 --max-import-ms 300 --max-payload-kb 64
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ページを開くだけなら読み込まれてはいけない重いモジュール
+HEAVY_MODULES = ["google.generativeai", "flatlib", "swisseph", "numpy"]
+# アプリが起動時に読み込む自前のモジュール（ai_kantei.py の先頭と同じ）
+APP_IMPORTS = ["icons", "ai_reading", "metrics", "rate_limit", "reading_cache", "reading_jobs", "timezones"]
+
+DEFAULT_MAX_IMPORT_MS = 300.0
+DEFAULT_MAX_PAYLOAD_KB = 64.0
+
+_CHILD = """
+import json, sys, time
+import streamlit
+t = time.perf_counter()
+for name in {imports!r}:
+    __import__(name)
+ms = (time.perf_counter() - t) * 1000
+print(json.dumps({{"import_ms": ms, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_imports():
+    """子プロセスで起動時の import を1回測る。"""
+    code = _CHILD.format(imports=APP_IMPORTS, heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure_payload():
+    """再実行ごとに送る画像（favicon とヘッダー画像）のバイト数。"""
+    sys.path.insert(0, APP_DIR)
+    from icons import VARIANTS, icon_bytes
+    return {name: len(icon_bytes(name)) for name in VARIANTS}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="起動時間と初回描画のペイロードを測る")
+    parser.add_argument('--repeat', type=int, default=3, help="import 時間を測る回数（中央値を使う）")
+    parser.add_argument('--max-import-ms', type=float, default=DEFAULT_MAX_IMPORT_MS)
+    parser.add_argument('--max-payload-kb', type=float, default=DEFAULT_MAX_PAYLOAD_KB)
+    args = parser.parse_args(argv)
+
+    runs = [measure_imports() for _ in range(max(1, args.repeat))]
+    import_ms = sorted(r["import_ms"] for r in runs)[len(runs) // 2]
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    payload = measure_payload()
+    payload_kb = sum(payload.values()) / 1024
+
+    print(f"import: {import_ms:.0f} ms (中央値 / {len(runs)}回)")
+    print(f"payload: {payload_kb:.1f} KB " + ", ".join(f"{k}={v:,}B" for k, v in payload.items()))
+
+    failures = []
+    if loaded:
+        failures.append(f"起動時に重いモジュールが読み込まれています: {', '.join(loaded)}")
+    if import_ms > args.max_import_ms:
+        failures.append(f"import が {import_ms:.0f} ms（上限 {args.max_import_ms:.0f} ms）")
+    if payload_kb > args.max_payload_kb:
+        failures.append(f"ペイロードが {payload_kb:.1f} KB（上限 {args.max_payload_kb:.0f} KB）")
+    for msg in failures:
+        print("NG: " + msg, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+チャート計算エンジン
+
+ai_kantei.py（Streamlit 画面）から計算部分だけを切り出したモジュール。
+Streamlit に依存しないので、バッチ処理やベンチマークからも import できる。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flatlib.datetime import Datetime
+from flatlib.geopos import GeoPos
+from flatlib.chart import Chart
+from flatlib import const
+
+from astro_defs import JP_NAMES, SIGN_LIST, RULERS, EXALTATIONS, HOUSE_THEMES, ALL_P, format_360
+from chart_model import SECT_LABELS, snapshot_from_chart
+from dignity_table import decode_details
+from metrics import span
+
+# ==========================================
+# 1. チャート計算エンジン
+# ==========================================
+# Streamlit から切り離した純粋な計算部分。
+# 入力（日時・タイムゾーン・緯度経度・ハウスシステム・天体リスト）が同じなら
+# 結果も同じなので、プロセス全体で共有する LRU/TTL キャッシュに載せる。
+# お名前などの表示用入力はキャッシュ参照の「後」で差し込む。
+
+DEFAULT_TZ = '+09:00'
+
+CHART_CACHE_SIZE = 512       # 保持するチャート数の上限
+CHART_CACHE_TTL = 60 * 60    # 秒。古いエントリは期限切れで再計算
+
+
+class ChartCache:
+    """スレッドセーフな LRU + TTL キャッシュ（ヒット/ミス数を記録）。
+
+    Streamlit は各セッションを別スレッドで動かすため、モジュール変数として
+    1つだけ持てば全セッションで共有される。計算自体はロックの外で行う。
+    """
+
+    def __init__(self, maxsize=CHART_CACHE_SIZE, ttl=CHART_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, stamp = item
+                if self.ttl is None or now - stamp < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, func):
+        value = self.get(key)
+        if value is None:
+            value = func()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+CHART_CACHE = ChartCache()
+
+
+def chart_key(input_date, input_time, lat, lon, tz=DEFAULT_TZ, hsys=const.HOUSES_WHOLE_SIGN, ids=None):
+    """キャッシュキー。日付・時刻は分単位の文字列（flatlib に渡す形）にそろえる。"""
+    ids = tuple(ids) if ids is not None else tuple(ALL_P)
+    return (input_date.strftime("%Y/%m/%d"), input_time.strftime("%H:%M"), tz, float(lat), float(lon), hsys, ids)
+
+
+def compute_snapshot(input_date, input_time, lat, lon, tz=DEFAULT_TZ, hsys=const.HOUSES_WHOLE_SIGN, ids=None):
+    """チャートを計算して ChartSnapshot を返す。キャッシュを経由しない。"""
+    all_p = list(ids) if ids is not None else list(ALL_P)
+    date_str = input_date.strftime("%Y/%m/%d")
+    time_str = input_time.strftime("%H:%M")
+    date = Datetime(date_str, time_str, tz)
+    pos = GeoPos(float(lat), float(lon))
+
+    with span("chart.flatlib"):
+        chart_whole = Chart(date, pos, hsys=hsys, IDs=all_p)
+    with span("chart.snapshot"):
+        return snapshot_from_chart(chart_whole, all_p, date_str, time_str, tz, input_date, input_time)
+
+
+def get_snapshot(input_date, input_time, lat, lon, tz=DEFAULT_TZ, hsys=const.HOUSES_WHOLE_SIGN, ids=None):
+    """キャッシュ経由で ChartSnapshot を返す（共有オブジェクトなので書き換えないこと）。"""
+    key = chart_key(input_date, input_time, lat, lon, tz, hsys, ids)
+    return CHART_CACHE.get_or_compute(
+        key, lambda: compute_snapshot(input_date, input_time, lat, lon, tz, hsys, ids)
+    )
+
+
+# ==========================================
+# 2. テキストレポート
+# ==========================================
+ASP_NAMES = {const.CONJUNCTION:'(0度)', const.SEXTILE:'(60度)', const.SQUARE:'(90度)', const.TRINE:'(120度)', const.OPPOSITION:'(180度)'}
+
+
+def house_rank(ruler_score):
+    """ハウスの強さ（支配星のディグニティ点から S〜D）。"""
+    return "S" if ruler_score >= 7 else "A" if ruler_score >= 4 else "B" if ruler_score >= 0 else "C" if ruler_score >= -4 else "D"
+
+
+def render_report_body(snap):
+    """鑑定用データ（お名前行を除く）を行のリストで返す。"""
+    lines = []
+    def log(t): lines.append(t)
+
+    sect_str = "昼チャート (Day)" if snap.is_day else "夜チャート (Night)"
+    log(f"生年月日: {snap.date_str} {snap.time_str}\nチャート区分: {sect_str}")
+    log("-" * 60)
+
+    log("【データ1: 天体位置・アングル】")
+    for k, p_id in enumerate(snap.objects):
+        sign = SIGN_LIST[snap.sign_idx[k]]
+        signlon = snap.signlon[k]
+        d, m = int(signlon), int((signlon - int(signlon)) * 60)
+        retro = " (R)" if snap.retro[k] else ""
+
+        sect_status = SECT_LABELS[int(snap.sect[k])]
+        sect_info = f" / {sect_status}" if sect_status else ""
+        abs_deg = format_360(sign, d, m)
+
+        host_ruler = RULERS.get(sign)
+        host_exalt = EXALTATIONS.get(sign, "None")
+        exalt_info = f", 高揚支援:{JP_NAMES.get(host_exalt)}" if host_exalt != "None" else ""
+
+        log(f"{JP_NAMES.get(p_id, p_id):<6}: {JP_NAMES.get(sign)} {d:02}度{m:02}分{retro} (第{snap.house[k]}ハウス){sect_info} 【360度:{abs_deg}】 / ホスト:{JP_NAMES.get(host_ruler)}{exalt_info}")
+
+    for k, label in ((snap.index(const.ASC), 'ASC'), (snap.index(const.MC), 'MC')):
+        sign = SIGN_LIST[snap.sign_idx[k]]
+        deg = int(snap.signlon[k])
+        log(f"{label:<6}: {JP_NAMES.get(sign)} {deg:02}度 (第{snap.house[k]}ハウス) 【360度:{format_360(sign, deg, 0)}】")
+
+    log(f"{'POF':<6}: {JP_NAMES.get(SIGN_LIST[snap.pof_sign_idx])} {int(snap.pof_lon % 30):02}度 (第{snap.pof_house}ハウス)")
+
+    s_sign_idx, s_deg, s_min, s_house, s_lon_abs = snap.selena
+    log(f"{'ホワイトムーン':<6}: {JP_NAMES[SIGN_LIST[s_sign_idx]]} {s_deg:02}度{s_min:02}分 (第{s_house}ハウス) / 宇宙の絶対守護パッチ 【360度:{s_lon_abs:.2f}度】")
+
+    log("-" * 60)
+
+    log("\n【データ2: ディグニティ(惑星の強さ)】")
+    scores = []
+    for k, score, mask in zip(snap.dig_idx, snap.dig_score, snap.dig_mask):
+        p_id = snap.ids[k]
+        scores.append({'name': JP_NAMES.get(p_id, p_id), 'sign': JP_NAMES.get(SIGN_LIST[snap.sign_idx[k]]), 'deg': int(snap.signlon[k]), 'score': int(score), 'mask': mask})
+    planet_score_map = snap.dignity_scores()
+
+    scores.sort(key=lambda x: x['score'], reverse=True)
+    for i, s in enumerate(scores, 1):
+        log(f"{i:<2}| {s['name']:<6}| {s['sign'][0]} {s['deg']:02}度 | {s['score']:+d} | {decode_details(s['mask'])}")
+    log("-" * 60)
+
+    log("\n【データ3: ハウス・ストレングス (Whole Sign)】")
+    for i in range(1, 13):
+        ruler_en = RULERS.get(SIGN_LIST[snap.house_sign_idx[i-1]])
+        ruler_score = planet_score_map.get(ruler_en, 0)
+        log(f"House{i:<2}: {HOUSE_THEMES[i-1]:<10} (支配星:{JP_NAMES.get(ruler_en, ruler_en)}) -> {house_rank(ruler_score)}")
+    log("-" * 60)
+
+    log("\n【■ 主要アスペクト】")
+    for a in snap.aspects:
+        i, j = a['i'], a['j']
+        id1, id2 = snap.ids[i], snap.ids[j]
+        name1 = f"{JP_NAMES.get(id1, id1)}（{snap.house[i]}ハウス）"
+        name2 = f"{JP_NAMES.get(id2, id2)}（{snap.house[j]}ハウス）"
+        asp_type = int(a['type'])
+        asp_str = ASP_NAMES.get(asp_type, f"({asp_type})")
+        log(f"{name1} ｘ {name2} {asp_str}（誤差{a['orb']:.1f}）")
+
+    return lines
+
+
+def render_report(snap, name):
+    """スナップショットから、お名前などの表示用項目を差し込んだ鑑定用データを作る。"""
+    return "\n".join(["【AI鑑定用 詳細データ】", f"お名前: {name}", *render_report_body(snap)])
+
+
+# ==========================================
+# 3. コンパクト形式（AI に送るトークンを減らす）
+# ==========================================
+# 同じ事実を「|」区切りの表で書く。桁そろえ・区切り線・360度表記・サイン名の「座」など、
+# 人が読むための飾りを省く（書式の説明は ai_reading.COMPACT_FORMAT でプロンプト側に書く）。
+# データ1〜3 の見出しはプロンプトの指示文から参照されるので残す。
+SECT_SHORT = {1: "吉", -1: "凶", 0: "中"}
+
+
+def _sign_short(sign_idx):
+    return JP_NAMES[SIGN_LIST[sign_idx]].rstrip("座")
+
+
+def short_name(p_id):
+    """天体・点の短い日本語名（コンパクト形式の表で使う）。"""
+    return JP_NAMES.get(p_id, p_id)
+
+
+def render_compact_body(snap):
+    lines = []
+    def log(t): lines.append(t)
+
+    log(f"日時={snap.date_str} {snap.time_str} 区分={'昼' if snap.is_day else '夜'}")
+
+    log("[データ1 天体] 名|座|度分|室|セクト|支配,高揚")
+    for k, p_id in enumerate(snap.objects):
+        sign = SIGN_LIST[snap.sign_idx[k]]
+        signlon = snap.signlon[k]
+        d, m = int(signlon), int((signlon - int(signlon)) * 60)
+        retro = "R" if snap.retro[k] else ""
+        host = short_name(RULERS.get(sign))
+        exalt = EXALTATIONS.get(sign)
+        if exalt:
+            host += f",{short_name(exalt)}"
+        log(f"{short_name(p_id)}|{_sign_short(snap.sign_idx[k])}|{d}°{m:02}{retro}|{snap.house[k]}|{SECT_SHORT[int(snap.sect[k])]}|{host}")
+    for k, label in ((snap.index(const.ASC), 'ASC'), (snap.index(const.MC), 'MC')):
+        log(f"{label}|{_sign_short(snap.sign_idx[k])}|{int(snap.signlon[k])}|{snap.house[k]}")
+    log(f"POF|{_sign_short(snap.pof_sign_idx)}|{int(snap.pof_lon % 30)}|{snap.pof_house}")
+    s_sign_idx, s_deg, s_min, s_house, _ = snap.selena
+    log(f"ホワイトムーン|{_sign_short(s_sign_idx)}|{s_deg}°{s_min:02}|{s_house}|宇宙の絶対守護パッチ")
+
+    log("[データ2 ディグニティ] 名|点|内訳（点の高い順）")
+    order = sorted(range(len(snap.dig_idx)), key=lambda n: int(snap.dig_score[n]), reverse=True)
+    for n in order:
+        detail = decode_details(snap.dig_mask[n]).replace("(", "").replace(")", "").replace(", ", ",")
+        log(f"{short_name(snap.ids[snap.dig_idx[n]])}|{int(snap.dig_score[n]):+d}|{detail}")
+
+    log("[データ3 ハウス] 室|テーマ|支配星|強さ")
+    planet_score_map = snap.dignity_scores()
+    for i in range(1, 13):
+        ruler_en = RULERS.get(SIGN_LIST[snap.house_sign_idx[i-1]])
+        log(f"{i}|{HOUSE_THEMES[i-1]}|{short_name(ruler_en)}|{house_rank(planet_score_map.get(ruler_en, 0))}")
+
+    log("[アスペクト] 天体1|天体2|角|誤差")
+    for a in snap.aspects:
+        log(f"{short_name(snap.ids[a['i']])}|{short_name(snap.ids[a['j']])}|{int(a['type'])}|{a['orb']:.1f}")
+
+    return lines
+
+
+def render_compact(snap, name):
+    return "\n".join([f"名前={name}", *render_compact_body(snap)])
+
+
+# 鑑定用データの形式 → 作る関数
+REPORT_FORMATS = {'full': render_report, 'compact': render_compact}
+
+
+def build_report(name, input_date, input_time, lat, lon, tz=DEFAULT_TZ, hsys=const.HOUSES_WHOLE_SIGN, ids=None, fmt='full'):
+    """キャッシュ経由で鑑定用データを作る（UI から呼ぶ入口）。fmt は REPORT_FORMATS のキー。"""
+    snap = get_snapshot(input_date, input_time, lat, lon, tz, hsys, ids)
+    with span("report.render", fmt=fmt):
+        return REPORT_FORMATS[fmt](snap, name)
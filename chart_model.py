@@ -0,0 +1,147 @@
+"""
+チャートのスナップショット（全セクション共通のデータモデル）
+
+1枚のチャートについて、黄経・サイン番号・ホールサインのハウス番号・逆行・セクト・
+ディグニティ・アスペクトを一度だけ計算して配列にまとめたもの。
+テキストレポート・JSON 出力・AI プロンプトはすべてここから作る。
+__slots__ と NumPy 配列だけで構成しているので、pickle してワーカー間で受け渡すのも軽い。
+"""
+import numpy as np
+
+from flatlib import const
+
+from astro_defs import SIGN_LIST, TRAD_P, get_planet_sect_status, get_selena_data, tz_offset_hours
+from aspect_engine import find_aspects, make_points
+from dignity_table import PLANET_INDEX, decode_details, score_batch
+
+SECT_CODES = {"In Sect(吉)": 1, "Out of Sect(凶)": -1, "Neutral": 0}
+SECT_LABELS = {v: k for k, v in SECT_CODES.items()}
+
+
+def house_of(sign_idx, asc_idx):
+    """ホールサインのハウス番号（ASC のサインを第1ハウスとする）。配列にもそのまま使える。"""
+    return (sign_idx - asc_idx) % 12 + 1
+
+
+class ChartSnapshot:
+    """1枚のチャートの計算結果。
+
+    points は天体（n_objects 個）のあとに ASC・MC を並べたもの。
+    各配列は points と同じ順番で、dig_* は古典7天体（TRAD_P の順、dig_idx が points 内の位置）。
+    asp_points はアスペクト計算用の Points（シナストリーの相互グリッドでもそのまま使う）。
+    """
+    __slots__ = (
+        'date_str', 'time_str', 'tz', 'is_day',
+        'ids', 'n_objects', 'lon', 'signlon', 'speed', 'sign_idx', 'house', 'retro', 'sect',
+        'asc_idx', 'house_sign_idx', 'pof_lon', 'selena',
+        'dig_idx', 'dig_score', 'dig_mask', 'aspects', 'asp_points',
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    # --- 取り出し用 ---
+    def index(self, point_id):
+        return self.ids.index(point_id)
+
+    @property
+    def objects(self):
+        return self.ids[:self.n_objects]
+
+    @property
+    def asc_lon(self):
+        return float(self.lon[self.n_objects])
+
+    @property
+    def pof_sign_idx(self):
+        return int(self.pof_lon // 30)
+
+    @property
+    def pof_house(self):
+        return house_of(self.pof_sign_idx, self.asc_idx)
+
+    def dignity_scores(self):
+        """{天体ID: 点数}"""
+        return {self.ids[i]: int(s) for i, s in zip(self.dig_idx, self.dig_score)}
+
+    # --- シリアライズ ---
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+    def to_dict(self):
+        """JSON にそのまま書ける辞書。"""
+        return {
+            'date': self.date_str, 'time': self.time_str, 'tz': self.tz,
+            'sect': 'day' if self.is_day else 'night',
+            'points': [
+                {
+                    'id': p, 'lon': float(self.lon[k]), 'sign': SIGN_LIST[self.sign_idx[k]],
+                    'house': int(self.house[k]), 'retro': bool(self.retro[k]),
+                    'speed': float(self.speed[k]), 'sect': SECT_LABELS[int(self.sect[k])],
+                }
+                for k, p in enumerate(self.ids)
+            ],
+            'houses': [SIGN_LIST[s] for s in self.house_sign_idx],
+            'pof': {'lon': self.pof_lon, 'sign': SIGN_LIST[self.pof_sign_idx], 'house': self.pof_house},
+            'selena': dict(zip(('sign', 'deg', 'min', 'house', 'lon'), (SIGN_LIST[self.selena[0]], *self.selena[1:]))),
+            'dignity': [
+                {'id': self.ids[i], 'score': int(s), 'detail': decode_details(m)}
+                for i, s, m in zip(self.dig_idx, self.dig_score, self.dig_mask)
+            ],
+            'aspects': [
+                {'p1': self.ids[a['i']], 'p2': self.ids[a['j']], 'type': int(a['type']), 'orb': float(a['orb'])}
+                for a in self.aspects
+            ],
+        }
+
+
+def snapshot_from_chart(chart, ids, date_str, time_str, tz, input_date, input_time):
+    """flatlib の Chart から ChartSnapshot を作る（chart.get を呼ぶのはここだけ）。"""
+    ids = list(ids)
+    points = ids + [const.ASC, const.MC]
+    objs = [chart.get(p) for p in points]
+    n_obj = len(ids)
+
+    lon = np.array([o.lon for o in objs])
+    signlon = np.array([o.signlon for o in objs])
+    sign_idx = np.array([SIGN_LIST.index(o.sign) for o in objs], dtype=np.int8)
+    speed = np.array([getattr(o, 'lonspeed', 0.0) for o in objs])
+    retro = np.array([o.isRetrograde() if k < n_obj else False for k, o in enumerate(objs)], dtype=bool)
+    asc_idx = int(sign_idx[n_obj])
+    house = house_of(sign_idx, asc_idx).astype(np.int8)
+
+    sun = points.index(const.SUN)
+    moon = points.index(const.MOON)
+    is_day = bool(7 <= house[sun] <= 12)
+    sect = np.array([SECT_CODES[get_planet_sect_status(p, is_day)] if k < n_obj else 0 for k, p in enumerate(points)], dtype=np.int8)
+
+    asc_lon, sun_lon, moon_lon = lon[n_obj], lon[sun], lon[moon]
+    if is_day: pof_lon = float((asc_lon + moon_lon - sun_lon) % 360)
+    else: pof_lon = float((asc_lon + sun_lon - moon_lon) % 360)
+
+    s_sign, s_deg, s_min, s_house, s_lon = get_selena_data(input_date, input_time, asc_idx, tz_offset_hours(tz))
+    selena = (SIGN_LIST.index(s_sign), s_deg, s_min, s_house, s_lon)
+
+    house_sign_idx = np.array([SIGN_LIST.index(chart.get(f'House{i}').sign) for i in range(1, 13)], dtype=np.int8)
+
+    dig_idx = np.array([ids.index(p) for p in TRAD_P if p in ids], dtype=np.int8)
+    dig_planets = [PLANET_INDEX[ids[k]] for k in dig_idx]
+    dig_score, dig_mask = score_batch(dig_planets, lon[dig_idx], is_day)
+
+    # アスペクトの能動/受動判定用の速度（惑星以外は -1）とオーブは flatlib の定義に合わせる
+    asp_speed = [abs(o.lonspeed) if o.isPlanet() else -1.0 for o in objs]
+    asp_points = make_points(points, lon, asp_speed, [o.orb() for o in objs])
+    aspects = find_aspects(asp_points)
+
+    return ChartSnapshot(
+        date_str=date_str, time_str=time_str, tz=tz, is_day=is_day,
+        ids=tuple(points), n_objects=n_obj, lon=lon, signlon=signlon, speed=speed,
+        sign_idx=sign_idx, house=house, retro=retro, sect=sect,
+        asc_idx=asc_idx, house_sign_idx=house_sign_idx, pof_lon=pof_lon, selena=selena,
+        dig_idx=dig_idx, dig_score=dig_score, dig_mask=dig_mask, aspects=aspects, asp_points=asp_points,
+    )
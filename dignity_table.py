@@ -0,0 +1,96 @@
+"""
+ディグニティ早見表
+
+calculate_dignity_score をサイン(12) × 整数度(30) × 古典7天体 × 昼夜(2) の全組み合わせで
+先に計算しておき、点数と内訳ビットマスクの配列として持つ。
+ターム（度数 < 境界）もフェイス（度数 // 10）も境界が整数なので、度数の小数部は
+結果に影響せず、整数度で引いた値は元の関数と完全に一致する。
+内訳の文字列は必要になったときだけビットマスクから組み立てる。
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from astro_defs import SIGN_LIST, TRAD_P, calculate_dignity_score
+
+# 内訳ラベル（calculate_dignity_score が details に追加する順番どおり）
+DETAIL_LABELS = ["Ruler(+5)", "Exalt(+4)", "Trip(+3)", "Term(+2)", "Face(+1)", "Detriment(-5)", "Fall(-4)", "Peregrine(-5)"]
+_LABEL_BITS = {label: 1 << i for i, label in enumerate(DETAIL_LABELS)}
+
+PLANET_INDEX = {p: i for i, p in enumerate(TRAD_P)}
+SIGN_INDEX = {s: i for i, s in enumerate(SIGN_LIST)}
+
+
+def _build_tables():
+    scores = np.zeros((12, 30, len(TRAD_P), 2), dtype=np.int8)
+    masks = np.zeros((12, 30, len(TRAD_P), 2), dtype=np.uint8)
+    for s_idx, sign in enumerate(SIGN_LIST):
+        for deg in range(30):
+            for p_idx, planet in enumerate(TRAD_P):
+                for is_day in (0, 1):
+                    score, detail = calculate_dignity_score(planet, sign, deg, bool(is_day))
+                    mask = 0
+                    for label in detail.split(", "):
+                        mask |= _LABEL_BITS[label]
+                    scores[s_idx, deg, p_idx, is_day] = score
+                    masks[s_idx, deg, p_idx, is_day] = mask
+    scores.flags.writeable = False
+    masks.flags.writeable = False
+    return scores, masks
+
+
+# [サイン, 整数度, 天体, 昼=1/夜=0]
+SCORE_TABLE, DETAIL_TABLE = _build_tables()
+
+
+@lru_cache(maxsize=256)
+def decode_details(mask):
+    """ビットマスクを calculate_dignity_score と同じ内訳文字列に戻す。"""
+    mask = int(mask)
+    return ", ".join(label for i, label in enumerate(DETAIL_LABELS) if mask & (1 << i))
+
+
+def _deg_index(degree):
+    d = int(degree)
+    return 29 if d > 29 else d
+
+
+def dignity_lookup(planet, sign, degree, is_day):
+    """表引き版。点数とビットマスクを返す（文字列は作らない）。"""
+    idx = (SIGN_INDEX[sign], _deg_index(degree), PLANET_INDEX[planet], 1 if is_day else 0)
+    return int(SCORE_TABLE[idx]), int(DETAIL_TABLE[idx])
+
+
+def dignity_score(planet, sign, degree, is_day):
+    """calculate_dignity_score と同じ (点数, 内訳文字列) を表引きで返す。"""
+    if planet not in PLANET_INDEX or sign not in SIGN_INDEX:
+        return calculate_dignity_score(planet, sign, degree, is_day)
+    score, mask = dignity_lookup(planet, sign, degree, is_day)
+    return score, decode_details(mask)
+
+
+def _planet_indices(planets):
+    arr = np.asarray(planets)
+    if arr.dtype.kind in 'iu':
+        return arr.astype(np.intp)
+    return np.array([PLANET_INDEX[p] for p in arr.ravel()], dtype=np.intp).reshape(arr.shape)
+
+
+def score_batch(planets, lons, is_day):
+    """(天体, 黄経0-360度, 昼チャートか) の配列をまとめて採点する。
+
+    planets は TRAD_P の天体名か、その並びの番号(0=太陽 … 6=土星)。
+    配列はブロードキャストされる。戻り値は (点数 int8 配列, ビットマスク uint8 配列)。
+    """
+    p_idx = _planet_indices(planets)
+    lon = np.mod(np.asarray(lons, dtype=np.float64), 360.0)
+    sign_idx = (lon // 30).astype(np.intp)
+    deg_idx = np.minimum((lon - sign_idx * 30).astype(np.intp), 29)
+    sign_idx = np.minimum(sign_idx, 11)
+    day_idx = np.asarray(is_day, dtype=np.intp)
+    return SCORE_TABLE[sign_idx, deg_idx, p_idx, day_idx], DETAIL_TABLE[sign_idx, deg_idx, p_idx, day_idx]
+
+
+def decode_batch(masks):
+    """ビットマスク配列を内訳文字列のリストに戻す。"""
+    return [decode_details(m) for m in np.asarray(masks).ravel()]
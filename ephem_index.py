@@ -0,0 +1,301 @@
+"""
+イングレス・留の索引（サインと逆行をその場で暦計算せずに引く）
+
+鑑定データの多く（サイン・ホールサインのハウス・支配星・昼夜）は、天体の正確な黄経ではなく
+「どのサインにいるか」だけで決まる。そこで 1900年〜数年先 の各天体のイングレス（サイン移動）と
+逆行の始まり・終わりの時刻を一度だけ求め、天体ごとに時刻順の配列として
+.cache/ephem_index/ に保存しておく。ある瞬間のサインと逆行は、その配列の二分探索で決まる。
+
+境界の時刻は TOLERANCE（約0.1秒）まで詰めてあり、境界から AMBIGUOUS（留は STATION_AMBIGUOUS）
+以内の瞬間と索引の範囲外だけは swisseph で計算し直すので、結果は Chart を作った場合と一致する。
+
+    python ephem_index.py    # 索引を作り（古ければ作り直し）、ランダムな時刻で照合する
+"""
+import datetime
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from flatlib import const
+from flatlib.datetime import Datetime
+from flatlib.ephem import swe
+
+from astro_defs import ALL_P, JP_NAMES, RULERS, SIGN_LIST
+from chart_model import house_of
+from selena import selena_from_jd
+from transits import Ephem, refine, znorm
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.environ.get("AI_KANTEI_EPHEM_INDEX", os.path.join(APP_DIR, ".cache", "ephem_index"))
+INDEX_VERSION = 2
+
+START_DATE = datetime.date(1900, 1, 1)   # 画面の生年月日の下限と同じ
+MARGIN_YEARS = 2                         # 作成日から何年先まで入れるか
+TOLERANCE = 1e-6                         # 境界の時刻の精度（日）
+AMBIGUOUS = 1e-5                         # イングレスからこれ以内なら swisseph で確かめる（日）
+# 外惑星の留の前後は速度がほぼ一定のまま続き、swisseph の速度の判定が数秒ぶれるので広めにとる
+STATION_AMBIGUOUS = 1e-3
+# flatlib は |速度| がこれ未満を「留」とし、逆行（isRetrograde）に数えない
+STATIONARY_SPEED = 0.0003
+
+# 天体ごとのサンプリング間隔（日）。1区間で動くのが1サイン未満・留が2回入らない長さにする
+SCAN_STEP = {
+    const.SUN: 5.0, const.MOON: 0.5, const.MERCURY: 1.0, const.VENUS: 2.0, const.MARS: 2.0,
+    const.JUPITER: 5.0, const.SATURN: 5.0, const.URANUS: 10.0, const.NEPTUNE: 10.0, const.PLUTO: 10.0,
+    const.NORTH_NODE: 5.0,
+}
+
+
+# ==========================================
+# 1. 索引の作成
+# ==========================================
+def _sign(lon):
+    return int(lon // 30) % 12
+
+
+def _is_retro(speed):
+    return speed <= -STATIONARY_SPEED
+
+
+def _body_index(body, jd0, jd1):
+    """body の [(イングレス時刻, 入ったサイン)] と [(逆行の切り替わり時刻, 逆行に入ったか)]。
+
+    どちらも先頭に jd0 の時点の状態を入れておく（二分探索の起点）。
+    逆行は flatlib と同じく速度が -STATIONARY_SPEED 以下のときとする。
+    """
+    eph = Ephem(body)
+    step = SCAN_STEP[body]
+    lon0, spd0 = eph(jd0)
+    ingresses = [(jd0, _sign(lon0))]
+    stations = [(jd0, _is_retro(spd0))]
+
+    def speed_crossing(a, b, spd_a, spd_b, level):
+        # 速度が level を横切る時刻（加速度は区間の両端の差分で近似）
+        accel = (spd_b - spd_a) / (b - a)
+        def g(t):
+            _, s = eph(t)
+            return s - level, accel
+        return refine(g, a, b, spd_a - level, spd_b - level, TOLERANCE)
+
+    def crossings(a, b, lon_a, lon_b):
+        # 順行・逆行が変わらない区間（1サイン未満の移動）で横切ったサインの境界は高々1つ
+        if _sign(lon_a) == _sign(lon_b):
+            return
+        forward = znorm(lon_b - lon_a) > 0
+        cusp = (_sign(lon_a) + 1) % 12 * 30.0 if forward else _sign(lon_a) * 30.0
+
+        def f(t):
+            lon, s = eph(t)
+            return znorm(lon - cusp), s
+        t = refine(f, a, b, znorm(lon_a - cusp), znorm(lon_b - cusp), TOLERANCE)
+        ingresses.append((t, _sign(cusp) if forward else (_sign(cusp) - 1) % 12))
+
+    t0 = jd0
+    while t0 < jd1:
+        t1 = min(t0 + step, jd1)
+        lon1, spd1 = eph(t1)
+        if (spd0 < 0) != (spd1 < 0):
+            # 留（速度 0）をはさむ区間は留の時刻で2つに分けて、それぞれでサインの境界を調べる
+            ts = speed_crossing(t0, t1, spd0, spd1, 0.0)
+            lon_s, _ = eph(ts)
+            crossings(t0, ts, lon0, lon_s)
+            crossings(ts, t1, lon_s, lon1)
+        else:
+            crossings(t0, t1, lon0, lon1)
+        if _is_retro(spd0) != _is_retro(spd1):
+            stations.append((speed_crossing(t0, t1, spd0, spd1, -STATIONARY_SPEED), _is_retro(spd1)))
+        t0, lon0, spd0 = t1, lon1, spd1
+    return ingresses, stations, eph.calls
+
+
+def _concat(per_body, dtype):
+    """天体ごとの [(時刻, 値)] を1本の配列と区切り位置にまとめる。"""
+    offsets = np.zeros(len(per_body) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(rows) for rows in per_body])
+    jd = np.array([t for rows in per_body for t, _ in rows], dtype=np.float64)
+    value = np.array([v for rows in per_body for _, v in rows], dtype=dtype)
+    return jd, value, offsets
+
+
+def build_index(out_dir=INDEX_DIR, bodies=ALL_P, start=START_DATE, end=None):
+    """start〜end（既定は今日から MARGIN_YEARS 年先）の索引を作って out_dir に保存する。"""
+    end = end or datetime.date(datetime.date.today().year + MARGIN_YEARS, 1, 1)
+    jd0 = Datetime(start.strftime("%Y/%m/%d"), "00:00", "+00:00").jd
+    jd1 = Datetime(end.strftime("%Y/%m/%d"), "00:00", "+00:00").jd
+    ingresses, stations, calls = [], [], 0
+    for body in bodies:
+        ing, sta, n = _body_index(body, jd0, jd1)
+        ingresses.append(ing)
+        stations.append(sta)
+        calls += n
+
+    arrays = {}
+    arrays['ingress_jd'], arrays['ingress_sign'], arrays['ingress_off'] = _concat(ingresses, np.int8)
+    arrays['station_jd'], arrays['station_retro'], arrays['station_off'] = _concat(stations, np.bool_)
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+    meta = {
+        'version': INDEX_VERSION, 'bodies': list(bodies), 'jd_start': jd0, 'jd_end': jd1,
+        'start': start.isoformat(), 'end': end.isoformat(), 'ephemeris_calls': calls,
+    }
+    # meta.json は最後に書く（途中で止まったら次回作り直される）
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def _index_is_fresh(out_dir, bodies):
+    try:
+        with open(os.path.join(out_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    # 今日の分が範囲に入っていなければ作り直す（先の日付は作成日から MARGIN_YEARS 年分）
+    today = datetime.date.today().isoformat()
+    return meta.get('version') == INDEX_VERSION and set(bodies) <= set(meta['bodies']) and meta['end'] > today
+
+
+# ==========================================
+# 2. 引き当て
+# ==========================================
+class EphemIndex:
+    """索引をメモリマップで開いて、サインと逆行を二分探索で引く。"""
+
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.bodies = self.meta['bodies']
+        self.jd_start, self.jd_end = self.meta['jd_start'], self.meta['jd_end']
+        arrays = {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r')
+            for name in ('ingress_jd', 'ingress_sign', 'ingress_off', 'station_jd', 'station_retro', 'station_off')
+        }
+        self.counts = {'ingress': len(arrays['ingress_jd']), 'station': len(arrays['station_jd'])}
+        # 天体ごとの区間（メモリマップのままのビュー）を先に切り出しておく
+        self._ingress, self._station = {}, {}
+        for b, body in enumerate(self.bodies):
+            lo, hi = int(arrays['ingress_off'][b]), int(arrays['ingress_off'][b + 1])
+            self._ingress[body] = (arrays['ingress_jd'][lo:hi], arrays['ingress_sign'][lo:hi])
+            lo, hi = int(arrays['station_off'][b]), int(arrays['station_off'][b + 1])
+            self._station[body] = (arrays['station_jd'][lo:hi], arrays['station_retro'][lo:hi])
+
+    def _lookup(self, table, jds, window):
+        """jds（配列）の各時刻の値。境界から window 以内・範囲外のものは valid が False。"""
+        t, values = table
+        k = np.clip(np.searchsorted(t, jds, side='right') - 1, 0, len(t) - 1)
+        valid = (jds >= self.jd_start) & (jds < self.jd_end)
+        # 先頭は範囲の始まり（本当の境界ではない）なので、前の境界との距離は k > 0 のときだけ見る
+        valid &= (k == 0) | (jds - t[k] > window)
+        nxt = np.minimum(k + 1, len(t) - 1)
+        valid &= (nxt == k) | (t[nxt] - jds > window)
+        return values[k], valid
+
+    def signs(self, body, jds):
+        """body のサイン番号の配列（jds と同じ形）と、索引で決まったかどうか。"""
+        return self._lookup(self._ingress[body], np.asarray(jds, dtype=np.float64), AMBIGUOUS)
+
+    def retrogrades(self, body, jds):
+        return self._lookup(self._station[body], np.asarray(jds, dtype=np.float64), STATION_AMBIGUOUS)
+
+
+@lru_cache(maxsize=None)
+def get_ephem_index(index_dir=INDEX_DIR, bodies=tuple(ALL_P)):
+    """プロセスで1つの EphemIndex。索引が無いか古ければ作り直してから開く。"""
+    if not _index_is_fresh(index_dir, bodies):
+        build_index(index_dir, bodies)
+    return EphemIndex(index_dir)
+
+
+def sign_positions(jds, ids=ALL_P, index=None, stats=None):
+    """各時刻・各天体の (サイン番号, 逆行) を (時刻数, 天体数) の配列で返す。
+
+    天体ごとに全時刻をまとめて二分探索し、索引で決まらないもの（境界の近く・範囲外）だけ
+    swisseph で計算する。stats に辞書を渡すと 'indexed' / 'ephemeris' の件数を足し込む。
+    """
+    index = index or get_ephem_index()
+    jds = np.atleast_1d(np.asarray(jds, dtype=np.float64))
+    signs = np.empty((len(jds), len(ids)), dtype=np.int8)
+    retro = np.empty((len(jds), len(ids)), dtype=bool)
+    fallback = 0
+    for n, body in enumerate(ids):
+        signs[:, n], ok_sign = index.signs(body, jds)
+        retro[:, n], ok_retro = index.retrogrades(body, jds)
+        for k in np.flatnonzero(~(ok_sign & ok_retro)):
+            obj = swe.sweObject(body, jds[k])
+            signs[k, n], retro[k, n] = _sign(obj['lon']), _is_retro(obj['lonspeed'])
+            fallback += 1
+    if stats is not None:
+        stats['indexed'] = stats.get('indexed', 0) + signs.size - fallback
+        stats['ephemeris'] = stats.get('ephemeris', 0) + fallback
+    return signs, retro
+
+
+# ==========================================
+# 3. サイン単位のチャート（バッチ用の高速経路）
+# ==========================================
+def sign_charts(births, ids=ALL_P, index=None, stats=None):
+    """サイン・ホールサインのハウス・逆行・支配星・昼夜・セレナだけのチャート（JSON にそのまま書ける辞書）のリスト。
+
+    births は (生年月日, 出生時間, 緯度, 経度, tz) の並び。天体は全員分をまとめて索引から引き、
+    swisseph は ASC・MC（1人1回のハウス計算）と境界付近の天体だけに使う。
+    """
+    births = list(births)
+    jds = [Datetime(d.strftime("%Y/%m/%d"), t.strftime("%H:%M"), tz).jd for d, t, _, _, tz in births]
+    all_signs, all_retro = sign_positions(jds, ids, index, stats)
+    angles = [swe.sweHousesLon(jd, float(lat), float(lon), const.HOUSES_WHOLE_SIGN)[1]
+              for (_, _, lat, lon, _), jd in zip(births, jds)]
+    ascs = [_sign(a[0]) for a in angles]
+    # ホワイトムーン（セレナ）も全員分をまとめて計算する
+    selena = selena_from_jd(jds, ascs)
+    sun = list(ids).index(const.SUN)
+    charts = []
+    for k, ((d, t, lat, lon, tz), signs, retro) in enumerate(zip(births, all_signs, all_retro)):
+        asc, mc = ascs[k], _sign(angles[k][1])
+        houses = house_of(signs, asc)
+        charts.append({
+            'date': d.strftime("%Y/%m/%d"), 'time': t.strftime("%H:%M"), 'tz': tz,
+            'sect': 'day' if 7 <= houses[sun] <= 12 else 'night',
+            'asc': SIGN_LIST[asc], 'mc': SIGN_LIST[mc],
+            'points': [
+                {'id': p, 'sign': SIGN_LIST[s], 'house': int(h), 'retro': bool(r), 'ruler': RULERS[SIGN_LIST[s]]}
+                for p, s, h, r in zip(ids, signs, houses, retro)
+            ],
+            'houses': [SIGN_LIST[(asc + i) % 12] for i in range(12)],
+            'selena': {'sign': SIGN_LIST[selena.sign_idx[k]], 'house': int(selena.house[k])},
+        })
+    return charts
+
+
+def sign_chart(input_date, input_time, lat, lon, tz='+09:00', ids=ALL_P, index=None, stats=None):
+    """1人分の sign_charts。"""
+    return sign_charts([(input_date, input_time, lat, lon, tz)], ids, index, stats)[0]
+
+
+if __name__ == '__main__':
+    t = time.perf_counter()
+    idx = get_ephem_index()
+    print(f"索引: {idx.meta['start']}〜{idx.meta['end']} / イングレス {idx.counts['ingress']:,}件・留 {idx.counts['station']:,}件"
+          f"（読み込み {time.perf_counter() - t:.1f}秒）")
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    jds = np.random.default_rng(0).uniform(idx.jd_start, idx.jd_end, n)
+    stats = {}
+    t = time.perf_counter()
+    signs, retro = sign_positions(jds, idx.bodies, idx, stats)
+    indexed = time.perf_counter() - t
+    mismatch = 0
+    t = time.perf_counter()
+    for k, jd in enumerate(jds):
+        for m, body in enumerate(idx.bodies):
+            obj = swe.sweObject(body, jd)
+            if signs[k, m] != _sign(obj['lon']) or retro[k, m] != _is_retro(obj['lonspeed']):
+                mismatch += 1
+                print(f"不一致: {JP_NAMES[body]} jd={jd:.6f}", file=sys.stderr)
+    direct = time.perf_counter() - t
+    print(f"照合: {n:,}時刻 × {len(idx.bodies)}天体 / 不一致 {mismatch}件 / swisseph で計算し直し {stats['ephemeris']}件")
+    print(f"索引 {indexed * 1e6 / n:.1f} µs/時刻 / swisseph {direct * 1e6 / n:.1f} µs/時刻")
+    sys.exit(1 if mismatch else 0)
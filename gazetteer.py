@@ -0,0 +1,301 @@
+"""
+オフラインの地名検索（出生地 → 緯度経度・タイムゾーン）
+
+data/gazetteer.csv（地名・都道府県・国・英語名・緯度経度・IANA タイムゾーン）から
+検索用の索引を作り、.cache/gazetteer/ に NumPy 配列として保存しておく。
+2回目以降はメモリマップで開くだけなので、起動も検索も速く、通信もしない。
+
+- 地名検索: 正規化したキーの3文字組（トライグラム）の転置索引。入力途中の前方一致は
+  先頭記号つきのトライグラムで、1文字だけのときはキーの並びを二分探索して引く。
+- 座標 → タイムゾーン: 2度四方のグリッドに地点を振り分けた索引で最寄りの地点を探し、
+  そのタイムゾーンを使う（国境付近では地図の境界と違うことがある）。登録地点は多くないので、
+  最寄りでも TZ_MAX_KM より遠ければ「わからない」（None）とする。
+
+    python gazetteer.py 富山    # 検索の確認（索引が古ければ作り直す）
+"""
+import json
+import math
+import os
+import sys
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.path.join(APP_DIR, "data", "gazetteer.csv")
+INDEX_DIR = os.environ.get("AI_KANTEI_GAZETTEER_INDEX", os.path.join(APP_DIR, ".cache", "gazetteer"))
+INDEX_VERSION = 1
+
+FIELDS = ('name', 'admin', 'country', 'name_en')
+GRID_DEG = 2.0            # タイムゾーン用グリッドの1マスの大きさ（度）
+PREFIX_MARK = "\x02"      # キーの先頭を表す記号（前方一致のトライグラム用）
+EARTH_KM = 6371.0
+TZ_MAX_KM = 150.0         # これより遠い地点のタイムゾーンは当てにしない
+
+
+class Place(NamedTuple):
+    name: str
+    admin: str
+    country: str
+    name_en: str
+    lat: float
+    lon: float
+    tz: str
+
+    def label(self):
+        admin = f"（{self.admin}）" if self.admin else ""
+        return f"{self.name}{admin} {self.name_en} / {self.tz}"
+
+
+def normalize(text):
+    """検索用の正規化（全角半角・大文字小文字をそろえ、空白と記号を除く）。"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return "".join(c for c in text if c.isalnum())
+
+
+def _trigrams(key):
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+def _gram_code(gram):
+    # 3文字を21ビットずつ詰めた整数（Unicode の範囲に収まるので衝突しない）
+    a, b, c = (ord(ch) for ch in gram)
+    return (a << 42) | (b << 21) | c
+
+
+def _cell(lat, lon):
+    rows = int(180 / GRID_DEG)
+    cols = int(360 / GRID_DEG)
+    r = min(int((lat + 90) // GRID_DEG), rows - 1)
+    c = int(((lon + 180) % 360) // GRID_DEG) % cols
+    return r, c
+
+
+def _csr(keys, values):
+    """(キー, 値) の組を、ソート済みのキー・区切り位置・値の3配列にまとめる。"""
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    uniq, starts = np.unique(keys, return_index=True)
+    offsets = np.append(starts, len(keys)).astype(np.int32)
+    return uniq, offsets, values.astype(np.int32)
+
+
+# ==========================================
+# 1. 索引の作成
+# ==========================================
+def read_places(path=DATA_PATH):
+    import csv
+    with open(path, encoding="utf-8", newline="") as f:
+        return [
+            Place(r['name'], r['admin'], r['country'], r['name_en'], float(r['lat']), float(r['lon']), r['tz'])
+            for r in csv.DictReader(f)
+        ]
+
+
+def build_index(path=DATA_PATH, out_dir=INDEX_DIR):
+    """CSV から索引を作って out_dir に保存する。"""
+    places = read_places(path)
+    tz_names = sorted({p.tz for p in places})
+
+    # 文字列は1本の UTF-8 のバイト列と、その区切り位置で持つ（地点 k の項目 f は k*4+f 番目）
+    blobs = [getattr(p, f).encode("utf-8") for p in places for f in FIELDS]
+    text_off = np.zeros(len(blobs) + 1, dtype=np.int64)
+    text_off[1:] = np.cumsum([len(b) for b in blobs])
+    text = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+
+    # 検索キー（地名・英語名・都道府県＋地名）。前方一致用に辞書順に並べておく
+    keys = []
+    for k, p in enumerate(places):
+        for key in {normalize(p.name), normalize(p.name_en), normalize(p.admin + p.name)}:
+            if key:
+                keys.append((key, k))
+    keys.sort()
+    key_blobs = [key.encode("utf-8") for key, _ in keys]
+    key_off = np.zeros(len(keys) + 1, dtype=np.int64)
+    key_off[1:] = np.cumsum([len(b) for b in key_blobs])
+    key_text = np.frombuffer(b"".join(key_blobs), dtype=np.uint8)
+    key_place = np.array([k for _, k in keys], dtype=np.int32)
+
+    # トライグラム → キー番号の転置索引
+    gram_codes, gram_keys = [], []
+    for n, (key, _) in enumerate(keys):
+        for gram in _trigrams(PREFIX_MARK + key):
+            gram_codes.append(_gram_code(gram))
+            gram_keys.append(n)
+    gram_code, gram_off, gram_post = _csr(np.array(gram_codes, dtype=np.int64), np.array(gram_keys, dtype=np.int64))
+
+    # タイムゾーン用グリッド: マス番号 → 地点番号
+    cols = int(360 / GRID_DEG)
+    cells = np.array([r * cols + c for r, c in (_cell(p.lat, p.lon) for p in places)], dtype=np.int64)
+    cell_id, cell_off, cell_post = _csr(cells, np.arange(len(places), dtype=np.int64))
+
+    arrays = {
+        'lat': np.array([p.lat for p in places]), 'lon': np.array([p.lon for p in places]),
+        'tz': np.array([tz_names.index(p.tz) for p in places], dtype=np.int16),
+        'text': text, 'text_off': text_off,
+        'key_text': key_text, 'key_off': key_off, 'key_place': key_place,
+        'gram_code': gram_code, 'gram_off': gram_off, 'gram_post': gram_post,
+        'cell_id': cell_id, 'cell_off': cell_off, 'cell_post': cell_post,
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+    meta = {'version': INDEX_VERSION, 'source_mtime': os.path.getmtime(path), 'count': len(places), 'tz_names': tz_names}
+    # meta.json は最後に書く（途中で止まったら次回作り直される）
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+
+def _index_is_fresh(path, out_dir):
+    try:
+        with open(os.path.join(out_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get('version') == INDEX_VERSION and meta.get('source_mtime') == os.path.getmtime(path)
+
+
+# ==========================================
+# 2. 検索
+# ==========================================
+class Gazetteer:
+    """索引をメモリマップで開いて、地名検索と座標 → タイムゾーンの引き当てをする。"""
+
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.tz_names = self.meta['tz_names']
+        for name in ('lat', 'lon', 'tz', 'text', 'text_off', 'key_text', 'key_off', 'key_place',
+                     'gram_code', 'gram_off', 'gram_post', 'cell_id', 'cell_off', 'cell_post'):
+            setattr(self, name, np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r'))
+        self._cols = int(360 / GRID_DEG)
+
+    def __len__(self):
+        return self.meta['count']
+
+    def _text(self, n):
+        return bytes(self.text[self.text_off[n]:self.text_off[n + 1]]).decode("utf-8")
+
+    def _key(self, n):
+        return bytes(self.key_text[self.key_off[n]:self.key_off[n + 1]]).decode("utf-8")
+
+    def place(self, k):
+        base = k * len(FIELDS)
+        fields = [self._text(base + f) for f in range(len(FIELDS))]
+        return Place(*fields, float(self.lat[k]), float(self.lon[k]), self.tz_names[int(self.tz[k])])
+
+    def _postings(self, gram):
+        i = np.searchsorted(self.gram_code, _gram_code(gram))
+        if i >= len(self.gram_code) or self.gram_code[i] != _gram_code(gram):
+            return None
+        return self.gram_post[self.gram_off[i]:self.gram_off[i + 1]]
+
+    def _prefix_keys(self, q):
+        """q で始まるキーの番号（キーは辞書順なので二分探索で範囲を求める）。"""
+        lo, hi = 0, len(self.key_place)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < q:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < len(self.key_place) and self._key(lo).startswith(q):
+            found.append(lo)
+            lo += 1
+        return found
+
+    def _gram_keys(self, grams):
+        """すべてのトライグラムを含むキーの番号（転置リストの共通部分）。"""
+        result = None
+        for gram in sorted(grams):
+            post = self._postings(gram)
+            if post is None:
+                return []
+            result = np.asarray(post) if result is None else np.intersect1d(result, post, assume_unique=True)
+            if not len(result):
+                return []
+        return [] if result is None else result.tolist()
+
+    def search(self, query, limit=10):
+        """地名の一部（入力途中でもよい）から候補の Place を返す。前方一致を先に並べる。"""
+        q = normalize(query)
+        if not q:
+            return []
+        if len(q) == 1:
+            prefix = self._prefix_keys(q)
+            partial = []
+        else:
+            prefix = [n for n in self._gram_keys(_trigrams(PREFIX_MARK + q)) if self._key(n).startswith(q)]
+            partial = []
+            if len(q) >= 3:
+                partial = [n for n in self._gram_keys(_trigrams(q)) if q in self._key(n)]
+
+        seen, hits = set(), []
+        # 前方一致 → 部分一致の順。同じ順位の中は CSV の並び（主な都市を先に書いてある）
+        for group in (prefix, partial):
+            for k in sorted({int(self.key_place[n]) for n in group} - seen):
+                seen.add(k)
+                hits.append(k)
+        return [self.place(k) for k in hits[:limit]]
+
+    def nearest(self, lat, lon, max_km=None):
+        """最寄りの地点 (Place, 距離km)。グリッドのマスを内側から外側へ広げて探す。
+
+        max_km より近い地点がなければ (None, inf)。
+        """
+        r0, c0 = _cell(lat, lon)
+        rows = int(180 / GRID_DEG)
+        best, best_d = None, float('inf')
+        cell_km = GRID_DEG * 111.2 * max(math.cos(math.radians(min(abs(lat), 89))), 0.05)
+        for ring in range(max(rows, self._cols)):
+            # このリングより外側の地点は best より遠いとわかったら終わり
+            if (ring - 1) * cell_km > min(best_d, max_km or float('inf')):
+                break
+            for r in range(r0 - ring, r0 + ring + 1):
+                if not 0 <= r < rows:
+                    continue
+                for c in range(c0 - ring, c0 + ring + 1):
+                    if max(abs(r - r0), abs(c - c0)) != ring:
+                        continue
+                    cid = r * self._cols + c % self._cols
+                    i = np.searchsorted(self.cell_id, cid)
+                    if i >= len(self.cell_id) or self.cell_id[i] != cid:
+                        continue
+                    for k in self.cell_post[self.cell_off[i]:self.cell_off[i + 1]]:
+                        d = _distance_km(lat, lon, float(self.lat[k]), float(self.lon[k]))
+                        if d < best_d:
+                            best, best_d = int(k), d
+        if best is None or (max_km is not None and best_d > max_km):
+            return None, float('inf')
+        return self.place(best), best_d
+
+    def timezone_at(self, lat, lon, max_km=TZ_MAX_KM):
+        """座標のタイムゾーン（max_km 以内の最寄りの地点のもの）。近くに地点がなければ None。"""
+        place, _ = self.nearest(float(lat), float(lon), max_km)
+        return place.tz if place else None
+
+
+def _distance_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+@lru_cache(maxsize=None)
+def get_gazetteer(path=DATA_PATH, index_dir=INDEX_DIR):
+    """プロセスで1つの Gazetteer。索引が無いか CSV より古ければ作り直してから開く。"""
+    if not _index_is_fresh(path, index_dir):
+        build_index(path, index_dir)
+    return Gazetteer(index_dir)
+
+
+if __name__ == '__main__':
+    gaz = get_gazetteer()
+    for q in sys.argv[1:] or ["富山"]:
+        for p in gaz.search(q):
+            print(f"{q}: {p.label()} ({p.lat:.4f}, {p.lon:.4f})")
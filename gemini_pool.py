@@ -0,0 +1,134 @@
+"""
+Gemini クライアントのプール（API キーごと）
+
+genai.configure(api_key=...) はプロセス全体の設定を書き換えるので、複数のセッションが
+別々のキーで同時に鑑定すると、他の人のキーで送ってしまうことがある。
+ここでは API キーごとに専用のクライアント（接続を持つ GenerativeServiceClient）を作って
+使い回し、GenerativeModel もモデル名・生成設定ごとに1つ作って保持する。
+
+- キーはハッシュ（key_id）で管理し、生のキーは統計やログに出さない
+- しばらく使われないクライアントは捨て（idle_ttl）、数の上限（max_size）を超えたら
+  最後に使ってから最も時間のたったものから捨てる
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 32
+DEFAULT_IDLE_TTL = 15 * 60   # 秒
+
+
+def key_id(api_key):
+    """API キーの識別子（先頭12桁のハッシュ）。キーなし（環境変数の既定）は 'default'。"""
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def make_client(api_key):
+    """API キー専用のクライアント（genai.configure のグローバル設定を使わない）。"""
+    # google.generativeai は読み込みが重いので、最初のクライアントを作るときまで import しない
+    from google.generativeai import client as genai_client
+    manager = genai_client._ClientManager()
+    manager.configure(api_key=api_key)
+    return manager.make_client("generative")
+
+
+def make_bound_model(client, model_name, generation_config):
+    import google.generativeai as genai
+    model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+    # GenerativeModel は最初の呼び出しでグローバルの既定クライアントを拾うので、先に差し込んでおく
+    model._client = client
+    return model
+
+
+class _Entry:
+    __slots__ = ('client', 'models', 'last_used', 'uses')
+
+    def __init__(self, client, now):
+        self.client = client
+        self.models = {}
+        self.last_used = now
+        self.uses = 0
+
+
+class ClientPool:
+    """API キーごとのクライアントと GenerativeModel を使い回すスレッドセーフなプール。"""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, idle_ttl=DEFAULT_IDLE_TTL,
+                 client_factory=make_client, model_factory=make_bound_model, clock=time.monotonic):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.client_factory = client_factory
+        self.model_factory = model_factory
+        self.clock = clock
+        self._entries = OrderedDict()   # key_id → _Entry（最後に使った順）
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "models_created": 0, "evicted_idle": 0, "evicted_lru": 0}
+
+    def _evict(self, now):
+        # ロックを持った状態で呼ぶ
+        for kid in [k for k, e in self._entries.items() if now - e.last_used > self.idle_ttl]:
+            del self._entries[kid]
+            self.counters["evicted_idle"] += 1
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.counters["evicted_lru"] += 1
+
+    def model(self, api_key, model_name, generation_config):
+        """api_key 専用のクライアントにつないだ GenerativeModel（同じ組み合わせなら同じもの）。"""
+        kid = key_id(api_key)
+        model_key = (model_name, json.dumps(generation_config, sort_keys=True))
+        now = self.clock()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(kid)
+            if entry is not None:
+                self.counters["hits"] += 1
+                self._entries.move_to_end(kid)
+        if entry is None:
+            # クライアントの作成はロックの外で（同時に作られたら先に登録された方を使う）
+            created = _Entry(self.client_factory(api_key), now)
+            with self._lock:
+                entry = self._entries.setdefault(kid, created)
+                self.counters["misses"] += 1
+                self._entries.move_to_end(kid)
+                self._evict(now)
+        with self._lock:
+            entry.last_used = now
+            entry.uses += 1
+            model = entry.models.get(model_key)
+        if model is not None:
+            return model
+        # モデルの作成もロックの外で（同時に作られたら先に登録された方を使う）
+        built = self.model_factory(entry.client, model_name, generation_config)
+        with self._lock:
+            model = entry.models.setdefault(model_key, built)
+            if model is built:
+                self.counters["models_created"] += 1
+        return model
+
+    def discard(self, api_key):
+        """キーのクライアントを捨てる（キーが無効になったときなど）。"""
+        with self._lock:
+            self._entries.pop(key_id(api_key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            self._evict(self.clock())
+            total = self.counters["hits"] + self.counters["misses"]
+            return dict(
+                self.counters, size=len(self._entries), max_size=self.max_size, idle_ttl=self.idle_ttl,
+                reuse_rate=self.counters["hits"] / total if total else 0.0,
+                clients={kid: e.uses for kid, e in self._entries.items()},
+            )
+
+
+# プロセス全体で共有するプール（Streamlit の全セッション共通）
+CLIENT_POOL = ClientPool()
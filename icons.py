@@ -0,0 +1,64 @@
+"""
+アイコン画像の縮小版
+
+my_icon.png（約1.9MB）をそのまま毎回ブラウザへ送らないよう、表示サイズに合わせた
+縮小版を icons/ に用意して使う。元画像の方が新しければその場で作り直す。
+読み込んだバイト列はプロセス内にキャッシュするので、再実行のたびにディスクを読むこともない。
+
+    python icons.py   # 縮小版をまとめて作り直す
+"""
+import io
+import os
+from functools import lru_cache
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(APP_DIR, "my_icon.png")
+
+# 名前 → (ファイル名, 幅, 正方形にするか)
+VARIANTS = {
+    'header': ("icons/my_icon_200w.png", 200, False),   # st.image(width=100) の2倍（高解像度画面用）
+    'favicon': ("icons/favicon_64.png", 64, True),      # ブラウザのタブ用
+}
+
+
+def build_variant(name):
+    """元画像から縮小版を作って保存し、そのバイト列を返す。"""
+    from PIL import Image
+
+    path, width, square = VARIANTS[name]
+    img = Image.open(SOURCE).convert("RGBA")
+    if square:
+        # 横長の画像は透明の余白で正方形にしてから縮小する
+        side = max(img.size)
+        canvas = Image.new("RGBA", (side, side), (0, 0, 0, 0))
+        canvas.paste(img, ((side - img.width) // 2, (side - img.height) // 2))
+        img = canvas.resize((width, width), Image.LANCZOS)
+    else:
+        img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+    # 256色パレットに減色（透過は保ったまま、サイズは約1/4になる）
+    img = img.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    data = buf.getvalue()
+    try:
+        with open(os.path.join(APP_DIR, path), "wb") as f:
+            f.write(data)
+    except OSError:
+        pass  # 読み取り専用の環境ではメモリ上の縮小版だけ使う
+    return data
+
+
+@lru_cache(maxsize=None)
+def icon_bytes(name):
+    """縮小版のバイト列。無い・古いときは作り直す。"""
+    path = os.path.join(APP_DIR, VARIANTS[name][0])
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(SOURCE):
+        return build_variant(name)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+if __name__ == '__main__':
+    for name in VARIANTS:
+        data = build_variant(name)
+        print(f"{VARIANTS[name][0]}: {len(data):,} bytes")
@@ -0,0 +1,242 @@
+"""
+処理時間の計測（スパン）と書き出し
+
+チャート計算・レポート作成・Gemini 呼び出しなどの段階を span() で囲むと、かかった時間を
+次の3か所に出せる。
+
+- トレース（画面のデバッグ表示用）: start_trace() の中で計測したスパンの一覧
+- JSON のログ行: 環境変数 AI_KANTEI_METRICS=1 のとき、1スパン1行で logger "ai_kantei.metrics" へ
+- Prometheus のテキスト形式: 段階ごとの回数・合計時間・ヒストグラムとトークン数などのカウンタ
+  （AI_KANTEI_METRICS_FILE を指定すると、トレースが終わるたびにそのファイルへ書き出す）
+
+どれも有効でないときの span() は、共有の何もしないコンテキストを返すだけなのでほぼ無負荷。
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import NamedTuple
+
+METRICS_ENV = "AI_KANTEI_METRICS"
+METRICS_FILE_ENV = "AI_KANTEI_METRICS_FILE"
+_ENABLED = bool(os.environ.get(METRICS_ENV))   # 起動時に一度だけ読む
+_METRICS_FILE = os.environ.get(METRICS_FILE_ENV)
+PREFIX = "ai_kantei"
+# ヒストグラムの区切り（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger("ai_kantei.metrics")
+
+
+class SpanRecord(NamedTuple):
+    name: str
+    seconds: float
+    attrs: dict
+
+
+# ==========================================
+# 1. 集計（Prometheus 用）
+# ==========================================
+class Registry:
+    """段階ごとの時間のヒストグラムと、ラベル付きカウンタを持つ（スレッドセーフ）。"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}     # 段階名 → [各区切りの件数..., 件数, 合計秒]
+        self._counters = {}   # (名前, ((ラベル, 値), ...)) → 値
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            row = self._stages.get(stage)
+            if row is None:
+                row = self._stages[stage] = [0] * len(self.buckets) + [0, 0.0]
+            for k, le in enumerate(self.buckets):
+                if seconds <= le:
+                    row[k] += 1
+            row[-2] += 1
+            row[-1] += seconds
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def prometheus_text(self):
+        """Prometheus のテキスト形式（exposition format 0.0.4）で返す。"""
+        with self._lock:
+            stages = {k: list(v) for k, v in self._stages.items()}
+            counters = dict(self._counters)
+        name = f"{PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} 処理の段階ごとの所要時間", f"# TYPE {name} histogram"]
+        for stage in sorted(stages):
+            row = stages[stage]
+            for le, count in zip(self.buckets, row):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {count}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {row[-2]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {row[-2]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {row[-1]:.6f}')
+        for cname in sorted({n for n, _ in counters}):
+            full = f"{PREFIX}_{cname}_total"
+            lines.append(f"# TYPE {full} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == cname:
+                    label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"{full}{{{label_str}}} {value}" if label_str else f"{full} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """テキストファイルに書き出す（node_exporter の textfile collector 向けに置き換えで書く）。"""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+def enabled():
+    """ログ・集計が有効か。"""
+    return _ENABLED
+
+
+# ==========================================
+# 2. トレースとスパン
+# ==========================================
+class Trace:
+    """1回の操作（チャート計算・AI鑑定など）の中で計測したスパンの一覧。"""
+
+    def __init__(self, name):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.spans = []
+        self.elapsed = None   # トレース全体の時間（秒、終わったときに入る）
+
+    def rows(self):
+        """画面表示用の [{段階, ミリ秒, その他の属性}, ...]。"""
+        return [{'stage': s.name, 'ms': round(s.seconds * 1000, 2), **s.attrs} for s in self.spans]
+
+    def summary(self):
+        """セッションに残す形（スパンの一覧と全体のミリ秒）。"""
+        return {'rows': self.rows(), 'ms': round((self.elapsed or 0.0) * 1000, 2)}
+
+
+_CURRENT = contextvars.ContextVar("ai_kantei_trace", default=None)
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "trace", "start")
+
+    def __init__(self, name, attrs, trace):
+        self.name = name
+        self.attrs = attrs
+        self.trace = trace
+
+    def set(self, **attrs):
+        """計測中に分かった値（トークン数など）を付け足す。None の値は捨てる。"""
+        self.attrs.update((k, v) for k, v in attrs.items() if v is not None)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        record(self.name, seconds, self.trace, **self.attrs)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **attrs):
+    """with span("chart.flatlib"): ... の形で段階の時間を測る。"""
+    trace = _CURRENT.get()
+    if trace is None and not _ENABLED:
+        return _NOOP
+    return _Span(name, dict(attrs), trace)
+
+
+def record(name, seconds, trace=None, **attrs):
+    """測り終えた時間を、トレース・集計・ログに渡す（外で測った時間を入れるときにも使う）。"""
+    trace = trace if trace is not None else _CURRENT.get()
+    if trace is not None:
+        trace.spans.append(SpanRecord(name, seconds, attrs))
+    if _ENABLED:
+        REGISTRY.observe(name, seconds)
+        logger.info(json.dumps({
+            "event": "span", "stage": name, "ms": round(seconds * 1000, 3),
+            "trace": trace.id if trace is not None else None,
+            "operation": trace.name if trace is not None else None,
+            **attrs,
+        }, ensure_ascii=False, default=str))
+
+
+def observe(name, seconds):
+    """トレースには載せず、集計（ヒストグラム）にだけ入れる。"""
+    if _ENABLED and seconds is not None:
+        REGISTRY.observe(name, seconds)
+
+
+def count(name, value=1, **labels):
+    """カウンタを増やす（トークン数・応答の文字数など）。無効なら何もしない。"""
+    if _ENABLED and value:
+        REGISTRY.inc(name, value, **labels)
+
+
+@contextmanager
+def start_trace(name, active=True):
+    """with start_trace("calc", active) as trace: の中のスパンを trace に集める。
+
+    active が偽で、ログ・集計も無効なら trace は None（計測しない）。
+    """
+    if not active and not _ENABLED:
+        yield None
+        return
+    trace = Trace(name)
+    token = _CURRENT.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.elapsed = time.perf_counter() - start
+        _CURRENT.reset(token)
+        if _ENABLED and _METRICS_FILE:
+            try:
+                REGISTRY.write(_METRICS_FILE)
+            except OSError as e:
+                logger.warning("metrics file write failed: %s", e)
+
+
+if _ENABLED and not logger.handlers:
+    # ログの設定がなければ、JSON 行をそのまま標準エラーに出す
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
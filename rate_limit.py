@@ -0,0 +1,193 @@
+"""
+Gemini 呼び出しの再試行とレート制御
+
+- エラーを一時的なもの（429 / 5xx / タイムアウト）と恒久的なもの（キー不正・引数不正など）に分ける
+- 一時的なエラーはジッター付き指数バックオフで再試行し、サーバーの「○秒後に再試行」ヒントを尊重する
+- プロセス全体で共有するトークンバケットと同時実行数の上限で、アクセスが集中したときは
+  全員が 429 になる前に手元で順番待ちさせる
+
+再試行・スロットル回数や順番待ちの時間は GEMINI_GATE.stats() で確認できる。
+"""
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+THROTTLE_STATUS = {429}
+
+DEFAULT_RPM = float(os.environ.get("AI_KANTEI_GEMINI_RPM", 30))                # 1分あたりのリクエスト数
+DEFAULT_CONCURRENCY = int(os.environ.get("AI_KANTEI_GEMINI_CONCURRENCY", 4))   # 同時に投げるリクエスト数
+
+
+# ==========================================
+# 1. エラーの分類
+# ==========================================
+def status_code(error):
+    """例外から HTTP ステータス相当の番号を取り出す（わからなければ None）。"""
+    code = getattr(error, "code", None)
+    if code is None:
+        response = getattr(error, "response", None)
+        code = getattr(response, "status_code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    code = status_code(error)
+    if code is not None:
+        return code in TRANSIENT_STATUS
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+_RETRY_IN = re.compile(r"retry in ([0-9.]+)\s*s", re.IGNORECASE)
+
+
+def retry_after_hint(error):
+    """サーバーが指定した再試行までの秒数（Retry-After / RetryInfo / メッセージ）。"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    m = _RETRY_IN.search(str(error))
+    return float(m.group(1)) if m else None
+
+
+# ==========================================
+# 2. 再試行の方針
+# ==========================================
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 2.0     # 秒。1回目の再試行の最大待ち時間
+    max_delay: float = 30.0
+    max_hint: float = 60.0      # サーバー指定の待ち時間がこれより長ければあきらめる
+
+    def delay(self, attempt, error, rng=random):
+        """attempt 回目（0始まり）の失敗後の待ち時間。full jitter とヒントの大きい方。"""
+        delay = rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        hint = retry_after_hint(error)
+        if hint is not None:
+            delay = max(delay, hint)
+        return delay
+
+
+class RetryGiveUp(Exception):
+    """再試行しても成功しなかった（元の例外は __cause__）。"""
+
+
+# ==========================================
+# 3. レート制御
+# ==========================================
+class TokenBucket:
+    """rate 個/秒で補充され、最大 capacity 個ためられるトークンバケット。"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._clock = clock
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """トークンを1つ予約し、使えるまでの待ち秒数を返す（負債を許して順番を守る）。"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class GeminiGate:
+    """トークンバケット＋同時実行数の上限＋再試行をまとめた呼び出し口。"""
+
+    def __init__(self, rpm=DEFAULT_RPM, concurrency=DEFAULT_CONCURRENCY, policy=None, sleep=time.sleep):
+        self.bucket = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0 * 5))
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.concurrency = concurrency
+        self.policy = policy or RetryPolicy()
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0, "success": 0, "retries": 0, "throttled": 0,
+            "transient_errors": 0, "permanent_errors": 0, "gave_up": 0, "rate_limited": 0,
+            "queue_wait_total": 0.0, "queue_wait_max": 0.0, "in_flight": 0,
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def _acquire(self, sleep):
+        start = time.monotonic()
+        wait = self.bucket.reserve()
+        if wait > 0:
+            self._count("rate_limited")
+            sleep(wait)
+        self.slots.acquire()
+        waited = time.monotonic() - start
+        with self._lock:
+            self.counters["queue_wait_total"] += waited
+            self.counters["queue_wait_max"] = max(self.counters["queue_wait_max"], waited)
+            self.counters["in_flight"] += 1
+        return waited
+
+    def _release(self):
+        self.slots.release()
+        self._count("in_flight", -1)
+
+    def call(self, fn, on_retry=None, sleep=None):
+        """fn() を制限付きで呼ぶ。一時的なエラーは policy に従って再試行する。
+
+        on_retry(次の試行番号(1始まり), 待ち秒数, 例外) は再試行の直前に呼ばれる。
+        恒久的なエラーはそのまま送出し、再試行しきれなければ RetryGiveUp を送出する。
+        """
+        sleep = sleep or self.sleep
+        self._count("calls")
+        for attempt in range(self.policy.max_attempts):
+            self._acquire(sleep)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_transient(e):
+                    self._count("permanent_errors")
+                    raise
+                self._count("transient_errors")
+                if status_code(e) in THROTTLE_STATUS:
+                    self._count("throttled")
+                delay = self.policy.delay(attempt, e)
+                if attempt + 1 >= self.policy.max_attempts or delay > self.policy.max_hint:
+                    self._count("gave_up")
+                    raise RetryGiveUp(f"{self.policy.max_attempts}回試行しましたが失敗しました: {e}") from e
+                self._count("retries")
+                last_error = e
+            else:
+                self._count("success")
+                return result
+            finally:
+                self._release()
+            if on_retry:
+                on_retry(attempt + 2, delay, last_error)
+            sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, rpm=self.bucket.rate * 60, concurrency=self.concurrency)
+
+
+# プロセス全体で共有する呼び出し口（Streamlit の全セッション共通）
+GEMINI_GATE = GeminiGate()
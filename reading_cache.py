@@ -0,0 +1,116 @@
+"""
+AI鑑定結果のディスクキャッシュ（SQLite）
+
+同じ計算データ・プロンプト版・モデル・生成設定の組み合わせなら、Gemini を呼ばずに
+前回の鑑定文を返す。件数上限（最近使っていないものから削除）と有効期限を持つ。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = os.environ.get(
+    "AI_KANTEI_CACHE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "readings.sqlite3"),
+)
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_TTL = 30 * 24 * 60 * 60   # 秒（30日）
+
+
+def reading_key(chart_data, prompt_version, model_name, generation_config):
+    """キャッシュキー（SHA-256）。生成設定はキー順を固定してから含める。"""
+    payload = json.dumps(
+        [chart_data, prompt_version, model_name, generation_config],
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReadingCache:
+    """鑑定文を key → text で保存する。接続は1本をロックで順番に使うので、スレッド間で共有できる。"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()      # hits / misses 用
+        self._db_lock = threading.Lock()   # 接続用
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Streamlit は再実行ごとに別のスレッドで動くので、スレッドごとに接続を開くと
+        # 閉じられない接続がたまっていく。プロセスで1本だけ開いて使い回す
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS readings ("
+                " key TEXT PRIMARY KEY, text TEXT NOT NULL, model TEXT,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS readings_accessed ON readings (accessed)")
+
+    @contextmanager
+    def _conn(self):
+        """ロックを取った接続（抜けるときにコミット、例外ならロールバック）。"""
+        with self._db_lock, self._db:
+            yield self._db
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._conn() as conn:
+            row = conn.execute("SELECT text, created FROM readings WHERE key = ?", (key,)).fetchone()
+            if row and (self.ttl is None or now - row[1] < self.ttl):
+                conn.execute("UPDATE readings SET accessed = ? WHERE key = ?", (now, key))
+                with self._lock:
+                    self.hits += 1
+                return row[0]
+            if row:
+                conn.execute("DELETE FROM readings WHERE key = ?", (key,))
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, text, model=None):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO readings (key, text, model, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, text, model, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        if self.ttl is not None:
+            conn.execute("DELETE FROM readings WHERE created < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            conn.execute(
+                "DELETE FROM readings WHERE key IN ("
+                " SELECT key FROM readings ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM readings WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM readings")
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._conn() as conn:
+            size = conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+        with self._lock:
+            return {"size": size, "max_entries": self.max_entries, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
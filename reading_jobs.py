@@ -0,0 +1,247 @@
+"""
+AI 鑑定をバックグラウンドのジョブとして実行する
+
+Streamlit は入力欄を1つ触るたびにスクリプト全体を実行し直すので、画面の処理の中で
+Gemini を呼ぶと、鑑定中にお名前や緯度を直しただけで鑑定が打ち切られてしまう。
+ここでは鑑定をプロセス全体で共有するスレッドプール（上限つき）に投げ、画面側は
+ジョブ ID をセッションに持って、終わったかどうかを定期的に見に来るだけにする。
+
+- ジョブは画面の再実行とは無関係に最後まで走り、結果は鑑定キャッシュにも保存される
+- 中止（cancel）はストリーミングのチャンクの合間と、再試行の待ち時間に効く
+  （ストリーミングなしの1回の呼び出しは途中で止められないので、結果は画面に出さずキャッシュにだけ残す）
+- 同じ利用者（owner）が同時に走らせられるジョブ数には上限がある
+
+投入・完了・失敗・中止・上限で断った件数は READING_JOBS.stats() で確認できる。
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from ai_reading import make_model, model_id, run_reading
+from metrics import count, observe, span, start_trace
+from rate_limit import GEMINI_GATE
+
+DEFAULT_WORKERS = int(os.environ.get("AI_KANTEI_READING_WORKERS", 4))     # 同時に走るジョブ数（全体）
+DEFAULT_PER_OWNER = int(os.environ.get("AI_KANTEI_READING_PER_USER", 1))  # 1人が同時に走らせられるジョブ数
+DEFAULT_KEEP = 30 * 60   # 秒。終わったジョブを画面が取りに来るまで残しておく時間
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobLimitError(Exception):
+    """同じ利用者のジョブが上限まで走っている。"""
+
+
+class JobCancelled(BaseException):
+    """ジョブが中止された（ジョブの中から送出して処理を打ち切る）。
+
+    asyncio.CancelledError と同じく BaseException にして、GeminiGate.call などの
+    except Exception でエラー（再試行・失敗の集計）として扱われないようにする。
+    """
+
+
+# ==========================================
+# 1. ジョブ
+# ==========================================
+class ReadingJob:
+    """1件の鑑定ジョブ。text は途中経過（ストリーミング中の全文）、result は関数の戻り値。"""
+
+    def __init__(self, owner, meta=None, clock=time.monotonic):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.meta = meta or {}
+        self.state = QUEUED
+        self.text = ""
+        self.log = []        # 画面に出す経過メッセージ（再試行など）
+        self.result = None
+        self.error = None
+        self.future = None
+        self._clock = clock
+        self._cancel = threading.Event()
+        self.created = clock()
+        self.started = self.finished = None
+
+    @property
+    def done(self):
+        return self.state in FINISHED
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        """中止されていれば JobCancelled を送出する。"""
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def wait(self, seconds):
+        """中止されたらすぐに起きる sleep（GeminiGate.call の sleep に渡す）。"""
+        if self._cancel.wait(seconds):
+            raise JobCancelled(self.id)
+
+    def update(self, text):
+        """途中経過の全文を更新する（run_reading の on_chunk に渡す）。"""
+        self.check()
+        self.text = text
+
+    def note(self, message):
+        self.log.append(message)
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or self._clock()) - self.started
+
+
+# ==========================================
+# 2. ジョブの置き場所と実行
+# ==========================================
+class JobStore:
+    """ジョブをスレッドプールで実行し、ID で引けるように持っておく（スレッドセーフ）。"""
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, per_owner=DEFAULT_PER_OWNER, keep=DEFAULT_KEEP,
+                 clock=time.monotonic):
+        self.max_workers = max_workers
+        self.per_owner = per_owner
+        self.keep = keep
+        self.clock = clock
+        self._executor = None   # 最初のジョブのときに作る（ページを開くだけならスレッドは不要）
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0}
+
+    def _prune(self, now):
+        # ロックを持った状態で呼ぶ
+        for job_id in [i for i, j in self._jobs.items() if j.done and now - j.finished > self.keep]:
+            del self._jobs[job_id]
+
+    def submit(self, owner, fn, meta=None):
+        """fn(job) をバックグラウンドで実行するジョブを作って返す。
+
+        owner のジョブが per_owner 件走っていれば JobLimitError を送出する。
+        """
+        with self._lock:
+            self._prune(self.clock())
+            running = sum(1 for j in self._jobs.values() if j.owner == owner and not j.done)
+            if running >= self.per_owner:
+                self.counters["rejected"] += 1
+                raise JobLimitError(f"同時に実行できる鑑定は{self.per_owner}件までです")
+            job = ReadingJob(owner, meta, self.clock)
+            self._jobs[job.id] = job
+            self.counters["submitted"] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="reading")
+            job.future = self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        if job.cancel_requested:
+            self._finish(job, CANCELLED)
+            return
+        job.started = self.clock()
+        job.state = RUNNING
+        try:
+            job.result = fn(job)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            job.error = e
+            self._finish(job, FAILED)
+        else:
+            # ストリーミングなしの呼び出し中に中止されたものは、結果があっても中止扱い（キャッシュには入っている）
+            self._finish(job, CANCELLED if job.cancel_requested else DONE)
+
+    def _finish(self, job, state):
+        with self._lock:
+            job.finished = self.clock()
+            job.state = state
+            self.counters[{DONE: "completed", FAILED: "failed", CANCELLED: "cancelled"}[state]] += 1
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """中止を依頼する。まだ始まっていなければその場で中止になる。"""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, CANCELLED)
+        return True
+
+    def active(self, owner=None):
+        """終わっていないジョブ（owner を指定すればその人の分だけ）。"""
+        with self._lock:
+            return [j for j in self._jobs.values() if not j.done and (owner is None or j.owner == owner)]
+
+    def shutdown(self, cancel=True):
+        """プールを止める（テスト・ベンチ用）。cancel なら走っているジョブにも中止を依頼する。"""
+        if cancel:
+            for job in self.active():
+                self.cancel(job.id)
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            self._prune(self.clock())
+            states = [j.state for j in self._jobs.values()]
+            return dict(
+                self.counters, queued=states.count(QUEUED), running=states.count(RUNNING),
+                kept=len(states), max_workers=self.max_workers, per_owner=self.per_owner,
+            )
+
+
+# ==========================================
+# 3. 鑑定ジョブの中身
+# ==========================================
+def reading_task(prompt, model_name, api_key=None, stream=True, cache=None, cache_key=None,
+                 gate=None, trace=False, attrs=None):
+    """ジョブとして実行する鑑定の関数 fn(job) を作る。
+
+    fn(job) は {'text', 'stats', 'trace'} を返す。結果は cache（ReadingCache）にも保存するので、
+    画面を閉じても次に同じ鑑定をしたときはキャッシュから出せる。
+    """
+    gate = gate or GEMINI_GATE
+
+    def run(job):
+        def on_retry(attempt, delay, error):
+            count("gemini_retries")
+            job.note(f"⚠️ 一時的なエラー: {error}")
+            job.note(f"📡 {delay:.1f}秒後に再接続します... (試行: {attempt}回目)")
+
+        # スパンはジョブのスレッドで集め、終わったら画面側がセッションのトレースに移す
+        with start_trace("reading", trace) as tr:
+            job.note("📡 宇宙に接続中... (試行: 1回目)")
+            with span("reading.model"):
+                model = make_model(model_name, api_key=api_key)
+            with span("reading.gemini", model=model_name, stream=stream, **(attrs or {})) as sp:
+                text, stats = gate.call(
+                    lambda: run_reading(model, prompt, stream=stream, on_chunk=job.update),
+                    on_retry=on_retry, sleep=job.wait,
+                )
+                sp.set(first_token_ms=stats.first_token and round(stats.first_token * 1000, 1),
+                       chunks=stats.chunks, chars=stats.chars, prompt_tokens=stats.prompt_tokens,
+                       output_tokens=stats.output_tokens, total_tokens=stats.total_tokens)
+            job.text = text
+            observe("reading.first_token", stats.first_token)
+            count("gemini_tokens", stats.prompt_tokens, kind="prompt")
+            count("gemini_tokens", stats.output_tokens, kind="output")
+            count("reading_chars", stats.chars)
+            if text and cache is not None:
+                with span("reading.cache_put"):
+                    cache.put(cache_key, text, model_id(model_name))
+        return {'text': text, 'stats': stats, 'trace': tr.summary() if tr else None}
+
+    return run
+
+
+# プロセス全体で共有するジョブ置き場（Streamlit の全セッション共通）
+READING_JOBS = JobStore()
@@ -0,0 +1,234 @@
+"""
+出生時刻の絞り込み（レクティファイ用の時刻スキャン）
+
+出生時刻がわからないとき、指定した時間帯（1日分など）を一定の間隔でなめて、
+ASC のサイン・MC のサイン・各天体のハウス（ホールサイン）・POF のサイン・昼夜の区分・
+ディグニティの順位が切り替わる時刻を求める。
+
+1分ごとに Chart を作り直すと1日で1440回の暦計算になるが、天体は1日ではほとんど動かない。
+そこで天体の黄経は数時間おきに求めた値（黄経と速度）から3次エルミート補間で出し、
+毎ステップ計算し直すのは ASC・MC（swisseph のハウス計算1回）だけにする。
+切り替わりのあったステップの中は二分法で秒単位まで詰める。
+"""
+import datetime
+import zoneinfo
+from typing import NamedTuple
+
+import numpy as np
+
+from flatlib import const
+from flatlib.datetime import Datetime
+from flatlib.ephem import swe
+
+from astro_defs import ALL_P, JP_NAMES, SIGN_LIST, TRAD_P
+from chart_engine import DEFAULT_TZ
+from chart_model import house_of
+from dignity_table import score_batch
+
+SAMPLE_HOURS = 6.0        # 天体の黄経を実際に計算する間隔（時間）
+DEFAULT_STEP = 1.0        # スキャンの間隔（分）
+PRECISION = 1.0 / 86400   # 二分法で詰める幅（日、1秒）
+
+COMPONENTS = ('asc', 'mc', 'pof', 'sect', 'houses', 'ranking')
+COMPONENT_LABELS = {'asc': "ASC", 'mc': "MC", 'pof': "POF", 'sect': "昼夜", 'houses': "ハウス", 'ranking': "ディグニティ順位"}
+
+
+class Boundary(NamedTuple):
+    time: datetime.datetime   # 切り替わった時刻（現地時間）
+    component: str            # COMPONENTS のどれか
+    before: object
+    after: object
+
+
+class Segment(NamedTuple):
+    start: datetime.datetime
+    end: datetime.datetime
+    state: dict
+
+
+# ==========================================
+# 1. 天体の黄経の補間
+# ==========================================
+class PlanetTrack:
+    """jd0〜jd1 の天体の黄経を、SAMPLE_HOURS おきの暦計算から3次エルミート補間で返す。"""
+
+    def __init__(self, ids, jd0, jd1, sample_hours=SAMPLE_HOURS):
+        self.ids = list(ids)
+        h = sample_hours / 24.0
+        n = max(1, int(np.ceil((jd1 - jd0) / h)))
+        self.nodes = jd0 + h * np.arange(n + 1)
+        self.h = h
+        self.calls = 0
+        lon = np.empty((len(self.ids), n + 1))
+        speed = np.empty_like(lon)
+        for k, jd in enumerate(self.nodes):
+            for p, body in enumerate(self.ids):
+                obj = swe.sweObject(body, jd)
+                lon[p, k], speed[p, k] = obj['lon'], obj['lonspeed']
+                self.calls += 1
+        # 360度をまたいでも滑らかになるよう、黄経を連続な値にしておく
+        self.lon = np.unwrap(lon, period=360.0, axis=1)
+        self.speed = speed
+
+    def at(self, jd):
+        """各天体の黄経（0〜360度）の配列。"""
+        k = min(max(int((jd - self.nodes[0]) // self.h), 0), len(self.nodes) - 2)
+        s = (jd - self.nodes[k]) / self.h
+        p0, p1 = self.lon[:, k], self.lon[:, k + 1]
+        m0, m1 = self.speed[:, k] * self.h, self.speed[:, k + 1] * self.h
+        s2, s3 = s * s, s * s * s
+        lon = (2 * s3 - 3 * s2 + 1) * p0 + (s3 - 2 * s2 + s) * m0 + (-2 * s3 + 3 * s2) * p1 + (s3 - s2) * m1
+        return np.mod(lon, 360.0)
+
+
+# ==========================================
+# 2. ある時刻の状態
+# ==========================================
+def chart_state(track, jd, lat, lon):
+    """jd の時点の ASC/MC/POF のサイン・昼夜・各天体のハウス・ディグニティ順位。"""
+    _, angles = swe.sweHousesLon(jd, lat, lon, const.HOUSES_WHOLE_SIGN)
+    asc_lon, mc_lon = angles[0], angles[1]
+    asc = int(asc_lon // 30)
+    p_lon = track.at(jd)
+    sign_idx = (p_lon // 30).astype(int)
+    houses = house_of(sign_idx, asc)
+
+    sun, moon = track.ids.index(const.SUN), track.ids.index(const.MOON)
+    is_day = bool(7 <= houses[sun] <= 12)
+    if is_day: pof_lon = (asc_lon + p_lon[moon] - p_lon[sun]) % 360
+    else: pof_lon = (asc_lon + p_lon[sun] - p_lon[moon]) % 360
+
+    trad = [track.ids.index(p) for p in TRAD_P]
+    scores, _ = score_batch(list(range(len(TRAD_P))), p_lon[trad], is_day)
+    ranking = tuple(TRAD_P[i] for i in sorted(range(len(TRAD_P)), key=lambda i: int(scores[i]), reverse=True))
+    return {
+        'asc': asc, 'mc': int(mc_lon // 30), 'pof': int(pof_lon // 30), 'sect': is_day,
+        'houses': tuple(int(x) for x in houses), 'ranking': ranking,
+    }
+
+
+def _bisect(state_at, component, a, b, before):
+    """[a, b] の中で component が before から変わる時刻を PRECISION まで詰める。"""
+    while b - a > PRECISION:
+        mid = (a + b) / 2
+        if state_at(mid)[component] == before:
+            a = mid
+        else:
+            b = mid
+    return b
+
+
+def _shift_only(prev, cur):
+    shift = (prev['asc'] - cur['asc']) % 12
+    return all((h1 - h0) % 12 == shift for h0, h1 in zip(prev['houses'], cur['houses']))
+
+
+# ==========================================
+# 3. スキャン
+# ==========================================
+def _zone(tz):
+    """'+09:00' 形式なら固定のオフセット、IANA 名（'America/New_York' など）ならそのタイムゾーン。"""
+    if tz[:1] in ('+', '-'):
+        hours, minutes = tz[1:].split(':')
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        return datetime.timezone(-offset if tz[0] == '-' else offset)
+    return zoneinfo.ZoneInfo(tz)
+
+
+def _ut_jd(utc):
+    return Datetime(utc.strftime("%Y/%m/%d"), utc.strftime("%H:%M:%S"), '+00:00').jd
+
+
+def scan(input_date, lat, lon, tz=DEFAULT_TZ, start=datetime.time(0, 0), end=datetime.time(23, 59),
+         step_minutes=DEFAULT_STEP, ids=ALL_P, stats=None):
+    """input_date の start〜end（現地時間）をスキャンし、(区間のリスト, 切り替わりのリスト) を返す。
+
+    tz は '+09:00' 形式か IANA 名。IANA 名なら UTC との差は時刻ごとに求めるので、
+    夏時間の切り替わりをまたぐ時間帯でも各時刻の現地時間は正しくなる（スキャン自体は世界時で等間隔）。
+    stats に辞書を渡すと、暦計算（天体）とハウス計算の回数を書き込む。
+    """
+    lat, lon = float(lat), float(lon)
+    zone = _zone(tz)
+    t0 = datetime.datetime.combine(input_date, start)
+    t1 = datetime.datetime.combine(input_date, end)
+    utc0 = t0 - t0.replace(tzinfo=zone).utcoffset()
+    jd0 = _ut_jd(utc0)
+    jd1 = _ut_jd(t1 - t1.replace(tzinfo=zone).utcoffset())
+    track = PlanetTrack(ids, jd0, jd1)
+
+    angle_calls = 0
+    def state_at(jd):
+        nonlocal angle_calls
+        angle_calls += 1
+        return chart_state(track, jd, lat, lon)
+
+    def local(jd):
+        utc = utc0 + datetime.timedelta(seconds=round((jd - jd0) * 86400))
+        return utc.replace(tzinfo=datetime.timezone.utc).astimezone(zone).replace(tzinfo=None)
+
+    step = step_minutes / 1440.0
+    n = int(round((jd1 - jd0) / step))
+    boundaries = []
+    segments = []
+    seg_start, prev = jd0, state_at(jd0)
+    for k in range(1, n + 1):
+        jd = min(jd0 + k * step, jd1)
+        cur = state_at(jd)
+        if cur == prev:
+            continue
+        times = []
+        for comp in COMPONENTS:
+            if cur[comp] != prev[comp]:
+                t = _bisect(state_at, comp, jd - step, jd, prev[comp])
+                times.append(t)
+                if comp == 'houses' and _shift_only(prev, cur):
+                    continue  # ASC のサインが変わって全天体が一斉にずれただけなら ASC の行で足りる
+                boundaries.append(Boundary(local(t), comp, prev[comp], cur[comp]))
+        # 1ステップの中で複数の項目が変わったら、最初の切り替わりで区間を閉じる
+        cut = min(times)
+        segments.append(Segment(local(seg_start), local(cut), prev))
+        seg_start, prev = cut, cur
+    segments.append(Segment(local(seg_start), t1, prev))
+    boundaries.sort(key=lambda b: b.time)
+
+    if stats is not None:
+        stats['ephemeris_calls'] = track.calls
+        stats['angle_calls'] = angle_calls
+    return segments, boundaries
+
+
+# ==========================================
+# 4. 表示用の整形
+# ==========================================
+def _sign(idx):
+    return JP_NAMES[SIGN_LIST[idx]]
+
+
+def describe_state(state, ids=ALL_P):
+    ranking = ">".join(JP_NAMES[p] for p in state['ranking'])
+    return {
+        'ASC': _sign(state['asc']), 'MC': _sign(state['mc']), 'POF': _sign(state['pof']),
+        '昼夜': "昼" if state['sect'] else "夜",
+        'ハウス': " ".join(f"{JP_NAMES[p]}{h}" for p, h in zip(ids, state['houses'])),
+        'ディグニティ順位': ranking,
+    }
+
+
+def describe_boundary(b, ids=ALL_P):
+    label = COMPONENT_LABELS[b.component]
+    if b.component in ('asc', 'mc', 'pof'):
+        change = f"{_sign(b.before)} → {_sign(b.after)}"
+    elif b.component == 'sect':
+        change = "昼 → 夜" if b.before else "夜 → 昼"
+    elif b.component == 'houses':
+        change = ", ".join(
+            f"{JP_NAMES[p]} 第{h0}→第{h1}ハウス" for p, h0, h1 in zip(ids, b.before, b.after) if h0 != h1
+        )
+    else:
+        change = f"{'>'.join(JP_NAMES[p] for p in b.before)} → {'>'.join(JP_NAMES[p] for p in b.after)}"
+    return f"{b.time:%H:%M:%S} | {label}: {change}"
+
+
+def segment_rows(segments, ids=ALL_P):
+    """画面の表用の行（区間ごと）。"""
+    return [{'開始': f"{s.start:%H:%M:%S}", '終了': f"{s.end:%H:%M:%S}", **describe_state(s.state, ids)} for s in segments]
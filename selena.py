@@ -0,0 +1,101 @@
+"""
+ホワイトムーン（セレナ）の一括計算
+
+get_selena_data の NumPy 版。UTC 時刻の配列（または swisseph のユリウス日）をまとめて受け取り、
+サイン番号・度・分・ホールサインのハウス・絶対黄経を配列で返す。
+現地時刻から使う場合はレコードごとのタイムゾーン（時間数）を渡す。
+ephem_index.sign_charts（batch_kantei.py --format signs）はこちらで全員分をまとめて計算する。
+
+    python selena.py   # 1900年〜今日の毎日について get_selena_data と一致するか照合する
+"""
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from astro_defs import SELENA_EPOCH_JD, SELENA_INITIAL_LON, SELENA_DAILY_MOTION
+
+# JD 2415020.5 = 1900-01-01 00:00 UTC
+_EPOCH = np.datetime64('1900-01-01T00:00:00', 's')
+_SECONDS_PER_DAY = 86400.0
+
+
+class SelenaArrays(NamedTuple):
+    sign_idx: np.ndarray          # 0=牡羊座, 1=牡牛座...
+    deg: np.ndarray               # サイン内の度（分の四捨五入による繰り上げ後）
+    minute: np.ndarray
+    house: Optional[np.ndarray]   # asc_sign_idx を渡したときだけ
+    lon: np.ndarray               # 絶対黄経（0-360度、丸め前）
+
+
+def _from_days(days, asc_sign_idx):
+    return selena_from_lon(np.mod(SELENA_INITIAL_LON + days * SELENA_DAILY_MOTION, 360.0), asc_sign_idx)
+
+
+def selena_from_lon(lon, asc_sign_idx=None):
+    """絶対黄経の配列からサイン・度・分・ハウスを出す（分は四捨五入し、60分は次の度へ繰り上げる）。"""
+    lon = np.asarray(lon, dtype=np.float64)
+    sign_idx = (lon // 30).astype(np.int64)
+    deg_total = np.mod(lon, 30)
+    deg = deg_total.astype(np.int64)
+    minute = ((deg_total - deg) * 60 + 0.5).astype(np.int64)  # 四捨五入
+
+    # 繰り上げ処理
+    carry = minute >= 60
+    minute = np.where(carry, 0, minute)
+    deg = deg + carry
+    carry = deg >= 30
+    deg = np.where(carry, 0, deg)
+    sign_idx = np.where(carry, (sign_idx + 1) % 12, sign_idx)
+
+    house = None
+    if asc_sign_idx is not None:
+        house = np.mod(sign_idx - np.asarray(asc_sign_idx), 12) + 1
+    return SelenaArrays(sign_idx, deg, minute, house, lon)
+
+
+def selena_from_jd(jd_ut, asc_sign_idx=None):
+    """ユリウス日（UT、swisseph の julday と同じ基準）の配列から計算する。"""
+    days = np.asarray(jd_ut, dtype=np.float64) - SELENA_EPOCH_JD
+    return _from_days(days, asc_sign_idx)
+
+
+def selena_from_utc(utc, asc_sign_idx=None):
+    """UTC 時刻の配列（datetime / datetime64 / ISO 文字列）から計算する。"""
+    seconds = (np.asarray(utc, dtype='datetime64[s]') - _EPOCH).astype(np.float64)
+    return _from_days(seconds / _SECONDS_PER_DAY, asc_sign_idx)
+
+
+def selena_from_local(local, tz_hours, asc_sign_idx=None):
+    """現地時刻の配列とレコードごとのタイムゾーン（時間数、例: 9.0 / -5.5）から計算する。"""
+    offset = np.rint(np.asarray(tz_hours, dtype=np.float64) * 3600).astype('timedelta64[s]')
+    return selena_from_utc(np.asarray(local, dtype='datetime64[s]') - offset, asc_sign_idx)
+
+
+if __name__ == '__main__':
+    # 1900-01-01 から今日までの毎日（時刻・タイムゾーン・ASC は乱数）を get_selena_data と照合する
+    import datetime
+    import sys
+    import time
+
+    from astro_defs import SIGN_LIST, get_selena_data
+
+    rng = np.random.default_rng(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    days = np.arange(np.datetime64('1900-01-01'), np.datetime64(datetime.date.today()) + 1)
+    local = days.astype('datetime64[s]') + rng.integers(0, 24 * 60, len(days)).astype('timedelta64[m]')
+    tz_hours = rng.integers(-12 * 4, 14 * 4 + 1, len(days)) / 4.0
+    asc = rng.integers(0, 12, len(days))
+    t = time.perf_counter()
+    arr = selena_from_local(local, tz_hours, asc)
+    vectorized = time.perf_counter() - t
+    mismatch = 0
+    t = time.perf_counter()
+    for k, dt in enumerate(local.astype(datetime.datetime)):
+        sign, deg, minute, house, lon = get_selena_data(dt.date(), dt.time(), int(asc[k]), float(tz_hours[k]))
+        got = (SIGN_LIST[arr.sign_idx[k]], int(arr.deg[k]), int(arr.minute[k]), int(arr.house[k]))
+        if got != (sign, deg, minute, house) or abs(arr.lon[k] - lon) > 1e-9:
+            mismatch += 1
+            print(f"不一致: {dt} tz={tz_hours[k]:+} {got} != {(sign, deg, minute, house)}", file=sys.stderr)
+    scalar = time.perf_counter() - t
+    print(f"照合: {len(days):,}日（{days[0]}〜{days[-1]}）/ 不一致 {mismatch}件")
+    print(f"NumPy {vectorized * 1e3:.1f} ms / get_selena_data {scalar * 1e3:.1f} ms")
+    sys.exit(1 if mismatch else 0)
@@ -0,0 +1,244 @@
+"""
+相性鑑定（シナストリー・コンポジット）
+
+2人の出生図を比べて、AI に渡す相性用の計算データを作る。
+
+- 相互アスペクト: A の天体 × B の天体の全組を aspect_engine.cross_aspects で一括判定
+- ハウス・オーバーレイ: A の天体が B のホールサインの何ハウスに入るか（とその逆）
+- 相互リセプション: A の天体と B の天体が互いのサインの支配星・高揚星になっている組
+- コンポジット: 2人の天体・ASC・MC の中間点で作ったチャート（ChartSnapshot として作るので
+  ディグニティ・ハウス・アスペクトは1人分のレポートと同じ処理で出せる）
+
+各人のチャートは chart_engine.get_snapshot で1回だけ計算し（キャッシュ経由）、
+比較はすべてスナップショットの配列から作る。
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+from flatlib import const
+
+from astro_defs import EXALTATIONS, JP_NAMES, RULERS, SIGN_LIST, TRAD_P, get_planet_sect_status
+from aspect_engine import cross_aspects, find_aspects, make_points
+from chart_engine import (
+    ASP_NAMES, DEFAULT_TZ, get_snapshot, short_name,
+    render_compact_body, render_report_body,
+)
+from chart_model import SECT_CODES, ChartSnapshot, house_of
+from dignity_table import PLANET_INDEX, score_batch
+from metrics import span
+from selena import selena_from_lon
+
+# サイン番号 → 支配星・高揚星（TRAD_P 内の番号。高揚星のないサインは -1）
+RULER_IDX = np.array([TRAD_P.index(RULERS[s]) for s in SIGN_LIST], dtype=np.int8)
+EXALT_IDX = np.array([TRAD_P.index(EXALTATIONS[s]) if s in EXALTATIONS else -1 for s in SIGN_LIST], dtype=np.int8)
+
+RECEPTION_LABELS = {'domicile': "支配星どうし", 'exaltation': "高揚星どうし", 'mixed': "支配星と高揚星"}
+
+
+class Birth(NamedTuple):
+    """1人分の出生データ（get_snapshot の引数と同じ）。"""
+    name: str
+    date: object
+    time: object
+    lat: object
+    lon: object
+    tz: str = DEFAULT_TZ
+
+
+class Reception(NamedTuple):
+    a: str      # A の天体
+    b: str      # B の天体
+    kind: str   # RECEPTION_LABELS のキー
+
+
+class Synastry(NamedTuple):
+    a: ChartSnapshot
+    b: ChartSnapshot
+    cross: np.ndarray        # ASPECT_DTYPE（i は A、j は B の points 内の番号）
+    a_in_b: np.ndarray       # A の各天体が入る B のハウス
+    b_in_a: np.ndarray       # B の各天体が入る A のハウス
+    receptions: list
+    composite: ChartSnapshot
+
+
+# ==========================================
+# 1. 比較
+# ==========================================
+def overlay(snap, other):
+    """snap の天体（ASC・MC を除く）が other のホールサインの何ハウスに入るか。"""
+    return house_of(snap.sign_idx[:snap.n_objects], other.asc_idx).astype(np.int8)
+
+
+def _hosts(snap):
+    # 古典7天体それぞれの在住サインの支配星・高揚星（TRAD_P 内の番号）
+    signs = snap.sign_idx[snap.dig_idx]
+    return RULER_IDX[signs], EXALT_IDX[signs]
+
+
+def mutual_receptions(a, b):
+    """A の天体 i と B の天体 j が互いのサインの支配星（または高揚星）になっている組。"""
+    a_dom, a_exa = _hosts(a)
+    b_dom, b_exa = _hosts(b)
+    j = np.arange(len(TRAD_P))
+    # m[i, j]: A の i が B の j のサインにいて、B の j が A の i のサインにいる
+    a_dom_j, a_exa_j = a_dom[:, None] == j[None, :], a_exa[:, None] == j[None, :]
+    b_dom_i, b_exa_i = (b_dom[None, :] == j[:, None]), (b_exa[None, :] == j[:, None])
+    kinds = {
+        'domicile': a_dom_j & b_dom_i,
+        'exaltation': a_exa_j & b_exa_i,
+        'mixed': (a_dom_j & b_exa_i) | (a_exa_j & b_dom_i),
+    }
+    found = []
+    for kind, m in kinds.items():
+        np.fill_diagonal(m, False)  # 同じ天体どうしは両方とも自分のサインにいるだけ
+        for i, k in zip(*np.nonzero(m)):
+            found.append(Reception(TRAD_P[i], TRAD_P[k], kind))
+    found.sort(key=lambda r: (TRAD_P.index(r.a), TRAD_P.index(r.b)))
+    return found
+
+
+def midpoint(lon_a, lon_b):
+    """2つの黄経の近い側の中間点（配列可）。"""
+    diff = np.mod(np.asarray(lon_b) - np.asarray(lon_a) + 180.0, 360.0) - 180.0
+    return np.mod(np.asarray(lon_a) + diff / 2, 360.0)
+
+
+def composite_snapshot(a, b):
+    """2枚のチャートの中間点で作るコンポジット・チャート。
+
+    ハウスは中間点の ASC を第1ハウスとするホールサイン、昼夜は中間点の太陽の位置で決める。
+    逆行は意味を持たないので付けない。
+    """
+    if a.ids != b.ids:
+        raise ValueError("コンポジットには同じ天体リストのチャートが必要です")
+    ids, n_obj = a.ids, a.n_objects
+    lon = midpoint(a.lon, b.lon)
+    signlon = np.mod(lon, 30.0)
+    sign_idx = (lon // 30).astype(np.int8)
+    asc_idx = int(sign_idx[n_obj])
+    house = house_of(sign_idx, asc_idx).astype(np.int8)
+    is_day = bool(7 <= house[ids.index(const.SUN)] <= 12)
+    sect = np.array([SECT_CODES[get_planet_sect_status(p, is_day)] if k < n_obj else 0 for k, p in enumerate(ids)], dtype=np.int8)
+
+    sun, moon = lon[ids.index(const.SUN)], lon[ids.index(const.MOON)]
+    asc_lon = lon[n_obj]
+    pof_lon = float((asc_lon + moon - sun) % 360) if is_day else float((asc_lon + sun - moon) % 360)
+
+    # 度・分の丸めは出生図のセレナ（selena.py / get_selena_data）と同じにする
+    s_lon = float(midpoint(a.selena[4], b.selena[4]))
+    s = selena_from_lon(s_lon, asc_idx)
+    selena = (int(s.sign_idx), int(s.deg), int(s.minute), int(s.house), s_lon)
+
+    objects = ids[:n_obj]
+    dig_idx = np.array([objects.index(p) for p in TRAD_P if p in objects], dtype=np.int8)
+    dig_score, dig_mask = score_batch([PLANET_INDEX[ids[k]] for k in dig_idx], lon[dig_idx], is_day)
+
+    # 能動/受動の判定用の速度は2人の平均（惑星以外は -1 のまま）、オーブは天体ごとに同じ
+    speed = np.where(a.asp_points.speed < 0, -1.0, (a.asp_points.speed + b.asp_points.speed) / 2)
+    asp_points = make_points(ids, lon, speed, a.asp_points.orb)
+
+    return ChartSnapshot(
+        date_str=f"{a.date_str}×{b.date_str}", time_str="", tz="", is_day=is_day,
+        ids=ids, n_objects=n_obj, lon=lon, signlon=signlon, speed=np.zeros_like(lon),
+        sign_idx=sign_idx, house=house, retro=np.zeros(len(ids), dtype=bool), sect=sect,
+        asc_idx=asc_idx, house_sign_idx=((asc_idx + np.arange(12)) % 12).astype(np.int8),
+        pof_lon=pof_lon, selena=selena,
+        dig_idx=dig_idx, dig_score=dig_score, dig_mask=dig_mask,
+        aspects=find_aspects(asp_points), asp_points=asp_points,
+    )
+
+
+def compare(a, b):
+    """2枚の ChartSnapshot から Synastry を作る。"""
+    with span("synastry.compare"):
+        return Synastry(
+            a=a, b=b,
+            cross=cross_aspects(a.asp_points, b.asp_points),
+            a_in_b=overlay(a, b), b_in_a=overlay(b, a),
+            receptions=mutual_receptions(a, b),
+            composite=composite_snapshot(a, b),
+        )
+
+
+# ==========================================
+# 2. 相性用の計算データ
+# ==========================================
+def _point_label(snap, k):
+    p_id = snap.ids[k]
+    return f"{JP_NAMES.get(p_id, p_id)}（{snap.house[k]}ハウス）"
+
+
+def render_synastry(syn, name_a, name_b):
+    lines = ["【AI鑑定用 相性データ（シナストリー）】", f"A: {name_a} / B: {name_b}", "=" * 60]
+    for label, name, snap in (("A", name_a, syn.a), ("B", name_b, syn.b)):
+        lines += [f"■ {label}: {name} の出生図", *render_report_body(snap), ""]
+    def log(t): lines.append(t)
+
+    log("=" * 60)
+    log(f"\n【データ4: 相互アスペクト（A: {name_a} × B: {name_b}）】")
+    for x in syn.cross:
+        i, j, asp_type = x['i'], x['j'], int(x['type'])
+        log(f"A {_point_label(syn.a, i)} ｘ B {_point_label(syn.b, j)} {ASP_NAMES.get(asp_type, f'({asp_type})')}（誤差{x['orb']:.1f}）")
+    log("-" * 60)
+
+    log("\n【データ5: ハウス・オーバーレイ（相手のハウスに入る天体）】")
+    for label, snap, houses, other in (("A", syn.a, syn.a_in_b, "B"), ("B", syn.b, syn.b_in_a, "A")):
+        log(f"{label}の天体 → {other}のハウス: " + ", ".join(
+            f"{JP_NAMES.get(p, p)}→第{h}" for p, h in zip(snap.objects, houses)
+        ))
+    log("-" * 60)
+
+    log("\n【データ6: 相互リセプション（A と B の天体が互いのサインにいる組）】")
+    if syn.receptions:
+        for r in syn.receptions:
+            log(f"A {JP_NAMES[r.a]} ⇔ B {JP_NAMES[r.b]}（{RECEPTION_LABELS[r.kind]}）")
+    else:
+        log("なし")
+    log("-" * 60)
+
+    log("\n【データ7: コンポジット・チャート（2人の中間点）】")
+    # 先頭の「生年月日・チャート区分」と区切り線は1人分のチャート用なので差し替える
+    log(f"チャート区分: {'昼チャート (Day)' if syn.composite.is_day else '夜チャート (Night)'}")
+    lines += render_report_body(syn.composite)[2:]
+    return "\n".join(lines)
+
+
+def render_synastry_compact(syn, name_a, name_b):
+    lines = [f"A={name_a} B={name_b}"]
+    for label, snap in (("A", syn.a), ("B", syn.b)):
+        lines += [f"<{label}の出生図>", *render_compact_body(snap)]
+    def log(t): lines.append(t)
+
+    log("[データ4 相互アスペクト] A天体|A室|B天体|B室|角|誤差")
+    for x in syn.cross:
+        i, j = x['i'], x['j']
+        log(f"{short_name(syn.a.ids[i])}|{syn.a.house[i]}|{short_name(syn.b.ids[j])}|{syn.b.house[j]}|{int(x['type'])}|{x['orb']:.1f}")
+
+    log("[データ5 オーバーレイ] 天体|相手の室")
+    for label, snap, houses in (("A", syn.a, syn.a_in_b), ("B", syn.b, syn.b_in_a)):
+        log(f"{label}→" + " ".join(f"{short_name(p)}{h}" for p, h in zip(snap.objects, houses)))
+
+    log("[データ6 相互リセプション] A天体|B天体|種類")
+    for r in syn.receptions:
+        log(f"{short_name(r.a)}|{short_name(r.b)}|{RECEPTION_LABELS[r.kind]}")
+
+    log(f"<データ7 コンポジット> 区分={'昼' if syn.composite.is_day else '夜'}")
+    lines += render_compact_body(syn.composite)[1:]
+    return "\n".join(lines)
+
+
+# 鑑定用データの形式 → 作る関数（キーは chart_engine.REPORT_FORMATS と同じ）
+SYNASTRY_FORMATS = {'full': render_synastry, 'compact': render_synastry_compact}
+
+
+def build_synastry(birth_a, birth_b, hsys=const.HOUSES_WHOLE_SIGN, ids=None):
+    """2人の Birth から Synastry を作る（各人のチャートはキャッシュ経由で1回だけ計算）。"""
+    snaps = [get_snapshot(b.date, b.time, b.lat, b.lon, b.tz, hsys, ids) for b in (birth_a, birth_b)]
+    return compare(*snaps)
+
+
+def render_synastry_report(syn, name_a, name_b, fmt='full'):
+    """Synastry から鑑定用データを作る。fmt は SYNASTRY_FORMATS のキー。"""
+    with span("report.render", fmt=fmt, kind='synastry'):
+        return SYNASTRY_FORMATS[fmt](syn, name_a, name_b)
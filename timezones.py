@@ -0,0 +1,42 @@
+"""
+タイムゾーン（IANA 名）から、その日時の UTC オフセットを求める
+
+flatlib の Datetime には '+09:00' 形式のオフセットを渡すので、IANA のタイムゾーン名と
+出生日時から当時のオフセット（夏時間・過去の標準時の変更を含む）をここで決める。
+標準ライブラリの zoneinfo だけを使い、通信はしない（tz データベースが OS に無い環境では
+requirements.txt の tzdata パッケージが使われる）。
+"""
+import datetime
+import zoneinfo
+from functools import lru_cache
+
+DEFAULT_TZ_NAME = "Asia/Tokyo"
+
+
+@lru_cache(maxsize=None)
+def available_zones():
+    return sorted(zoneinfo.available_timezones())
+
+
+def format_offset(delta):
+    """timedelta を '+09:00' 形式にする（秒は分に丸める。地方平均時の半端な秒など）。"""
+    minutes = round(delta.total_seconds() / 60)
+    sign = '-' if minutes < 0 else '+'
+    hh, mm = divmod(abs(minutes), 60)
+    return f"{sign}{hh:02}:{mm:02}"
+
+
+def utc_offset(tz_name, input_date, input_time):
+    """tz_name の地域での input_date input_time（現地時間）の UTC オフセット（'+09:00' 形式）。
+
+    夏時間の切り替えで存在しない・重複する時刻は、切り替え前のオフセットとして扱う。
+    """
+    local = datetime.datetime.combine(input_date, input_time).replace(tzinfo=zoneinfo.ZoneInfo(tz_name))
+    return format_offset(local.utcoffset())
+
+
+def resolve_offset(tz, input_date, input_time):
+    """'+09:00' 形式ならそのまま、IANA 名（Asia/Tokyo など）ならその日時のオフセットにする。"""
+    if tz[:1] in ('+', '-'):
+        return tz
+    return utc_offset(tz, input_date, input_time)
@@ -0,0 +1,190 @@
+"""
+トランジット（経過天体）→ 出生図のイベント年表
+
+指定期間に起きる次のイベントの正確な時刻を求め、時刻順に並べて返す。
+
+- 経過天体と出生図の天体・ASC・MC とのメジャーアスペクトの成立（exact）
+- 経過天体のサイン移動（イングレス）
+- 経過天体の留（順行⇄逆行の切り替わり）
+
+毎日・毎時のサンプリングではなく、天体ごとの速さに合わせた粗い間隔で黄経と速度を取り、
+符号が変わる区間（ブラケット）だけを、速度を使った安全装置付きニュートン法で詰める。
+1回の暦計算で黄経と速度が同時に得られるので、1イベントあたり数回の計算で分単位に収束する。
+"""
+import heapq
+from typing import NamedTuple
+
+from flatlib import const
+from flatlib.datetime import Datetime
+from flatlib.ephem import swe
+
+from astro_defs import JP_NAMES, SIGN_LIST, TRAD_P
+
+# 経過天体ごとのサンプリング間隔（日）。逆行期間や1サインの滞在より十分短くとる
+SCAN_STEP = {
+    const.SUN: 10.0, const.MOON: 1.0, const.MERCURY: 4.0, const.VENUS: 5.0,
+    const.MARS: 5.0, const.JUPITER: 10.0, const.SATURN: 10.0,
+}
+# 月は1日に約13度動き、10年で数万件のイベントになるため既定では含めない
+DEFAULT_BODIES = [p for p in TRAD_P if p != const.MOON]
+NATAL_POINTS = TRAD_P + [const.ASC, const.MC]
+ASPECT_ANGLES = [const.CONJUNCTION, const.SEXTILE, const.SQUARE, const.TRINE, const.OPPOSITION]
+
+TOLERANCE = 1.0 / 1440   # 日（1分）
+MAX_ITER = 30
+
+
+class TransitEvent(NamedTuple):
+    jd: float
+    kind: str          # 'aspect' / 'ingress' / 'station'
+    body: str          # 経過天体
+    target: str = ""   # 出生図側の天体（aspect のみ）
+    aspect: int = -1   # アスペクト角（aspect のみ）
+    sign: str = ""     # 入るサイン（ingress）/ 留の位置のサイン（station）
+    lon: float = 0.0   # イベント時点の経過天体の黄経
+    retro: bool = False  # イベント時点で逆行中か（station では「逆行に入る」なら True）
+
+
+class Ephem:
+    """暦計算の呼び出し回数を数える薄いラッパー。"""
+
+    def __init__(self, body):
+        self.body = body
+        self.calls = 0
+
+    def __call__(self, jd):
+        self.calls += 1
+        obj = swe.sweObject(self.body, jd)
+        return obj['lon'], obj['lonspeed']
+
+
+def znorm(angle):
+    """角度の差を -180〜+180 度にそろえる。"""
+    angle = angle % 360
+    return angle if angle <= 180 else angle - 360
+
+
+def refine(f, a, b, fa, fb, tol=TOLERANCE):
+    """f(a), f(b) の符号が異なる区間で f(t)=0 を解く。f は (値, 微分) を返す。
+
+    ニュートン法の一歩が区間から出たり縮みが遅いときは二分法に切り替える。tol は日単位の精度。
+    """
+    # 両端の値から線形補間で初期値を取る
+    t = a + (b - a) * fa / (fa - fb) if fa != fb else (a + b) / 2
+    for _ in range(MAX_ITER):
+        ft, dt = f(t)
+        if ft == 0:
+            return t
+        if (ft < 0) == (fa < 0):
+            a, fa = t, ft
+        else:
+            b, fb = t, ft
+        if b - a < tol:
+            break
+        step = ft / dt if dt else None
+        nxt = t - step if step is not None else None
+        if nxt is None or not (a < nxt < b) or abs(step) > (b - a) / 2:
+            nxt = (a + b) / 2
+        if abs(nxt - t) < tol / 4:
+            return nxt
+        t = nxt
+    return (a + b) / 2 if b - a < tol else t
+
+
+def _body_events(body, jd_start, jd_end, natal, aspects):
+    eph = Ephem(body)
+    step = SCAN_STEP.get(body, 5.0)
+    targets = []
+    for name, lon in natal:
+        for asp in aspects:
+            angles = {asp % 360, (-asp) % 360}
+            for a in angles:
+                targets.append(('aspect', name, asp, (lon + a) % 360))
+    for i, sign in enumerate(SIGN_LIST):
+        targets.append(('ingress', '', -1, i * 30.0))
+
+    events = []
+    t0 = jd_start
+    lon0, spd0 = eph(t0)
+    while t0 < jd_end:
+        t1 = min(t0 + step, jd_end)
+        lon1, spd1 = eph(t1)
+
+        # 留：速度の符号の切り替わり（速度の導関数は差分で近似）
+        if (spd0 < 0) != (spd1 < 0):
+            accel = (spd1 - spd0) / (t1 - t0)
+            def g(t):
+                _, s = eph(t)
+                return s, accel
+            t = refine(g, t0, t1, spd0, spd1)
+            lon_t, _ = eph(t)
+            events.append(TransitEvent(t, 'station', body, sign=SIGN_LIST[int(lon_t // 30) % 12], lon=lon_t, retro=spd1 < 0))
+
+        # アスペクト成立とイングレス：経過天体の黄経が目標角を横切るところ
+        for kind, name, asp, target in targets:
+            f0 = znorm(lon0 - target)
+            f1 = znorm(lon1 - target)
+            if (f0 < 0) == (f1 < 0) or abs(f0 - f1) > 90:
+                continue  # 横切っていない / ±180度の折り返し
+
+            def f(t, target=target):
+                lon, s = eph(t)
+                return znorm(lon - target), s
+            t = refine(f, t0, t1, f0, f1)
+            lon_t, spd_t = eph(t)
+            retro = spd_t < 0
+            if kind == 'aspect':
+                events.append(TransitEvent(t, 'aspect', body, name, asp, lon=lon_t, retro=retro))
+            else:
+                entered = int(target // 30) if f1 > f0 else (int(target // 30) - 1) % 12
+                events.append(TransitEvent(t, 'ingress', body, sign=SIGN_LIST[entered], lon=lon_t, retro=retro))
+        t0, lon0, spd0 = t1, lon1, spd1
+
+    events.sort()
+    return events, eph.calls
+
+
+def natal_points(chart, ids=NATAL_POINTS):
+    """flatlib の Chart から出生図側の (ID, 黄経) を取り出す。"""
+    return [(i, chart.get(i).lon) for i in ids]
+
+
+def transit_timeline(natal_chart, start, end, bodies=None, aspects=None, stats=None):
+    """natal_chart に対する start〜end（flatlib の Datetime）のイベントを時刻順に返す。
+
+    stats に辞書を渡すと、天体ごとの暦計算の回数を書き込む。
+    """
+    natal = natal_points(natal_chart)
+    per_body = []
+    for body in bodies or DEFAULT_BODIES:
+        events, calls = _body_events(body, start.jd, end.jd, natal, aspects or ASPECT_ANGLES)
+        per_body.append(events)
+        if stats is not None:
+            stats[body] = calls
+    return list(heapq.merge(*per_body))
+
+
+# ==========================================
+# レポート用の整形
+# ==========================================
+ASPECT_LABELS = {const.CONJUNCTION: '(0度)', const.SEXTILE: '(60度)', const.SQUARE: '(90度)', const.TRINE: '(120度)', const.OPPOSITION: '(180度)'}
+
+
+def format_event(ev, tz='+09:00'):
+    dt = Datetime.fromJD(ev.jd, tz)
+    when = f"{dt.date.toString()} {dt.time.toString()[:5]}"
+    body = JP_NAMES.get(ev.body, ev.body)
+    retro = " (R)" if ev.retro and ev.kind != 'station' else ""
+    if ev.kind == 'aspect':
+        return f"{when} | {body}{retro} ｘ 出生の{JP_NAMES.get(ev.target, ev.target)} {ASPECT_LABELS.get(ev.aspect, f'({ev.aspect})')}"
+    if ev.kind == 'ingress':
+        return f"{when} | {body}{retro} → {JP_NAMES[ev.sign]}入り"
+    turn = "逆行開始" if ev.retro else "順行に戻る"
+    return f"{when} | {body} 留（{turn}） {JP_NAMES[ev.sign]} {int(ev.lon % 30):02}度"
+
+
+def render_timeline(events, tz='+09:00'):
+    """鑑定用データに追記できる形の行リストにする。"""
+    lines = ["\n【■ トランジット年表】"]
+    lines.extend(format_event(ev, tz) for ev in events)
+    return lines